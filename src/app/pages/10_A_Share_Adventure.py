@@ -17,21 +17,23 @@ import plotly.express as px
 # ========================== Cache ========================== #
 
 def update_cache():
-    data = []
-    for f in os.listdir(A_SHARE_CACHE_DIR):
-        if f.startswith('china_') and f.endswith('.csv'):
-            df = pd.read_csv(A_SHARE_CACHE_DIR/f)
-            data.append(df)
-    data = pd.concat(data)
-    data.to_parquet(A_SHARE_CACHE_DIR/'china.parquet')
+    # only the new or changed snapshot files are converted into the partitioned parquet store
+    n_files = biga.snapshot_store.ingest()
+    biga.materialize_metrics()
+    if n_files > 0:
+        load_cache.clear()
+        load_single_day_data.clear()
 
 @st.cache_data
 def load_cache():
-    return pd.read_parquet(A_SHARE_CACHE_DIR/'china.parquet')
+    return biga.snapshot_store.load(universe='CHINA')
 
 @st.cache_data
 def load_single_day_data(analysis_date):
-    stocks, etfs, foreign_etf = biga.load_data_cache_from_csv(dt=analysis_date.isoformat())
+    data = biga.load_data_cache(dt=analysis_date.isoformat())
+    if data is None:
+        return None
+    stocks, etfs, foreign_etf = data
     return stocks
 
 st.session_state['full_hist_data'] = None
@@ -43,6 +45,8 @@ biga = BigA()
 analysis_date = st.date_input('分析日期', value=None)
 if analysis_date is not None:
     st.session_state['stocks'] = load_single_day_data(analysis_date=analysis_date)
+    if st.session_state['stocks'] is None:
+        st.write(f"{analysis_date} 没有数据")
 
 
 # ========================== Main Workflow ========================== #
@@ -55,7 +55,7 @@ tab1, tab2, tab3 = st.tabs(["TradingView Data", "GS Healthcare Screener", "XBI/L
 with tab1:
 
     filtered_tv_df = filter_dataframe(
-        df=st.session_state['tradeview'].data_df.query(f"Date == '{dt}'"), 
+        df=df_filter(st.session_state['tradeview'].data_df, {'Date': dt}, view=True),
         default_cols=['Date','Ticker','Description','Price','Upcoming Earnings Date','Recent Earnings Date']
     )
     st.write(filtered_tv_df, use_container_width=True)
@@ -8,6 +8,9 @@ if str(ROOT_DIR) not in sys.path:
 import src.config as cfg
 import src.data.utils as hp
 from src.model.macro.dfm import DFMConfig, run_dfm_app
+from src.model.macro.dfm_cache import DFMFitCache
+from src.model.macro.dfm_search import spec_search, SpecSearchCache
+from src.model.macro.nowcast import Nowcaster
 
 import datetime
 import itertools
@@ -82,6 +85,45 @@ if uploaded_file is not None:
     st.write("Data Preview:")
     st.write(df.head())
 
+    mode = st.radio("Mode", ['DFM', 'Nowcast'], horizontal=True,
+                    help="Nowcast keeps missing values and mixes daily, weekly, monthly and quarterly series")
+    if mode == 'Nowcast':
+        numeric_cols = df.select_dtypes('number').columns.tolist()
+        quarterly_vars = st.multiselect("Quarterly series", numeric_cols)
+        target = st.selectbox("Nowcast target", quarterly_vars or numeric_cols)
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            nowcast_factors = st.number_input("Number of factors", 1, 10, 1)
+        with col2:
+            nowcast_order = st.number_input("Order of factor AR model", 1, 10, 1)
+        with col3:
+            how = st.selectbox("Monthly aggregation of higher frequency series", ['mean', 'last'])
+        monthly_df = df[[c for c in numeric_cols if c not in quarterly_vars]]
+        quarterly_df = df[quarterly_vars].dropna(how='all') if quarterly_vars else None
+
+        nowcaster = st.session_state.get('nowcaster')
+        same_panel = nowcaster is not None and nowcaster.variables == list(monthly_df.columns) + quarterly_vars
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Estimate nowcasting model"):
+                nowcaster = Nowcaster(monthly_df, quarterly_df, factors=nowcast_factors, factor_orders=nowcast_order,
+                                      how=how)
+                nowcaster.fit()
+                st.session_state['nowcaster'] = nowcaster
+        with col2:
+            # a new vintage of the same panel is filtered with the estimated parameters, no refit
+            if same_panel and st.button("Update with this file"):
+                news = nowcaster.update(monthly_df, quarterly_df, target=target)
+                st.write("Impact of the new releases")
+                st.dataframe(news.details_by_impact)
+
+        nowcaster = st.session_state.get('nowcaster')
+        if nowcaster is not None and target in nowcaster.variables:
+            st.metric(f"Nowcast of {target} ({nowcaster.monthly.index[-1]})", f"{nowcaster.nowcast(target):.4f}")
+            path = nowcaster.nowcasts(target, horizon=3)
+            st.plotly_chart(px.line(x=path.index.astype(str), y=path.values, labels={'x': 'month', 'y': target}))
+        st.stop()
+
     # Validate columns
     non_float_cols = [col for col in df.columns if df[col].dtype != 'float64' and col != 'date']
     if non_float_cols:
@@ -102,13 +144,36 @@ if uploaded_file is not None:
     available_vars = [col for col in df.columns if col != 'date']
     selected_vars = st.multiselect("Select Variables for DFM Analysis", available_vars, default=available_vars)
 
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns(4)
     with col1:
         k_factors = st.number_input("Number of unobserved factors", 1, 10, 1)
     with col2:
         factor_order = st.number_input("Order of factor AR model", 1, 10, 1)
     with col3:
         error_order = st.number_input("Order of AR errors", 1, 10, 1)
+    with col4:
+        backend = st.selectbox("Estimation", ['auto', 'statsmodels', 'pca'],
+                               help="pca: principal components and Kalman smoother, for panels of many series")
+
+    with st.expander("Specification search"):
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            search_k = st.multiselect("Number of factors", list(range(1, 11)), [1, 2])
+        with col2:
+            search_p = st.multiselect("Factor AR orders", list(range(1, 11)), [1, 2])
+        with col3:
+            search_q = st.multiselect("Error AR orders", list(range(0, 11)), [1])
+        with col4:
+            search_method = st.selectbox("Search", ['grid', 'halving'])
+        search_timeout = st.number_input("Timeout per fit (seconds)", 5, 3600, 60)
+        if st.button("Search specifications"):
+            # candidates already evaluated on this data are read from the cache
+            search = spec_search(df[selected_vars], k_factors=search_k, factor_orders=search_p,
+                                 error_orders=search_q, method=search_method, timeout=search_timeout,
+                                 cache=SpecSearchCache())
+            st.dataframe(search.ranking, hide_index=True)
+            st.write("ARIMA by variable")
+            st.dataframe(search.arima, hide_index=True)
 
     # Multi-select for metrics
     eval_metrics = st.multiselect("Evaluation Metrics",
@@ -118,10 +183,11 @@ if uploaded_file is not None:
     if st.button("Run DFM"):
         # Initialize DFM Configuration
         dfm_config = DFMConfig(data=df, k_factors=k_factors, factor_order=factor_order,
-                               error_order=error_order, variable_names=selected_vars)
+                               error_order=error_order, variable_names=selected_vars, backend=backend)
 
-        # Fit the model
-        fitted_model = dfm_config.run_DFM()
+        # Fit the model, unchanged data and settings are served from the fit cache
+        fitted_model = dfm_config.run_DFM(cache=DFMFitCache())
+        st.caption(f"DFM fit: {fitted_model.fit_status}")
         fitted_model.evaluate_insample()
         fitted_model.split_data(0.2)
         fitted_model.evaluate_outsample()
@@ -132,6 +198,8 @@ if uploaded_file is not None:
 
         st.write(fitted_model.in_sample_metrics)
         st.write(fitted_model.out_of_sample_metrics)
+        st.write("Residual diagnostics")
+        st.dataframe(fitted_model.diagnostics())
 
         st.stop()
         # Simple metrics-value pair table
@@ -12,23 +12,27 @@
 # Path: src/data/db_manager.py
 
 import os, sys, logging
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import src.config as cfg
 from src.utils.pandas_utils import df_filter, set_cols_numeric
 
 from sqlalchemy import Column
+from sqlalchemy import Index
 from sqlalchemy import Integer, String, Float, DateTime
 from sqlalchemy import MetaData
 from sqlalchemy import PrimaryKeyConstraint
 from sqlalchemy import Table
 from sqlalchemy import create_engine
 from sqlalchemy import delete
+from sqlalchemy import event
 from sqlalchemy import exc
 from sqlalchemy import insert
 from sqlalchemy import inspect
 from sqlalchemy import select
 from sqlalchemy import text
+from sqlalchemy import UniqueConstraint
 from sqlalchemy import update
 from sqlalchemy.orm import sessionmaker, declarative_base
 
@@ -85,6 +89,17 @@ class DBManager:
         self.tables = self.metadata.tables
         self.table_names = self.metadata.tables.keys()
 
+    def reflect_table(self, table_name: str) -> Table:
+        """
+        Load the definition of a table already in the database, e.g. created by an earlier run
+        :return: the table, or None when the database has no such table
+        """
+        if not inspect(self.engine).has_table(table_name):
+            return None
+        table = Table(table_name, self.metadata, autoload_with=self.engine, extend_existing=True)
+        self.refresh_tables()
+        return table
+
     def create_columns(self, columns: list) -> list:
         """
         Create a list of column objects from a list of tuples
@@ -100,7 +115,7 @@ class DBManager:
         Create a table
         """
         try:
-            if table_name in self.table_names:
+            if table_name in self.table_names or self.reflect_table(table_name) is not None:
                 logging.warning(f"Table {table_name} already exists.")
                 return
             table = Table(table_name, self.metadata, *columns)
@@ -121,7 +136,7 @@ class DBManager:
         :param primary_keys: a list of primary keys
         """
         try:
-            if table_name in self.table_names:
+            if table_name in self.table_names or self.reflect_table(table_name) is not None:
                 logging.warning(f"Table {table_name} already exists.")
                 return
 
@@ -312,4 +327,181 @@ class TradingViewDB(DBManager):
         self.create_table_from_df('universe', universe_setup_df)
 
     def populate_universe_table(self, universe_df: pd.DataFrame, filter_spec=None):
-        self.insert_data_from_df(table_name='universe', df=df_filter(df=universe_df, filter_dict=filter_spec))
\ No newline at end of file
+        self.insert_data_from_df(table_name='universe', df=df_filter(df=universe_df, filter_dict=filter_spec))
+
+
+class FinancialStatementDB(DBManager):
+    """
+    Financial statements stored as a fact table: one row per (ticker, item, date) with integer keys, an integer
+    yyyymmdd date and a float value. Ticker symbols and statement item names live once in their own dimension tables.
+    """
+
+    def __init__(self, db_name: str = 'yfinance') -> None:
+        super().__init__(db_name)
+        self.ticker_ids = {}
+        self.item_ids = {}
+        # the id caches hold dimension rows inserted by a transaction not committed yet
+        self._uncommitted_ids = False
+        event.listen(self.engine, 'commit', self._on_commit)
+        event.listen(self.engine, 'rollback', self._on_rollback)
+        self.create_fact_tables()
+
+    def _on_commit(self, connection) -> None:
+        self._uncommitted_ids = False
+
+    def _on_rollback(self, connection) -> None:
+        # the dimension rows inserted by the transaction are gone, so are their cached ids
+        if self._uncommitted_ids:
+            self.ticker_ids, self.item_ids = {}, {}
+            self._uncommitted_ids = False
+
+    def create_fact_tables(self) -> None:
+        """
+        Create the ticker and item dimension tables and the fact table, clustered on (ticker_id, item_id, date) and
+        indexed on (item_id, date) for cross-sectional queries.
+        """
+        try:
+            if 'financial_fact' in self.table_names:
+                return
+            ticker_dim = Table(
+                'ticker_dim', self.metadata,
+                Column('ticker_id', Integer, primary_key=True),
+                Column('ticker', String, nullable=False, unique=True)
+            )
+            item_dim = Table(
+                'financial_item', self.metadata,
+                Column('item_id', Integer, primary_key=True),
+                Column('statement', String, nullable=False),
+                Column('item', String, nullable=False),
+                UniqueConstraint('statement', 'item')
+            )
+            fact = Table(
+                'financial_fact', self.metadata,
+                Column('ticker_id', Integer, primary_key=True),
+                Column('item_id', Integer, primary_key=True),
+                Column('date', Integer, primary_key=True),
+                Column('value', Float),
+                sqlite_with_rowid=False
+            )
+            Index('ix_financial_fact_item_date', fact.c.item_id, fact.c.date)
+            self.metadata.create_all(self.engine, tables=[ticker_dim, item_dim, fact], checkfirst=True)
+            self.refresh_tables()
+            logging.info("Financial statement fact tables created successfully")
+        except exc.SQLAlchemyError as e:
+            logging.info(f"Error: {e}")
+            sys.exit(1)
+
+    @staticmethod
+    def encode_date(dates) -> np.ndarray:
+        """
+        Encode dates as yyyymmdd integers, 0 where the date is missing
+        """
+        dates = pd.DatetimeIndex(pd.to_datetime(dates, errors='coerce'))
+        encoded = dates.year * 10000 + dates.month * 100 + dates.day
+        return np.where(dates.isna(), 0, encoded).astype(np.int64)
+
+    @staticmethod
+    def decode_date(dates) -> pd.DatetimeIndex:
+        return pd.to_datetime(pd.Series(dates).astype(str), format='%Y%m%d')
+
+    @staticmethod
+    def statement_to_long(statement_df: pd.DataFrame, ticker: str) -> pd.DataFrame:
+        """
+        Reshape a wide statement (items x report dates, as served by yfinance) into long facts with one vectorized
+        pass, dropping missing values and undated columns.
+        :return: a dataframe with columns ticker, item, date (yyyymmdd int) and value
+        """
+        values = statement_df.to_numpy(dtype=float)
+        dates = FinancialStatementDB.encode_date(statement_df.columns)
+        n_items, n_dates = values.shape
+        facts = pd.DataFrame({
+            'ticker': ticker,
+            'item': np.repeat(statement_df.index.astype(str).to_numpy(), n_dates),
+            'date': np.tile(dates, n_items),
+            'value': values.ravel()
+        })
+        return facts[np.isfinite(facts['value'].to_numpy()) & (facts['date'].to_numpy() > 0)]
+
+    def _get_or_create_ids(self, connection, table_name: str, key_columns: list, keys: pd.DataFrame) -> dict:
+        """
+        Look up the integer ids of the given dimension keys, inserting the ones not seen before
+        """
+        table = self.tables[table_name]
+        id_column = [c for c in table.primary_key.columns][0]
+        keys = keys.drop_duplicates()
+        connection.execute(insert(table).prefix_with('OR IGNORE'), keys.to_dict(orient='records'))
+        result = connection.execute(select(id_column, *[table.c[k] for k in key_columns])).fetchall()
+        if len(key_columns) == 1:
+            return {row[1]: row[0] for row in result}
+        return {tuple(row[1:]): row[0] for row in result}
+
+    def load_statement_facts(self, statement: str, facts: pd.DataFrame, connection=None) -> int:
+        """
+        Upsert long facts (ticker, item, date, value) of one statement into the fact table
+        :param statement: name of the statement, e.g. 'quarterly_income_stmt'
+        :param facts: long facts as returned by statement_to_long, possibly for many tickers
+        :param connection: an open connection, to write as part of a larger transaction
+        :return: the number of facts written
+        """
+        if facts.empty:
+            return 0
+        if connection is None:
+            with self.engine.begin() as connection:
+                return self.load_statement_facts(statement, facts, connection)
+
+        new_tickers = facts['ticker'][~facts['ticker'].isin(list(self.ticker_ids))].unique()
+        if len(new_tickers) > 0:
+            self._uncommitted_ids = True
+            self.ticker_ids = self._get_or_create_ids(connection, 'ticker_dim', ['ticker'],
+                                                      pd.DataFrame({'ticker': new_tickers}))
+        item_keys = self.item_ids.setdefault(statement, {})
+        new_items = facts['item'][~facts['item'].isin(list(item_keys))].unique()
+        if len(new_items) > 0:
+            self._uncommitted_ids = True
+            ids = self._get_or_create_ids(connection, 'financial_item', ['statement', 'item'],
+                                          pd.DataFrame({'statement': statement, 'item': new_items}))
+            self.item_ids[statement] = {item: i for (stmt, item), i in ids.items() if stmt == statement}
+
+        records = pd.DataFrame({
+            'ticker_id': facts['ticker'].map(self.ticker_ids).to_numpy(dtype=np.int64),
+            'item_id': facts['item'].map(self.item_ids[statement]).to_numpy(dtype=np.int64),
+            'date': facts['date'].to_numpy(dtype=np.int64),
+            'value': facts['value'].to_numpy(dtype=float)
+        })
+        connection.execute(insert(self.tables['financial_fact']).prefix_with('OR REPLACE'),
+                           records.to_dict(orient='records'))
+        return len(records)
+
+    def query_cross_section(self, statement: str, item: str, date) -> pd.DataFrame:
+        """
+        Query one statement item for all tickers at a report date, e.g. revenue of every ticker for a quarter
+        :return: a dataframe with columns ticker and value
+        """
+        query = text("""
+            SELECT t.ticker, f.value
+            FROM financial_fact f
+            JOIN financial_item i ON i.item_id = f.item_id
+            JOIN ticker_dim t ON t.ticker_id = f.ticker_id
+            WHERE i.statement = :statement AND i.item = :item AND f.date = :date
+        """)
+        params = {'statement': statement, 'item': item, 'date': int(self.encode_date([date])[0])}
+        with self.engine.begin() as connection:
+            result = connection.execute(query, params).fetchall()
+        return pd.DataFrame(result, columns=['ticker', 'value'])
+
+    def query_statement(self, statement: str, ticker: str) -> pd.DataFrame:
+        """
+        Query one ticker's statement back into the wide layout served by yfinance (items x report dates)
+        """
+        query = text("""
+            SELECT i.item, f.date, f.value
+            FROM financial_fact f
+            JOIN financial_item i ON i.item_id = f.item_id
+            JOIN ticker_dim t ON t.ticker_id = f.ticker_id
+            WHERE i.statement = :statement AND t.ticker = :ticker
+        """)
+        with self.engine.begin() as connection:
+            result = connection.execute(query, {'statement': statement, 'ticker': ticker}).fetchall()
+        facts = pd.DataFrame(result, columns=['item', 'date', 'value'])
+        facts['date'] = self.decode_date(facts['date']).to_numpy()
+        return facts.pivot(index='item', columns='date', values='value')
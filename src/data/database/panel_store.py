@@ -0,0 +1,152 @@
+import json, logging
+from pathlib import Path
+logger = logging.getLogger(__name__)
+
+import numpy as np
+import pandas as pd
+
+
+# source tables of daily prices: long-format column names of the date, ticker, adjusted close and volume
+PRICE_SOURCES = {
+    # efinance quote history downloaded by BigA.download_a_share_historical (forward-adjusted by default)
+    'history_quote': {'date': '日期', 'ticker': '股票代码', 'close': '收盘', 'volume': '成交量'},
+    # yfinance history from script/build_yfinance_db_cache.py (close is split and dividend adjusted)
+    'historical_price': {'date': 'date', 'ticker': 'ticker', 'close': 'close', 'volume': 'volume'},
+}
+
+PANEL_DTYPES = {'close': 'float64', 'volume': 'float32', 'returns': 'float32'}
+
+
+class PanelStore:
+    """
+    Daily prices as dates x tickers matrices in .npy files, opened memory-mapped so that screening, factor and
+    correlation code can slice them without pivoting the long tables, and several processes share the same pages.
+
+    The directory holds one file per field (close, volume, returns), plus the index files dates.npy and tickers.npy and
+    a meta.json. Matrices are stored column-major so that the full history of a ticker is contiguous.
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = Path(root_dir)
+        self.meta = json.loads((self.root_dir / 'meta.json').read_text())
+        self.dates = pd.DatetimeIndex(np.load(self.root_dir / 'dates.npy').astype('datetime64[ns]'))
+        self.tickers = pd.Index(np.load(self.root_dir / 'tickers.npy'))
+        self.fields = self.meta['fields']
+        self._panels = {}
+
+    def __repr__(self):
+        return (f"PanelStore({self.root_dir}, {len(self.dates)} dates x {len(self.tickers)} tickers, "
+                f"fields={self.fields})")
+
+    @property
+    def shape(self):
+        return len(self.dates), len(self.tickers)
+
+    def panel(self, field: str) -> np.ndarray:
+        """
+        The read-only memory-mapped matrix of a field
+        """
+        if field not in self._panels:
+            if field not in self.fields:
+                raise KeyError(f"{field} not in panel store, available fields: {self.fields}")
+            self._panels[field] = np.load(self.root_dir / f"{field}.npy", mmap_mode='r')
+        return self._panels[field]
+
+    def _date_slice(self, start=None, end=None) -> slice:
+        start = 0 if start is None else self.dates.searchsorted(pd.Timestamp(start), side='left')
+        end = len(self.dates) if end is None else self.dates.searchsorted(pd.Timestamp(end), side='right')
+        return slice(start, end)
+
+    def ticker_loc(self, tickers) -> np.ndarray:
+        locs = self.tickers.get_indexer(tickers)
+        if (locs < 0).any():
+            missing = [t for t, loc in zip(tickers, locs) if loc < 0]
+            raise KeyError(f"Tickers not in panel store: {missing}")
+        return locs
+
+    def series(self, field: str, ticker: str, start=None, end=None) -> np.ndarray:
+        """
+        The history of one ticker as a zero-copy view on the memory map
+        """
+        rows = self._date_slice(start, end)
+        return self.panel(field)[rows, self.tickers.get_loc(ticker)]
+
+    def get(self, field: str, tickers=None, start=None, end=None) -> np.ndarray:
+        """
+        A dates x tickers block of a field. A date range over all tickers, or a contiguous range of tickers, is a
+        zero-copy view; picking a list of tickers copies the selected columns.
+        """
+        data = self.panel(field)[self._date_slice(start, end)]
+        if tickers is None:
+            return data
+        return data[:, self.ticker_loc(tickers)]
+
+    def frame(self, field: str, tickers=None, start=None, end=None) -> pd.DataFrame:
+        """
+        Same as get, labelled with dates and tickers
+        """
+        rows = self._date_slice(start, end)
+        columns = self.tickers if tickers is None else self.tickers[self.ticker_loc(tickers)]
+        return pd.DataFrame(self.get(field, tickers, start, end), index=self.dates[rows], columns=columns)
+
+    @classmethod
+    def build(cls, con, root_dir, table='history_quote', columns=None, chunksize=500000,
+              dtypes=None) -> 'PanelStore':
+        """
+        Build the panel store from a long-format price table. The date and ticker indexes come from two DISTINCT
+        queries, then the table is streamed in chunks straight into the memory maps, so that it is never pivoted in
+        memory. Returns are computed from the adjusted close, one block of tickers at a time.
+        :param con: a SQLAlchemy engine or connection, or a sqlite3 connection
+        :param root_dir: the directory to write the panel store to
+        :param table: the source table name, one of PRICE_SOURCES unless columns are given
+        :param columns: mapping of 'date', 'ticker', 'close', 'volume' to the column names in the table
+        :param chunksize: number of rows read per chunk
+        :param dtypes: dtype of each field, PANEL_DTYPES by default
+        """
+        columns = columns or PRICE_SOURCES[table]
+        dtypes = {**PANEL_DTYPES, **(dtypes or {})}
+        root_dir = Path(root_dir)
+        root_dir.mkdir(parents=True, exist_ok=True)
+        date_col, ticker_col = columns['date'], columns['ticker']
+
+        dates = pd.read_sql(f'SELECT DISTINCT "{date_col}" AS date FROM "{table}"', con)['date']
+        dates = pd.DatetimeIndex(pd.to_datetime(dates).unique()).sort_values()
+        tickers = pd.read_sql(f'SELECT DISTINCT "{ticker_col}" AS ticker FROM "{table}"', con)['ticker']
+        tickers = pd.Index(np.sort(tickers.astype(str).unique()))
+        shape = (len(dates), len(tickers))
+        logger.info(f"Building panel store of {shape[0]} dates x {shape[1]} tickers from {table}")
+
+        np.save(root_dir / 'dates.npy', np.asarray(dates, dtype='datetime64[D]'))
+        np.save(root_dir / 'tickers.npy', np.asarray(tickers, dtype=str))
+
+        fields = ['close', 'volume']
+        panels = {}
+        for field in fields + ['returns']:
+            panels[field] = np.lib.format.open_memmap(root_dir / f"{field}.npy", mode='w+', dtype=dtypes[field],
+                                                      shape=shape, fortran_order=True)
+            panels[field][:] = np.nan
+
+        query = (f'SELECT "{date_col}" AS date, "{ticker_col}" AS ticker, '
+                 + ', '.join(f'"{columns[f]}" AS {f}' for f in fields) + f' FROM "{table}"')
+        n_rows = 0
+        for chunk in pd.read_sql(query, con, chunksize=chunksize):
+            rows = dates.get_indexer(pd.to_datetime(chunk['date']))
+            cols = tickers.get_indexer(chunk['ticker'].astype(str))
+            for field in fields:
+                panels[field][rows, cols] = pd.to_numeric(chunk[field], errors='coerce').to_numpy()
+            n_rows += len(chunk)
+
+        # simple returns since the previous bar of each ticker, across suspended days
+        block = max(1, chunksize // max(shape[0], 1))
+        for start in range(0, shape[1], block):
+            close = pd.DataFrame(panels['close'][:, start:start + block])
+            panels['returns'][:, start:start + block] = close.ffill().pct_change(fill_method=None).where(close.notna())
+
+        for panel in panels.values():
+            panel.flush()
+        meta = {'source': table, 'columns': columns, 'fields': list(panels.keys()), 'dtypes': dtypes,
+                'rows': n_rows, 'shape': list(shape), 'built_at': pd.Timestamp.now().isoformat()}
+        (root_dir / 'meta.json').write_text(json.dumps(meta, ensure_ascii=False, indent=2))
+        del panels
+        logger.info(f"Loaded {n_rows} rows into the panel store at {root_dir}")
+        return cls(root_dir)
@@ -0,0 +1,157 @@
+import time, datetime, logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+logger = logging.getLogger(__name__)
+
+import pandas as pd
+
+
+HISTORY_TABLE = 'history_quote'
+STATE_TABLE = 'history_quote_state'
+TICKER_COL = '股票代码'
+DATE_COL = '日期'
+
+
+class EfinanceQuoteSource:
+    """
+    Daily A-share quote history from efinance (forward-adjusted). Any object with the same get_quote_history method,
+    e.g. one serving local files, can replace it.
+    """
+
+    def get_quote_history(self, code: str, beg: str = '19000101') -> pd.DataFrame:
+        import efinance as ef
+        return ef.stock.get_quote_history(stock_codes=code, beg=beg)
+
+
+# ========================== State Table ========================== #
+
+def _has_table(conn, table_name: str) -> bool:
+    query = "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?"
+    return conn.execute(query, (table_name,)).fetchone() is not None
+
+
+def create_state_table(conn) -> None:
+    with conn:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                {TICKER_COL} TEXT PRIMARY KEY,
+                last_date TEXT,
+                rows INTEGER,
+                updated_at TEXT
+            )
+        """)
+
+
+def load_state(conn) -> dict:
+    """
+    Get the last stored date of every ticker from the state table. The first time, the state table is seeded from the
+    history table with a single GROUP BY, so existing databases are not downloaded again.
+    :return: a dictionary of ticker -> last stored date (YYYY-MM-DD)
+    """
+    create_state_table(conn)
+    state = dict(conn.execute(f"SELECT {TICKER_COL}, last_date FROM {STATE_TABLE}").fetchall())
+    if state or not _has_table(conn, HISTORY_TABLE):
+        return state
+
+    logger.info(f"Seeding {STATE_TABLE} from {HISTORY_TABLE}")
+    now = datetime.datetime.now().isoformat()
+    with conn:
+        conn.execute(f"""
+            INSERT INTO {STATE_TABLE} ({TICKER_COL}, last_date, rows, updated_at)
+            SELECT {TICKER_COL}, MAX({DATE_COL}), COUNT(*), ? FROM {HISTORY_TABLE} GROUP BY {TICKER_COL}
+        """, (now,))
+    return dict(conn.execute(f"SELECT {TICKER_COL}, last_date FROM {STATE_TABLE}").fetchall())
+
+
+# ========================== Download ========================== #
+
+def fetch_quote_history(source, code: str, last_date: str = None) -> pd.DataFrame:
+    """
+    Download the bars of one ticker after its last stored date, or its full history. Runs inside the worker pool, so it
+    must not touch the database.
+    """
+    if last_date is None:
+        return source.get_quote_history(code)
+    beg = (pd.Timestamp(last_date) + pd.Timedelta(days=1)).strftime('%Y%m%d')
+    df = source.get_quote_history(code, beg=beg)
+    # sources are not trusted to honour beg, stored bars must not be appended twice
+    return df[df[DATE_COL].astype(str) > last_date]
+
+
+def write_batch(conn, frames: list, state_rows: list) -> int:
+    """
+    Append the buffered frames of several tickers and update their state rows in one transaction, so the state never
+    runs ahead of the committed history.
+    :return: the number of rows written
+    """
+    frames = [df for df in frames if not df.empty]
+    batch = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    with conn:
+        if not batch.empty:
+            if not _has_table(conn, HISTORY_TABLE):
+                conn.execute(pd.io.sql.get_schema(batch, HISTORY_TABLE))
+            # write in the column order of the existing table, as to_sql created it
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({HISTORY_TABLE})")]
+            batch = batch.reindex(columns=columns)
+            batch = batch.astype(object).where(batch.notna(), None)
+            column_list = ', '.join('"' + c + '"' for c in columns)
+            query = f"INSERT INTO {HISTORY_TABLE} ({column_list}) VALUES ({', '.join('?' * len(columns))})"
+            conn.executemany(query, batch.itertuples(index=False, name=None))
+        conn.executemany(f"""
+            INSERT INTO {STATE_TABLE} ({TICKER_COL}, last_date, rows, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT({TICKER_COL}) DO UPDATE SET
+                last_date = COALESCE(excluded.last_date, last_date),
+                rows = rows + excluded.rows,
+                updated_at = excluded.updated_at
+        """, state_rows)
+    return len(batch)
+
+
+def download_history_quote(conn, codes: list, source=None, max_workers: int = 8, batch_size: int = 50,
+                           incremental: bool = True, desc: str = '下载历史行情') -> dict:
+    """
+    Download the daily history of the given tickers with a pool of workers and append it to the history_quote table in
+    batches, tracking the last stored date of every ticker in the history_quote_state table.
+    :param conn: sqlite3 connection to the A-share database
+    :param codes: list of six-digit tickers
+    :param source: quote source with a get_quote_history(code, beg) method, efinance by default
+    :param max_workers: number of download threads
+    :param batch_size: number of tickers buffered before a write
+    :param incremental: fetch the bars after the last stored date of already stored tickers, instead of skipping them
+    :return: a dictionary of run statistics
+    """
+    source = source or EfinanceQuoteSource()
+    state = load_state(conn)
+    codes = list(dict.fromkeys(codes))
+    pending = codes if incremental else [c for c in codes if c not in state]
+
+    stats = {'tickers': 0, 'skipped': len(codes) - len(pending), 'failed': 0, 'rows': 0, 'elapsed': 0.0}
+    frames, state_rows = [], []
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_quote_history, source, code, state.get(code)): code for code in pending}
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+            code = futures[future]
+            try:
+                df = future.result()
+            except Exception as e:
+                logger.exception(f"Failed to download history of {code}: {e}")
+                stats['failed'] += 1
+                continue
+
+            last_date = str(df[DATE_COL].max()) if not df.empty else None
+            frames.append(df)
+            state_rows.append((code, last_date, len(df), datetime.datetime.now().isoformat()))
+
+            if len(state_rows) >= batch_size:
+                stats['rows'] += write_batch(conn, frames, state_rows)
+                stats['tickers'] += len(state_rows)
+                frames, state_rows = [], []
+
+    if state_rows:
+        stats['rows'] += write_batch(conn, frames, state_rows)
+        stats['tickers'] += len(state_rows)
+
+    stats['elapsed'] = time.perf_counter() - start
+    return stats
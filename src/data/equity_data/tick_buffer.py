@@ -0,0 +1,203 @@
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+import numpy as np
+import pandas as pd
+
+
+class TickRingBuffer:
+    """
+    Fixed-size ring buffer of intraday ticks for one ticker, backed by preallocated NumPy arrays. Once full, the oldest
+    ticks are overwritten.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self.timestamps = np.empty(capacity, dtype='datetime64[us]')
+        self.prices = np.full(capacity, np.nan)
+        self.volumes = np.full(capacity, np.nan)
+        self.count = 0      # number of ticks ever appended
+        self.flushed = 0    # number of ticks ever handed to the flusher
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, price, volume=np.nan):
+        i = self.count % self.capacity
+        self.timestamps[i] = np.datetime64(timestamp, 'us')
+        self.prices[i] = price
+        self.volumes[i] = volume
+        self.count += 1
+
+    def extend(self, timestamps, prices, volumes=None):
+        prices = np.asarray(prices, dtype=float)
+        n = len(prices)
+        timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+        volumes = np.full(n, np.nan) if volumes is None else np.asarray(volumes, dtype=float)
+        keep = min(n, self.capacity)
+        positions = (self.count + n - keep + np.arange(keep)) % self.capacity
+        self.timestamps[positions] = timestamps[n - keep:]
+        self.prices[positions] = prices[n - keep:]
+        self.volumes[positions] = volumes[n - keep:]
+        self.count += n
+
+    def _positions(self, n: int) -> np.ndarray:
+        """
+        Array positions of the last n ticks, oldest first
+        """
+        n = min(n, len(self))
+        return (self.count - n + np.arange(n)) % self.capacity
+
+    def latest(self, n: int = 1) -> pd.DataFrame:
+        """
+        The last n ticks, oldest first
+        """
+        positions = self._positions(n)
+        return pd.DataFrame({
+            'datetime': self.timestamps[positions],
+            'price': self.prices[positions],
+            'volume': self.volumes[positions]
+        })
+
+    def rolling_stats(self, window: int) -> dict:
+        """
+        Summary statistics over the last `window` ticks, computed on the arrays directly
+        """
+        positions = self._positions(window)
+        prices = self.prices[positions]
+        volumes = self.volumes[positions]
+        if len(prices) == 0:
+            return {'n': 0, 'last': np.nan, 'mean': np.nan, 'std': np.nan, 'min': np.nan, 'max': np.nan,
+                    'vwap': np.nan}
+        traded = np.isfinite(volumes) & np.isfinite(prices)
+        volume_total = volumes[traded].sum()
+        return {
+            'n': len(prices),
+            'last': prices[-1],
+            'mean': np.nanmean(prices),
+            'std': np.nanstd(prices, ddof=1) if len(prices) > 1 else np.nan,
+            'min': np.nanmin(prices),
+            'max': np.nanmax(prices),
+            'vwap': (prices[traded] * volumes[traded]).sum() / volume_total if volume_total > 0 else np.nan
+        }
+
+    def drain(self):
+        """
+        Hand over the ticks appended since the last drain, oldest first. Ticks overwritten before they could be drained
+        are counted and dropped.
+        :return: the unflushed ticks as a dataframe and the number of dropped ticks
+        """
+        pending = self.count - self.flushed
+        dropped = max(pending - self.capacity, 0)
+        output = self.latest(pending - dropped)
+        self.flushed = self.count
+        return output, dropped
+
+
+class TickBufferStore:
+    """
+    Thread-safe collection of one TickRingBuffer per ticker. Writers (the price sampler, the option cache) append, readers
+    such as a live dashboard query the latest ticks and rolling statistics without touching the database.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self.buffers = {}
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def _get_buffer(self, ticker) -> TickRingBuffer:
+        if ticker not in self.buffers:
+            self.buffers[ticker] = TickRingBuffer(self.capacity)
+        return self.buffers[ticker]
+
+    def append(self, ticker, timestamp, price, volume=np.nan):
+        with self._lock:
+            self._get_buffer(ticker).append(timestamp, price, volume)
+
+    def extend(self, ticker, timestamps, prices, volumes=None):
+        with self._lock:
+            self._get_buffer(ticker).extend(timestamps, prices, volumes)
+
+    def latest(self, ticker, n: int = 1) -> pd.DataFrame:
+        with self._lock:
+            if ticker not in self.buffers:
+                return pd.DataFrame(columns=['datetime', 'price', 'volume'])
+            return self.buffers[ticker].latest(n)
+
+    def latest_prices(self) -> pd.Series:
+        """
+        The last price of every ticker
+        """
+        with self._lock:
+            return pd.Series({tic: buf.prices[(buf.count - 1) % buf.capacity] for tic, buf in self.buffers.items()
+                              if buf.count > 0}, dtype=float)
+
+    def rolling_stats(self, window: int, tickers=None) -> pd.DataFrame:
+        """
+        Rolling statistics over the last `window` ticks, one row per ticker
+        """
+        with self._lock:
+            tickers = list(self.buffers.keys()) if tickers is None else tickers
+            return pd.DataFrame({tic: self.buffers[tic].rolling_stats(window) for tic in tickers
+                                 if tic in self.buffers}).T
+
+    def drain(self) -> pd.DataFrame:
+        """
+        Collect the unflushed ticks of all tickers into one long dataframe (ticker, datetime, price, volume)
+        """
+        with self._lock:
+            dflist = []
+            for tic, buf in self.buffers.items():
+                df, dropped = buf.drain()
+                if dropped > 0:
+                    logger.warning(f"{dropped} ticks of {tic} were overwritten before being flushed")
+                    self.dropped += dropped
+                if not df.empty:
+                    dflist.append(df.assign(ticker=tic))
+        if len(dflist) == 0:
+            return pd.DataFrame(columns=['ticker', 'datetime', 'price', 'volume'])
+        return pd.concat(dflist, ignore_index=True)[['ticker', 'datetime', 'price', 'volume']]
+
+
+class TickFlusher(threading.Thread):
+    """
+    Background thread persisting the ticks of a TickBufferStore every `interval` seconds through `write_fn`, which
+    receives one long dataframe per flush. A batch that fails to write is retried on the next flush.
+    """
+
+    def __init__(self, store: TickBufferStore, write_fn, interval: float = 5.0):
+        super().__init__(daemon=True)
+        self.store = store
+        self.write_fn = write_fn
+        self.interval = interval
+        self.pending = None
+        self._stop_event = threading.Event()
+
+    def flush(self) -> int:
+        ticks = self.store.drain()
+        if self.pending is not None:
+            ticks = pd.concat([self.pending, ticks], ignore_index=True)
+            self.pending = None
+        if ticks.empty:
+            return 0
+        try:
+            self.write_fn(ticks)
+        except Exception as e:
+            logger.exception(f"Failed to flush {len(ticks)} ticks, retrying on the next flush: {e}")
+            self.pending = ticks
+            return 0
+        return len(ticks)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def stop(self, timeout=None):
+        """
+        Stop the thread after a final flush
+        """
+        self._stop_event.set()
+        self.join(timeout)
@@ -4,6 +4,7 @@ import numpy as np
 
 import src.config as cfg
 from src.data.database.db_manager import TradingViewDB
+from src.data.equity_data.tv_snapshots import SnapshotStore
 from src.utils.pandas_utils import df_filter, set_cols_numeric
 from src.utils.general_utils import assign_market_cap_group, check_group_by_input
 import plotly.express as px
@@ -28,6 +29,10 @@ tv_univ_label_to_keys = {
 }
 tv_univ_keys_to_labels = {v: k for k, v in tv_univ_label_to_keys.items()}
 
+# derived columns of BigA.prepare_metrics, materialized per snapshot under the name below
+BIGA_METRICS = 'biga_metrics'
+BIGA_METRIC_COLUMNS = ['ytd_cost', 'CostLE10', 'logPrice', 'logYTDCost', 'logVol', 'SharpRatio']
+
 
 category_dict = {
     "General Meta": [
@@ -282,6 +287,8 @@ class BigA(TradingView):
             'csi_industry_map': self.csi_industry_map,
             'csi_tic_name_map': self.csi_tic_name_map
         }
+        self.snapshot_store = SnapshotStore(raw_dir=cfg.TV_CACHE_DIR/'raw'/'china',
+                                            root_dir=cfg.TV_CACHE_DIR/'china_snapshots')
 
     def get_csi_meta_map(self):
         import src.meta.ashare_params as ashare_meta
@@ -316,30 +323,46 @@ class BigA(TradingView):
             logger.error(f"Failed to populate asset tags: {e}")
             return
 
-    @staticmethod
-    def download_a_share_historical(db_path, stocks):
-        import datetime
-        today = datetime.datetime.today().strftime('%Y-%m-%d')
+    def load_data_cache(self, dt=None, start=None, end=None):
+        """
+        Load the snapshots of one date, or of a date range, from the partitioned parquet store. The CSV exports get
+        there through self.snapshot_store.ingest(); exports not ingested yet are ingested on the first miss.
+        """
+        data = self.snapshot_store.load(dt=dt, start=start, end=end, metrics=BIGA_METRICS)
+        if data is None and self.snapshot_store.ingest() > 0:
+            data = self.snapshot_store.load(dt=dt, start=start, end=end, metrics=BIGA_METRICS)
+        if data is None:
+            logger.info(f"No data found for {dt or (start, end)}")
+            return None
+        try:
+            logger.info("Populating asset tags...")
+            return BigA.define_asset_tags(data, **self.asset_tag_supplement_data)
+        except Exception as e:
+            logger.error(f"Failed to populate asset tags: {e}")
+            return
 
+    @staticmethod
+    def download_a_share_historical(db_path, stocks, source=None, incremental=True, max_workers=8, batch_size=50):
+        """
+        下载A股日线历史行情到 history_quote 表。多线程并发下载，按批写入，每只股票的最新日期记录在
+        history_quote_state 表中，增量模式下只下载最新日期之后的行情。
+        :param db_path: the sqlite database path
+        :param stocks: dataframe of the stocks to download, with a `tic` column of six-digit tickers
+        :param source: quote source with a get_quote_history(code, beg) method, efinance by default
+        :param incremental: fetch new bars of already stored tickers instead of skipping them
+        :return: a dictionary of run statistics
+        """
         import sqlite3
+        from src.data.equity_data.ashare_history import download_history_quote
         conn = sqlite3.connect(db_path)
-
-        # 从数据库中读取已经下载的股票代码
-        query = f"""
-        SELECT DISTINCT 股票代码 FROM history_quote
-        """
-        df = pd.read_sql(query, conn)
-        cached_tickers=df['股票代码'].values.tolist()
-
-        stocks_to_download = stocks[~stocks.tic.isin(cached_tickers)]
-
-        from tqdm import tqdm
-        import efinance as ef
-        with tqdm(total=stocks_to_download.shape[0], desc="下载历史行情") as pbar:
-            for i, row in stocks_to_download.iterrows():
-                df = ef.stock.get_quote_history(stock_codes=row.tic)
-                df.to_sql('history_quote', conn, if_exists='append', index=False)
-                pbar.update(1)
+        try:
+            stats = download_history_quote(conn, stocks.tic.tolist(), source=source, max_workers=max_workers,
+                                           batch_size=batch_size, incremental=incremental)
+        finally:
+            conn.close()
+        logger.info(f"Downloaded {stats['rows']} bars of {stats['tickers']} stocks in {stats['elapsed']:.1f}s, "
+                    f"{stats['failed']} failed")
+        return stats
 
     @staticmethod
     def define_asset_tags(data: pd.DataFrame, **kwargs):
@@ -410,15 +433,74 @@ class BigA(TradingView):
                 grouped_mean = grouped_mean.reset_index()
         return grouped_mean
 
+    @staticmethod
+    def compute_metrics(stocks):
+        """
+        The derived columns of prepare_metrics, computed on whole columns at once
+        """
+        price = stocks['Price'].to_numpy(dtype=float)
+        ytd = stocks['YTD Performance'].to_numpy(dtype=float)
+        volatility = stocks['Volatility'].to_numpy(dtype=float)
+        ytd_cost = price * (1 + ytd / 100)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharp_ratio = ytd / volatility
+            return pd.DataFrame({
+                'ytd_cost': ytd_cost,
+                'CostLE10': ytd_cost <= 10,
+                'logPrice': np.log(price),
+                'logYTDCost': np.log(ytd_cost),
+                'logVol': sharp_ratio,
+                'SharpRatio': sharp_ratio
+            }, index=stocks.index)
+
     @staticmethod
     def prepare_metrics(stocks):
-        return stocks\
-            .assign(ytd_cost=lambda x: x['Price']*x['YTD Performance'].apply(lambda y: 1+y/100))\
-            .assign(CostLE10=lambda x: x['ytd_cost']<=10) \
-            .assign(logPrice=lambda x: np.log(x['Price'])) \
-            .assign(logYTDCost=lambda x: np.log(x['ytd_cost']))\
-            .assign(logVol=lambda x: x['YTD Performance']/x['Volatility'])\
-            .assign(SharpRatio=lambda x: x['YTD Performance']/x['Volatility'])
+        # snapshots loaded through load_data_cache already carry the materialized metrics, except the snapshots
+        # ingested since the last materialize_metrics, whose joined metric columns are empty
+        if set(BIGA_METRIC_COLUMNS).issubset(stocks.columns):
+            missing = stocks[BIGA_METRIC_COLUMNS].isna().all(axis=1)
+            if not missing.any():
+                return stocks
+            stocks = stocks.copy()
+            computed = BigA.compute_metrics(stocks.loc[missing]).reindex(stocks.index)
+            stocks[BIGA_METRIC_COLUMNS] = stocks[BIGA_METRIC_COLUMNS].mask(missing, computed, axis=0)
+            return stocks
+        return pd.concat([stocks.drop(columns=BIGA_METRIC_COLUMNS, errors='ignore'), BigA.compute_metrics(stocks)],
+                         axis=1)
+
+    def materialize_metrics(self):
+        """
+        Compute the metrics of every snapshot not materialized yet and store them next to it
+        """
+        return self.snapshot_store.materialize(BIGA_METRICS, BigA.compute_metrics,
+                                               columns=['Price', 'YTD Performance', 'Volatility'])
+
+    def metric_panel(self, metric='SharpRatio', start=None, end=None, time='close', universe='CHINA'):
+        """
+        Dates x tickers panel of a materialized metric, for cross-date studies
+        """
+        df = self.snapshot_store.load_metrics(BIGA_METRICS, start=start, end=end, time=time, universe=universe,
+                                              columns=['Ticker', 'Date', metric])
+        if df is None:
+            return None
+        return df.pivot_table(index='Date', columns='Ticker', values=metric, aggfunc='last')
+
+    @staticmethod
+    def rolling_rank(panel, window=5):
+        """
+        Cross-sectional percentile rank of each ticker (1/n for the best, 1 for the worst), averaged over the last
+        `window` dates
+        """
+        return panel.rank(axis=1, ascending=False, pct=True).rolling(window, min_periods=1).mean()
+
+    @staticmethod
+    def top_name_persistence(panel, top_n=100):
+        """
+        Share of the top_n names of each date that are still in the top_n on the next date
+        """
+        top = (panel.rank(axis=1, ascending=False, method='first') <= top_n).to_numpy()
+        kept = (top[1:] & top[:-1]).sum(axis=1) / np.maximum(top[:-1].sum(axis=1), 1)
+        return pd.Series(kept, index=panel.index[1:], name='persistence')
 
     @staticmethod
     def top_sharp_ratios(stocks):
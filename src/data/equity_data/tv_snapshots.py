@@ -0,0 +1,212 @@
+import os, re, json, logging
+from pathlib import Path
+logger = logging.getLogger(__name__)
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+import src.config as cfg
+
+
+# raw TradingView screener exports are named <universe>_<date>[_<time>].csv
+SNAPSHOT_FILE_PATTERN = re.compile(r'^(?P<universe>[a-z0-9\-]+)_(?P<date>\d{4}-\d{2}-\d{2})(?:_(?P<time>[^.]+))?\.csv$')
+PARTITION_COLUMNS = ['Date', 'Time']
+# text columns of the exports; every other column is stored as float64
+STRING_COLUMNS = ['Ticker', 'Description', 'Sector', 'Industry', 'Country', 'Exchange', 'Technical Rating',
+                  'Recent Earnings Date', 'Upcoming Earnings Date', 'Universe']
+
+
+class SnapshotStore:
+    """
+    Partitioned parquet dataset of the daily TradingView snapshots of one market, laid out as
+    Date=<date>/Time=<time>/<universe>.parquet. New or changed CSV exports are ingested incrementally; loads of one day
+    or a date range are answered from the partitions with predicate pushdown, without touching the CSV files.
+
+    Column types are fixed the first time a column is ingested and recorded in _manifest.json together with the
+    ingested files, so that every partition shares one schema.
+    """
+
+    def __init__(self, raw_dir=cfg.TV_CACHE_DIR / 'raw' / 'china', root_dir=cfg.TV_CACHE_DIR / 'china_snapshots'):
+        self.raw_dir = Path(raw_dir)
+        self.root_dir = Path(root_dir)
+        self.manifest_path = self.root_dir / '_manifest.json'
+        self.manifest = self._read_manifest()
+        self._dataset = None
+
+    def _read_manifest(self):
+        if not self.manifest_path.exists():
+            return {'files': {}, 'schema': {}}
+        return json.loads(self.manifest_path.read_text(encoding='utf-8'))
+
+    def _write_manifest(self):
+        self.manifest_path.write_text(json.dumps(self.manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    @staticmethod
+    def parse_filename(file_name: str):
+        """
+        :return: (universe, date, time) of a snapshot file, None when the file is not a snapshot
+        """
+        match = SNAPSHOT_FILE_PATTERN.match(file_name)
+        if match is None:
+            return None
+        return match.group('universe'), match.group('date'), match.group('time') or 'close'
+
+    def _conform(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Cast the columns to the types recorded in the manifest, recording the types of new columns
+        """
+        schema = self.manifest['schema']
+        output = {}
+        for c in df.columns:
+            if c not in schema:
+                schema[c] = 'string' if c in STRING_COLUMNS else 'float64'
+            if schema[c] == 'string':
+                output[c] = df[c].astype(object).map(lambda x: None if pd.isna(x) else str(x))
+            else:
+                output[c] = pd.to_numeric(df[c], errors='coerce').astype('float64')
+        # built in one go, the exports have well over a hundred columns
+        return pd.DataFrame(output, index=df.index)
+
+    def schema(self) -> pa.Schema:
+        types = {'string': pa.string(), 'float64': pa.float64()}
+        fields = [pa.field(c, types[t]) for c, t in self.manifest['schema'].items()]
+        return pa.schema(fields + [pa.field(c, pa.string()) for c in PARTITION_COLUMNS])
+
+    def pending_files(self) -> list:
+        """
+        Snapshot files not ingested yet, or changed since they were ingested
+        """
+        pending = []
+        for f in sorted(os.listdir(self.raw_dir)):
+            if self.parse_filename(f) is None:
+                continue
+            stat = os.stat(self.raw_dir / f)
+            record = self.manifest['files'].get(f)
+            if record is None or record['size'] != stat.st_size or record['mtime'] != stat.st_mtime:
+                pending.append(f)
+        return pending
+
+    def ingest(self) -> int:
+        """
+        Convert the new or changed CSV exports into their partitions.
+        :return: the number of files ingested
+        """
+        pending = self.pending_files()
+        for f in pending:
+            universe, dt, time = self.parse_filename(f)
+            df = pd.read_csv(self.raw_dir / f, dtype={'Ticker': str})
+            df = self._conform(pd.concat([df, pd.Series(universe.upper(), index=df.index, name='Universe')], axis=1))
+            partition_dir = self.root_dir / f"Date={dt}" / f"Time={time}"
+            partition_dir.mkdir(parents=True, exist_ok=True)
+            df.to_parquet(partition_dir / f"{universe}.parquet", index=False)
+            stat = os.stat(self.raw_dir / f)
+            self.manifest['files'][f] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'rows': len(df),
+                                         'date': dt, 'time': time, 'universe': universe.upper()}
+            logger.info(f"Ingested {f} ({len(df)} rows)")
+        if pending:
+            self.root_dir.mkdir(parents=True, exist_ok=True)
+            self._write_manifest()
+            self._dataset = None
+        return len(pending)
+
+    def _metric_dir(self, name: str) -> Path:
+        # the leading underscore keeps derived datasets out of the discovery of the snapshot dataset
+        return self.root_dir / f"_{name}"
+
+    def materialize(self, name: str, fn, columns=None) -> int:
+        """
+        Compute derived columns once per snapshot file and store them next to the snapshot, under _<name>/ with the
+        same partitions. A file is computed again only after it has been re-ingested.
+        :param name: name of the derived dataset
+        :param fn: callable taking one snapshot dataframe and returning the derived columns, aligned on its index
+        :param columns: snapshot columns fn needs, all by default
+        :return: the number of snapshot files computed
+        """
+        done = self.manifest.setdefault('metrics', {}).setdefault(name, {})
+        todo = [f for f, record in self.manifest['files'].items() if done.get(f) != record['mtime']]
+        for f in todo:
+            record = self.manifest['files'][f]
+            universe = self.parse_filename(f)[0]
+            partition = Path(f"Date={record['date']}") / f"Time={record['time']}"
+            read_columns = None if columns is None else list(dict.fromkeys(['Ticker', 'Universe'] + list(columns)))
+            df = pd.read_parquet(self.root_dir / partition / f"{universe}.parquet", columns=read_columns)
+            derived = pd.concat([df[['Ticker', 'Universe']], fn(df)], axis=1)
+            (self._metric_dir(name) / partition).mkdir(parents=True, exist_ok=True)
+            derived.to_parquet(self._metric_dir(name) / partition / f"{universe}.parquet", index=False)
+            done[f] = record['mtime']
+        if todo:
+            self._write_manifest()
+            logger.info(f"Materialized {name} for {len(todo)} snapshot files")
+        return len(todo)
+
+    def available_dates(self) -> list:
+        return sorted({record['date'] for record in self.manifest['files'].values()})
+
+    @staticmethod
+    def _partitioning():
+        return ds.partitioning(pa.schema([pa.field(c, pa.string()) for c in PARTITION_COLUMNS]), flavor='hive')
+
+    def dataset(self) -> ds.Dataset:
+        if self._dataset is None:
+            self._dataset = ds.dataset(self.root_dir, format='parquet', partitioning=self._partitioning(),
+                                       schema=self.schema())
+        return self._dataset
+
+    @staticmethod
+    def _filter(dt=None, start=None, end=None, time=None, universe=None):
+        conditions = []
+        if dt is not None:
+            conditions.append(ds.field('Date') == str(dt))
+        if start is not None:
+            conditions.append(ds.field('Date') >= str(start))
+        if end is not None:
+            conditions.append(ds.field('Date') <= str(end))
+        if time is not None:
+            conditions.append(ds.field('Time') == time)
+        if universe is not None:
+            conditions.append(ds.field('Universe') == universe)
+        condition = None
+        for c in conditions:
+            condition = c if condition is None else condition & c
+        return condition
+
+    def load(self, dt=None, start=None, end=None, time=None, universe=None, columns=None,
+             metrics=None) -> pd.DataFrame:
+        """
+        Load the snapshots of one date, or of a date range, keeping only the partitions and columns asked for.
+        :param dt: a single date (YYYY-MM-DD)
+        :param start: first date of the range, inclusive
+        :param end: last date of the range, inclusive
+        :param time: snapshot time partition, e.g. 'close'
+        :param universe: universe label, e.g. 'CHINA'
+        :param columns: subset of columns to read, all by default
+        :param metrics: name of a materialized dataset whose columns are joined to the snapshots
+        :return: None when nothing has been ingested for the request
+        """
+        if not self.manifest['files']:
+            return None
+        table = self.dataset().to_table(filter=self._filter(dt, start, end, time, universe), columns=columns)
+        if table.num_rows == 0:
+            return None
+        df = table.to_pandas()
+        if metrics is not None and metrics in self.manifest.get('metrics', {}):
+            derived = self.load_metrics(metrics, dt=dt, start=start, end=end, time=time, universe=universe)
+            if derived is not None:
+                keys = ['Ticker', 'Universe'] + PARTITION_COLUMNS
+                derived = derived.drop(columns=[c for c in derived.columns if c in df.columns and c not in keys])
+                df = df.merge(derived, on=keys, how='left')
+        return df
+
+    def load_metrics(self, name: str, dt=None, start=None, end=None, time=None, universe=None,
+                     columns=None) -> pd.DataFrame:
+        """
+        Load a materialized dataset, with the same filters as load
+        """
+        if not self._metric_dir(name).exists():
+            return None
+        dataset = ds.dataset(self._metric_dir(name), format='parquet', partitioning=self._partitioning())
+        table = dataset.to_table(filter=self._filter(dt, start, end, time, universe), columns=columns)
+        if table.num_rows == 0:
+            return None
+        return table.to_pandas()
@@ -22,6 +22,14 @@ class Stock:
         self.option_chain_data = self.get_option_chain()
         self.set_additional_attributes()
 
+    @staticmethod
+    def load_stock(ticker):
+        """
+        This function returns the bare yfinance Ticker for the given ticker, skipping the meta info and option chain
+        requests made when constructing a Stock.
+        """
+        return yf.Ticker(ticker)
+
     def get_meta_info(self):
         try:
             return self.yf_ticker.info
@@ -140,6 +148,16 @@ class StockUniverse:
         for ticker in tickers:
             self.add_stock(ticker)
 
+    def get_price_panel(self, tickers=None, field='Close'):
+        """
+        This function returns a dates x tickers dataframe of the given historical data field, e.g. as the input of
+        model.technical.indicators.IndicatorEngine. Stocks without downloaded historical data are left out.
+        """
+        tickers = self.stocks.keys() if tickers is None else tickers
+        panel = {ticker: self.get_stock(ticker).historical_data[field] for ticker in tickers
+                 if self.get_stock(ticker).historical_data is not None}
+        return pd.DataFrame(panel).sort_index()
+
     def get_put_call_ratios_dataframe(self, tickers):
         """
         This function returns a dataframe containing the Put/Call ratio for each stock in the given list of tickers.
@@ -154,12 +172,19 @@ class StockUniverse:
         return put_call_ratios_df
 
 
+# columns of the yfinance option chain tables, as stored in option_chains
+OPTION_CHAIN_COLUMNS = ['contractSymbol', 'lastTradeDate', 'strike', 'lastPrice', 'bid', 'ask', 'change',
+                        'percentChange', 'volume', 'openInterest', 'impliedVolatility', 'inTheMoney', 'contractSize',
+                        'currency']
+
+
 class OptionCache:
-    def __init__(self, tickers, interval=1):
+    def __init__(self, tickers, interval=1, tick_store=None):
         self.universe = StockUniverse()
         self.stocks = [self.universe.get_stock(ticker) for ticker in tickers]
         self.interval = interval
         self.option_chains = {}
+        self.tick_store = tick_store  # optional TickBufferStore serving the latest contract prices from memory
         self.create_db()
 
     def create_db(self):
@@ -190,17 +215,29 @@ class OptionCache:
         self.conn.commit()
 
     def save_option_chain_to_db(self, timestamp, ticker, expiration_date, option_type, option_chain):
-        cursor = self.conn.cursor()
-
-        for index, row in option_chain.iterrows():
-            row_data = (timestamp, ticker, expiration_date, option_type) + tuple(row)
-            cursor.execute("""
-                INSERT INTO option_chains (timestamp, ticker, expiration_date, option_type, contractSymbol, lastTradeDate, strike, lastPrice, bid, ask, change, percentChange, volume, openInterest, impliedVolatility, inTheMoney, contractSize, currency)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, row_data)
-
+        df = option_chain.reindex(columns=OPTION_CHAIN_COLUMNS)
+        # sqlite3 binds neither Timestamps nor NumPy integers
+        df['lastTradeDate'] = pd.to_datetime(df['lastTradeDate'], utc=True).map(
+            lambda t: None if pd.isna(t) else int(t.timestamp()))
+        df = df.astype(object).where(df.notna(), None)
+        rows = [(timestamp, ticker, expiration_date, option_type) + tuple(row) for row in df.itertuples(index=False)]
+
+        columns = ['timestamp', 'ticker', 'expiration_date', 'option_type'] + OPTION_CHAIN_COLUMNS
+        self.conn.executemany(f"""
+            INSERT INTO option_chains ({', '.join(columns)})
+            VALUES ({', '.join('?' * len(columns))})
+        """, rows)
         self.conn.commit()
 
+    def buffer_option_chain(self, timestamp, option_chain):
+        """
+        Append the last price and volume of every contract to the in-memory tick buffers, keyed by contract symbol.
+        """
+        dt = pd.Timestamp(timestamp, unit='s')
+        for symbol, price, volume in zip(option_chain['contractSymbol'], option_chain['lastPrice'],
+                                         option_chain['volume']):
+            self.tick_store.append(symbol, dt, price, volume)
+
     def fetch_and_save_option_chain(self, stock):
         try:
             option_chains = stock.get_option_chain()
@@ -209,6 +246,10 @@ class OptionCache:
             for expiration_date, option_chain in option_chains.items():
                 if option_chain is not None:
                     self.option_chains[(stock.ticker, expiration_date)] = option_chain
+                    # the in-memory buffers are served even when the database write fails
+                    if self.tick_store is not None:
+                        self.buffer_option_chain(timestamp, option_chain.calls)
+                        self.buffer_option_chain(timestamp, option_chain.puts)
                     self.save_option_chain_to_db(timestamp, stock.ticker, expiration_date, 'call', option_chain.calls)
                     self.save_option_chain_to_db(timestamp, stock.ticker, expiration_date, 'put', option_chain.puts)
         except Exception as e:
@@ -1,9 +1,17 @@
+import io
+import json
+import logging
 import requests
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from string import Template
 from collections import namedtuple
 import pandas as pd
 import numpy as np
 
+import src.config as cfg
+logger = logging.getLogger(__name__)
+
 
 base_url = 'https://www.federalreserve.gov/datadownload/Output.aspx?'
 query_suffix = '&lastobs=&from=&to=&filetype=csv&label=include&layout=seriescolumn&type=package'
@@ -23,17 +31,136 @@ suffix_map = {
     'small_domestic': '|small|nsa'
 }
 
+# metadata rows above the values of a package in the seriescolumn layout, in order; the last one holds the series codes
+H8_HEADER_ROWS = ['description', 'unit', 'multiplier', 'currency', 'identifier', 'code']
+# placeholders of missing observations in the packages
+H8_MISSING_VALUES = ['ND', 'NA', 'NC']
+
+H8_CACHE_DIR = cfg.FED_CACHE_DIR / 'H8'
+# the H.8 release is published every Friday at 4:15 p.m. Eastern Time
+H8_RELEASE_WEEKDAY = 4
+H8_RELEASE_TIME = pd.Timedelta(hours=16, minutes=15)
+
+
+def latest_release_time(now=None) -> pd.Timestamp:
+    """
+    The time of the latest weekly H.8 publication before now, in UTC
+    """
+    now = pd.Timestamp.now(tz='UTC') if now is None else pd.Timestamp(now)
+    now = now.tz_localize('UTC') if now.tzinfo is None else now
+    local_now = now.tz_convert('America/New_York')
+    days_back = (local_now.weekday() - H8_RELEASE_WEEKDAY) % 7
+    release = local_now.normalize() - pd.Timedelta(days=days_back) + H8_RELEASE_TIME
+    if release > local_now:
+        release -= pd.Timedelta(days=7)
+    return release.tz_convert('UTC')
+
+
+class H8Cache:
+    """
+    On-disk cache of the parsed H8 packages: one parquet file of the data and one json file of the code labels and
+    HTTP validators (ETag, Last-Modified) per package.
+
+    A cached package is served without any request until the next weekly release; after that it is revalidated with a
+    conditional request, and only downloaded and parsed again when the Fed answers with new content. When the Fed
+    cannot be reached, the cached package is served as is.
+    """
+
+    def __init__(self, cache_dir=H8_CACHE_DIR / 'cache', session=None, timeout=30):
+        self.cache_dir = Path(cache_dir)
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _data_path(self, series_name):
+        return self.cache_dir / f"h8_{series_name}.parquet"
+
+    def _meta_path(self, series_name):
+        return self.cache_dir / f"h8_{series_name}.json"
+
+    def load_meta(self, series_name) -> dict:
+        if not (self._meta_path(series_name).exists() and self._data_path(series_name).exists()):
+            return None
+        return json.loads(self._meta_path(series_name).read_text())
+
+    def _write_meta(self, series_name, meta):
+        self._meta_path(series_name).write_text(json.dumps(meta, indent=2))
+
+    def load(self, series_name):
+        meta = self.load_meta(series_name)
+        data = pd.read_parquet(self._data_path(series_name))
+        data.columns.name = 'item'
+        return meta['code2label'], data
+
+    def save(self, series_name, code2label, data, headers, checked_at):
+        data.to_parquet(self._data_path(series_name))
+        self._write_meta(series_name, {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'checked_at': checked_at.isoformat(),
+            'code2label': code2label
+        })
+
+    def is_fresh(self, meta, now=None) -> bool:
+        return pd.Timestamp(meta['checked_at']) >= latest_release_time(now)
+
+    def fetch(self, series_name, url, parse, refresh=False, now=None):
+        """
+        Get a package from the cache, revalidating or downloading it when needed.
+        :param parse: callable turning the downloaded csv text into (code2label, data)
+        :param refresh: revalidate even if the package was checked after the latest release
+        :return: code2label, data and how the package was obtained: 'cached', 'not_modified', 'downloaded' or
+            'offline'
+        """
+        now = pd.Timestamp.now(tz='UTC') if now is None else pd.Timestamp(now)
+        meta = self.load_meta(series_name)
+        if meta is not None and not refresh and self.is_fresh(meta, now):
+            return (*self.load(series_name), 'cached')
+
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code not in (200, 304):
+                response.raise_for_status()
+                raise requests.HTTPError(f"unexpected status {response.status_code} for {series_name}")
+        except requests.RequestException as e:
+            if meta is None:
+                raise
+            logger.warning(f"Failed to revalidate H8 {series_name}, serving the cached package: {e}")
+            return (*self.load(series_name), 'offline')
+
+        if response.status_code == 304 and meta is not None:
+            meta['checked_at'] = now.isoformat()
+            self._write_meta(series_name, meta)
+            return (*self.load(series_name), 'not_modified')
+
+        code2label, data = parse(response.content.decode('utf-8'))
+        self.save(series_name, code2label, data, response.headers, now)
+        logger.info(f"Downloaded H8 {series_name}: {data.shape[0]} dates x {data.shape[1]} series")
+        return code2label, data, 'downloaded'
+
 
 class FederalReserveH8:
 
-    def __init__(self):
-        self.url_map = {k: query_template.substitute(series_name=v) for k, v in series_code_map.items()}
+    def __init__(self, cache_dir=None, url_map=None, session=None):
+        self.url_map = url_map or {k: query_template.substitute(series_name=v) for k, v in series_code_map.items()}
         self.H8 = namedtuple('H8', ['level', 'parent', 'name'])
         self.create_balance_sheet_tree()
-        self.raw_data_cache = {}
+        self.compile_tree_index()
+        self.cache = H8Cache(H8_CACHE_DIR / 'cache' if cache_dir is None else cache_dir, session=session)
+        self.snapshot_dir = H8_CACHE_DIR
+        self.metadata_cache = {}
         self.data_cache = {}
+        self.snapshot_cache = {}
         self.code2label_map = {}
         self.label2code_map = {}
+        self.tree_codes = {}
+        self._panel = None
 
     def create_balance_sheet_tree(self):
         self.level_1_assets = (
@@ -99,47 +226,192 @@ class FederalReserveH8:
 
         self.h8tree = h8tree
 
-    def build_h8_cache(self, series_name: str):
+    def compile_tree_index(self):
+        """
+        Index the balance sheet tree once: the children of every parent, in tree order, and the path of every node
+        from its level 1 ancestor. Node names are not unique ('non-mbs'), parent names are.
+        """
+        self.tree_children = {}
+        for node in self.h8tree:
+            self.tree_children.setdefault(node.parent, []).append(node)
+
+        self.tree_paths = {}
+        stack = [(root, ()) for root in ('assets', 'liabilities')]
+        while stack:
+            parent, path = stack.pop()
+            for child in self.tree_children.get(parent, []):
+                self.tree_paths[child] = path + (child.name,)
+                stack.append((child.name, path + (child.name,)))
+
+    def resolve_codes(self, series_name):
+        """
+        Map every node of the tree to its series code in a package. A node is labelled with the tail of its path,
+        e.g. 'real_estate_loans:commercial_real_estate_loans:secured_by_farmland|all|nsa'; the longest tail found among
+        the package labels wins. Nodes not published in the package are left out.
+        """
+        label2code = self.label2code_map[series_name]
+        suffix = suffix_map[series_name]
+        codes = {}
+        for node, path in self.tree_paths.items():
+            for k in range(len(path)):
+                code = label2code.get(':'.join(path[k:]) + suffix)
+                if code is not None:
+                    codes[node] = code
+                    break
+        self.tree_codes[series_name] = codes
+        return codes
+
+    def parse_package(self, series_name, text):
+        metadata, data = self.parse_csv(text)
+        self.metadata_cache[series_name] = metadata
+        return metadata['label'].to_dict(), data
+
+    def build_h8_cache(self, series_name: str, refresh=False):
+        """
+        Load a package through the on-disk cache. When the Fed cannot be reached and nothing is cached yet, or the
+        downloaded package cannot be parsed, the holdings tables of the local xlsx snapshot are loaded instead.
+        :return: how the package was obtained, see H8Cache.fetch, 'snapshot', or 'unavailable' when there is no
+            snapshot either
+        """
         series_url = self.url_map.get(series_name)
-        raw_data = self.get_data(series_url)
-        code2label, label2code, data = self.clean_data(raw_data)
+        try:
+            code2label, data, status = self.cache.fetch(
+                series_name, series_url, parse=lambda text: self.parse_package(series_name, text), refresh=refresh)
+        except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+            return self._fall_back_to_snapshot(series_name, e)
+
+        self.add_package(series_name, code2label, data)
+        return status
+
+    def build_all(self, groups=None, max_workers=5, refresh=False) -> pd.DataFrame:
+        """
+        Load the packages of several bank groups concurrently, see build_h8_cache, and align them on one date index.
+        A group that fails to download or parse falls back to its snapshot without stopping the others.
+        :param groups: bank groups of series_code_map, all of them by default
+        :return: the combined panel with (group, item) columns
+        """
+        groups = list(series_code_map) if groups is None else list(groups)
+
+        def fetch(series_name):
+            return self.cache.fetch(series_name, self.url_map.get(series_name),
+                                    parse=lambda text: self.parse_package(series_name, text), refresh=refresh)
 
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {g: executor.submit(fetch, g) for g in groups}
+        self.build_status = {}
+        for g, future in futures.items():
+            try:
+                code2label, data, self.build_status[g] = future.result()
+            except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+                # ValueError also covers the pandas parser errors of a malformed csv
+                self.build_status[g] = self._fall_back_to_snapshot(g, e)
+                continue
+            self.add_package(g, code2label, data)
+        return self.panel
+
+    def _fall_back_to_snapshot(self, series_name, error) -> str:
+        logger.warning(f"Failed to load H8 {series_name}, loading the local xlsx snapshot: {error!r}")
+        try:
+            self.snapshot_cache[series_name] = self.load_xlsx_snapshot(series_name)
+        except (OSError, ImportError) as e:
+            logger.error(f"No local xlsx snapshot of H8 {series_name} either, skipping it: {e}")
+            return 'unavailable'
+        return 'snapshot'
+
+    def add_package(self, series_name, code2label, data):
+        """
+        Register a parsed package and resolve the tree codes of its bank group
+        """
         self.code2label_map[series_name] = code2label
-        self.label2code_map[series_name] = label2code
-        self.raw_data_cache[series_name] = raw_data
+        self.label2code_map[series_name] = {v: k for k, v in code2label.items()}
         self.data_cache[series_name] = data
+        self.resolve_codes(series_name)
+        self._panel = None
+
+    def load_xlsx_snapshot(self, series_name):
+        """
+        The holdings tables saved in data/macro/Fed/H8/h8_data_<series_name>.xlsx, one sheet per table
+        :return: a dictionary of table name (level2, level3, level4, cre, rre) -> dataframe indexed by date
+        """
+        sheets = pd.read_excel(self.snapshot_dir / f"h8_data_{series_name}.xlsx", sheet_name=None, index_col=0)
+        return {name[len(series_name) + 1:]: df for name, df in sheets.items()}
+
+    def _from_snapshot(self, series_name, table):
+        if series_name not in self.data_cache and series_name in self.snapshot_cache:
+            return self.snapshot_cache[series_name].get(table)
+        return None
+
+    @property
+    def panel(self) -> pd.DataFrame:
+        """
+        The loaded packages side by side, with (group, item) columns
+        """
+        if self._panel is None:
+            if not self.data_cache:
+                return pd.DataFrame(columns=pd.MultiIndex.from_tuples([], names=['group', 'item']))
+            self._panel = pd.concat(self.data_cache, axis=1, names=['group', 'item']).sort_index()
+        return self._panel
+
+    def descendants(self, node, depth=1) -> list:
+        """
+        The nodes below node, level by level, down to depth levels below it (all levels when depth is None)
+        :param node: a node or the name of a parent, e.g. 'loans_and_leases_in_bank_credit', 'assets'
+        """
+        name = getattr(node, 'name', node)
+        if name not in self.tree_children and name not in {n.name for n in self.tree_paths}:
+            raise KeyError(f"{name} is not a node of the H8 balance sheet tree")
+        nodes, parents, level = [], [name], 0
+        while parents and (depth is None or level < depth):
+            children = [child for parent in parents for child in self.tree_children.get(parent, [])]
+            nodes.extend(children)
+            parents = [child.name for child in children]
+            level += 1
+        return nodes
+
+    def select_nodes(self, nodes, groups=None) -> pd.DataFrame:
+        """
+        The holdings of the given nodes in billions, for several bank groups, in a single column selection of the
+        combined panel. Nodes not published by a group come out as NaN columns.
+        :return: a dataframe with (group, node) columns; nodes sharing a name are labelled 'parent|name'
+        """
+        groups = list(self.data_cache) if groups is None else list(groups)
+        missing = [g for g in groups if g not in self.data_cache]
+        if missing:
+            raise KeyError(f"H8 packages not loaded: {missing}, call build_h8_cache first")
+        names = [node.name for node in nodes]
+        names = [f"{node.parent}|{node.name}" if names.count(node.name) > 1 else node.name for node in nodes]
+
+        columns = pd.MultiIndex.from_tuples([(g, self.tree_codes[g].get(node, '')) for g in groups for node in nodes])
+        output = self.panel.reindex(columns=columns) / 1e3
+        output.columns = pd.MultiIndex.from_product([groups, names], names=['group', 'node'])
+        return output
+
+    def get_subtree(self, node, groups=None, depth=1) -> pd.DataFrame:
+        """
+        The holdings of the nodes below node for several bank groups, see descendants and select_nodes
+        """
+        return self.select_nodes(self.descendants(node, depth), groups)
+
+    def _group_holdings(self, series_name, nodes):
+        return self.select_nodes(nodes, [series_name])[series_name]
 
     def get_level3_holdings(self, series_name):
-        data = self.data_cache.get(series_name)
-        label2code = self.label2code_map.get(series_name)
-        suffix = suffix_map.get(series_name)
-        dflist = []
-        for node in self.h8tree:
-            if node.level == 3:
-                dflist.append(data[label2code.get(node.name + suffix)].rename(node.name))
-        return pd.concat(dflist, axis=1) / 1e3
+        snapshot = self._from_snapshot(series_name, 'level3')
+        if snapshot is not None:
+            return snapshot
+        return self._group_holdings(series_name, [node for node in self.h8tree if node.level == 3])
 
     def get_cre_holdings(self, series_name):
-        data = self.data_cache.get(series_name)
-        label2code = self.label2code_map.get(series_name)
-        suffix = suffix_map.get(series_name)
-        dflist = []
-        for node in self.h8tree:
-            if (node.parent == 'commercial_real_estate_loans') and (node.level == 5):
-                item_code = label2code.get('real_estate_loans:' + node.parent + ':' + node.name + suffix)
-                dflist.append(data[item_code].rename(node.name))
-        return pd.concat(dflist, axis=1) / 1e3
+        snapshot = self._from_snapshot(series_name, 'cre')
+        if snapshot is not None:
+            return snapshot
+        return self._group_holdings(series_name, self.tree_children['commercial_real_estate_loans'])
 
     def get_rre_holdings(self, series_name):
-        data = self.data_cache.get(series_name)
-        label2code = self.label2code_map.get(series_name)
-        suffix = suffix_map.get(series_name)
-        dflist = []
-        for node in self.h8tree:
-            if (node.parent == 'residential_real_estate_loans') and (node.level == 5):
-                item_code = label2code.get('real_estate_loans:' + node.parent + ':' + node.name + suffix)
-                dflist.append(data[item_code].rename(node.name))
-        return pd.concat(dflist, axis=1) / 1e3
+        snapshot = self._from_snapshot(series_name, 'rre')
+        if snapshot is not None:
+            return snapshot
+        return self._group_holdings(series_name, self.tree_children['residential_real_estate_loans'])
 
     @staticmethod
     def clean_names(x):
@@ -162,37 +434,57 @@ class FederalReserveH8:
             response_data = response.content.decode('utf-8')
         else:
             raise Exception("failed to get data.")
-
-        input_list = [FederalReserveH8.clean_names(row).split(',') for row in response_data.splitlines()]
-        input_list = [[x.lower() for x in row] for row in input_list]
-        data_df = pd.DataFrame(input_list)
-
-        return data_df
+        return FederalReserveH8.parse_csv(response_data)
 
     @staticmethod
-    def clean_data(raw_data):
-        code2label = raw_data.iloc[[0, 5], 1:].T.set_index(5)[0].to_dict()
-        label2code = {v: k for k, v in code2label.items()}
-
-        data = pd.DataFrame(data=raw_data.iloc[6:, 1:].values,
-                            columns=raw_data.iloc[5, 1:].values,
-                            index=raw_data.iloc[6:, 0].values)
-        data.index.name = 'date'
-        data.columns.name = 'item'
-        data = data.rename(pd.to_datetime)
-
-        for item in data.columns:
-            data[item] = data[item].replace('', np.nan).astype(float)
+    def parse_csv(response_data):
+        """
+        Parse a package downloaded in the seriescolumn layout with the CSV reader: the metadata rows are read as text
+        and their labels cleaned once, the values below them are read straight into one float matrix.
+        :return: the metadata as a dataframe indexed by the lowercase series code, with the cleaned label in 'label',
+            and the values as a float dataframe of dates x series codes
+        """
+        metadata = pd.read_csv(io.StringIO(response_data), header=None, nrows=len(H8_HEADER_ROWS), index_col=0,
+                               dtype=str, keep_default_na=False).T
+        metadata.columns = H8_HEADER_ROWS
+        metadata = metadata.set_index(metadata['code'].str.lower().rename('item')).drop(columns='code')
+        metadata['label'] = metadata['description'].map(FederalReserveH8.clean_names).str.lower()
 
-        return code2label, label2code, data
+        values = pd.read_csv(io.StringIO(response_data), header=None, skiprows=len(H8_HEADER_ROWS), index_col=0,
+                             na_values=H8_MISSING_VALUES, dtype={i + 1: 'float64' for i in range(len(metadata))})
+        data = pd.DataFrame(values.to_numpy(dtype='float64'),
+                            index=pd.DatetimeIndex(pd.to_datetime(values.index), name='date'),
+                            columns=metadata.index)
+        return metadata, data
 
     @staticmethod
-    def wide_to_long(series_df, groupname):
-        return (
-            series_df.stack().rename('value')
-            .reset_index().rename(columns={'level_1': 'item'})
-            .assign(group=lambda x: groupname)
-        )
+    def wide_to_long(series_df, groupname=None):
+        """
+        Reshape a wide frame of one group (item columns), or the combined panel ((group, item) columns), into rows of
+        date, item, value and group in one pass over the value matrix. Missing values are dropped.
+        """
+        values = series_df.to_numpy(dtype='float64')
+        n_dates, n_columns = values.shape
+        if isinstance(series_df.columns, pd.MultiIndex):
+            groups = series_df.columns.get_level_values(0).to_numpy()
+            items = series_df.columns.get_level_values(-1).to_numpy()
+        else:
+            groups = np.full(n_columns, groupname, dtype=object)
+            items = series_df.columns.to_numpy()
+        rows, cols = np.nonzero(~np.isnan(values))
+        return pd.DataFrame({
+            'date': series_df.index.to_numpy()[rows],
+            'item': items[cols],
+            'value': values[rows, cols],
+            'group': groups[cols],
+        })
+
+    def to_long(self, groups=None) -> pd.DataFrame:
+        """
+        All the loaded packages in long format, see wide_to_long
+        """
+        panel = self.panel if groups is None else self.panel[list(groups)]
+        return self.wide_to_long(panel)
 
 
 if __name__ == '__main__':
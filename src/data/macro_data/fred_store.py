@@ -0,0 +1,343 @@
+import sqlite3, datetime, logging, threading
+from pathlib import Path
+logger = logging.getLogger(__name__)
+
+import requests
+import pandas as pd
+
+import src.config as cfg
+
+
+FRED_ROOT_URL = 'https://api.stlouisfed.org/fred'
+FRED_DB_PATH = cfg.DB_DIR / 'fred.db'
+# the end of the real-time period of the current vintage
+FRED_LATEST = '9999-12-31'
+FRED_UPDATES_WINDOW = datetime.timedelta(days=13)
+
+RELEASE_COLUMNS = ['id', 'name', 'link', 'press_release', 'notes', 'realtime_start', 'realtime_end']
+SERIES_COLUMNS = ['id', 'release_id', 'title', 'realtime_start', 'realtime_end', 'observation_start', 'observation_end',
+                  'frequency', 'frequency_short', 'units', 'units_short', 'seasonal_adjustment',
+                  'seasonal_adjustment_short', 'last_updated', 'popularity', 'group_popularity', 'notes']
+
+
+def _previous_day(date: str) -> str:
+    return (datetime.date.fromisoformat(date) - datetime.timedelta(days=1)).isoformat()
+
+
+class FREDClient:
+    """
+    Minimal client of the FRED REST API, paging through the list endpoints
+    """
+
+    def __init__(self, api_key=None, base_url=FRED_ROOT_URL, session=None, timeout=30, limit=1000):
+        self.api_key = api_key or cfg.fred_api_key
+        self.base_url = base_url.rstrip('/')
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.limit = limit
+
+    def get(self, endpoint, **params) -> dict:
+        params = {'api_key': self.api_key, 'file_type': 'json', **params}
+        params = {k: v for k, v in params.items() if v is not None}
+        response = self.session.get(f"{self.base_url}/{endpoint}", params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_all(self, endpoint, key, **params) -> list:
+        """
+        All the items of a list endpoint, e.g. key='seriess' for release/series
+        """
+        items, offset = [], 0
+        while True:
+            data = self.get(endpoint, limit=self.limit, offset=offset, **params)
+            page = data.get(key, [])
+            items.extend(page)
+            offset += len(page)
+            if not page or offset >= int(data.get('count', offset)):
+                return items
+
+    def releases(self) -> list:
+        return self.get_all('releases', 'releases')
+
+    def release_series(self, release_id) -> list:
+        return self.get_all('release/series', 'seriess', release_id=release_id)
+
+    def series(self, series_id) -> dict:
+        return self.get('series', series_id=series_id)['seriess'][0]
+
+    def observations(self, series_id, realtime_start=None, realtime_end=None) -> list:
+        return self.get_all('series/observations', 'observations', series_id=series_id,
+                            realtime_start=realtime_start, realtime_end=realtime_end)
+
+    def updates(self, filter_value='all', start_time=None, end_time=None) -> list:
+        return self.get_all('series/updates', 'seriess', filter_value=filter_value, start_time=start_time,
+                            end_time=end_time)
+
+
+class FREDStore:
+    """
+    Local SQLite store of the FRED releases, series metadata and observations, so that pages read FRED data without
+    calling the API.
+
+    Observations are stored per vintage, keyed by (series_id, date, realtime_start): a revision adds a row and closes
+    the realtime_end of the revised one, so any past vintage can be read back. The last_updated time of every synced
+    series is recorded; sync_updates asks FRED for the series updated since the last check and re-pulls only the
+    observations of the stored series that changed, from the real-time start of their last sync. The updates endpoint
+    only covers the last two weeks: when the last check is older, or there was none, the metadata of every stored
+    series is fetched instead so that no update is missed.
+
+    One connection is shared by every caller, e.g. the Streamlit sessions of the FRED page: the sync and read methods
+    hold a lock so that concurrent transactions do not commit or roll back each other's writes.
+    """
+
+    def __init__(self, db_path=FRED_DB_PATH, client=None):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.client = client or FREDClient()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self.create_tables()
+
+    def close(self):
+        self.conn.close()
+
+    def create_tables(self):
+        with self.conn:
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS releases (
+                    {', '.join(c + (' INTEGER PRIMARY KEY' if c == 'id' else ' TEXT') for c in RELEASE_COLUMNS)},
+                    synced_at TEXT
+                )""")
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS series (
+                    {', '.join(c + (' TEXT PRIMARY KEY' if c == 'id' else ' TEXT') for c in SERIES_COLUMNS)},
+                    synced_at TEXT
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS observations (
+                    series_id TEXT,
+                    date TEXT,
+                    value REAL,
+                    realtime_start TEXT,
+                    realtime_end TEXT,
+                    PRIMARY KEY (series_id, date, realtime_start)
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    series_id TEXT PRIMARY KEY,
+                    last_updated TEXT,
+                    realtime_start TEXT,
+                    rows INTEGER,
+                    synced_at TEXT
+                )""")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    @staticmethod
+    def _clock():
+        return datetime.datetime.now()
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now().isoformat(timespec='seconds')
+
+    @staticmethod
+    def _today():
+        return datetime.date.today().isoformat()
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = "
+                          "excluded.value", (key, value))
+
+    def _upsert(self, table, columns, records, extra=None):
+        """
+        Insert or replace records (dictionaries from the API), keeping the columns of the table that are not given,
+        e.g. the release of a series returned by the updates endpoint
+        """
+        extra = extra or {}
+        given = columns + list(extra)
+        rows = [tuple(r.get(c) for c in columns) + tuple(extra.values()) for r in records]
+        updates = ', '.join(f"{c} = COALESCE(excluded.{c}, {c})" for c in given if c != 'id')
+        self.conn.executemany(
+            f"INSERT INTO {table} ({', '.join(given)}) VALUES ({', '.join('?' * len(given))}) "
+            f"ON CONFLICT(id) DO UPDATE SET {updates}", rows)
+
+    # ========================== Sync ========================== #
+
+    def sync_releases(self, refresh=False) -> int:
+        """
+        Store the list of releases, fetched only the first time or when refresh is set
+        :return: the number of releases fetched
+        """
+        with self._lock:
+            if not refresh and self.conn.execute("SELECT 1 FROM releases LIMIT 1").fetchone():
+                return 0
+            releases = self.client.releases()
+            with self.conn:
+                self._upsert('releases', RELEASE_COLUMNS, releases, {'synced_at': self._now()})
+            return len(releases)
+
+    def sync_release_series(self, release_id, refresh=False) -> int:
+        """
+        Store the metadata of the series of a release, fetched only the first time or when refresh is set
+        :return: the number of series fetched
+        """
+        with self._lock:
+            query = "SELECT 1 FROM series WHERE release_id = ? LIMIT 1"
+            if not refresh and self.conn.execute(query, (str(release_id),)).fetchone():
+                return 0
+            seriess = self.client.release_series(release_id)
+            with self.conn:
+                self._upsert('series', [c for c in SERIES_COLUMNS if c != 'release_id'], seriess,
+                             {'release_id': str(release_id), 'synced_at': self._now()})
+            return len(seriess)
+
+    def sync_observations(self, series_ids, force=False) -> list:
+        """
+        Pull the observations of the series whose last_updated changed since their last sync. The first sync of a
+        series stores its current vintage; later syncs ask for every vintage since the previous sync, so revisions
+        are kept.
+        :return: the ids of the series pulled
+        """
+        with self._lock:
+            pulled = []
+            for series_id in series_ids:
+                info = self.series_info(series_id)
+                if info is None:
+                    info = self.client.series(series_id)
+                    with self.conn:
+                        self._upsert('series', [c for c in SERIES_COLUMNS if c != 'release_id'], [info],
+                                     {'synced_at': self._now()})
+                state = self.conn.execute("SELECT last_updated, realtime_start FROM sync_state WHERE series_id = ?",
+                                          (series_id,)).fetchone()
+                if state is not None and state[0] == info.get('last_updated') and not force:
+                    continue
+                realtime_start = None if state is None else state[1]
+                observations = self.client.observations(series_id, realtime_start=realtime_start,
+                                                        realtime_end=None if state is None else FRED_LATEST)
+                self._write_observations(series_id, observations, info.get('last_updated'), current=state is None)
+                pulled.append(series_id)
+            return pulled
+
+    def _write_observations(self, series_id, observations, last_updated, current=False):
+        """
+        Merge pulled observations into the stored vintages. FRED clips the real-time start of every vintage to the
+        requested one, so a value equal to the latest stored vintage of its date only extends that vintage, and a new
+        value closes it the day before its own real-time start.
+        :param current: the observations are the current vintage only, which is returned with a real-time period of
+            today; they stay current until a later sync returns their revision
+        """
+        with self._lock:
+            today = self._today()
+            latest = {row[0]: list(row[1:]) for row in self.conn.execute("""
+                SELECT date, value, realtime_start, realtime_end, MAX(realtime_start) FROM observations
+                WHERE series_id = ? GROUP BY date
+            """, (series_id,))}
+            rows = sorted((o['date'], o.get('realtime_start', today),
+                           None if o['value'] in ('.', '') else float(o['value']),
+                           FRED_LATEST if current else o.get('realtime_end', FRED_LATEST)) for o in observations)
+            inserts, updates = [], {}
+            for date, realtime_start, value, realtime_end in rows:
+                stored = latest.get(date)
+                if stored is not None and stored[1] >= realtime_start:
+                    # the same vintage returned again, or one older than what is stored
+                    if stored[1] == realtime_start:
+                        stored[0], stored[2] = value, realtime_end
+                        updates[(date, stored[1])] = stored
+                    continue
+                if stored is not None and stored[0] == value and stored[2] >= _previous_day(realtime_start):
+                    stored[2] = realtime_end
+                    updates[(date, stored[1])] = stored
+                    continue
+                if stored is not None:
+                    stored[2] = min(stored[2], _previous_day(realtime_start))
+                    updates[(date, stored[1])] = stored
+                latest[date] = [value, realtime_start, realtime_end]
+                inserts.append((series_id, date, value, realtime_start, realtime_end))
+            with self.conn:
+                self.conn.executemany("""
+                    UPDATE observations SET value = ?, realtime_end = ?
+                    WHERE series_id = ? AND date = ? AND realtime_start = ?
+                """, [(v[0], v[2], series_id, date, start) for (date, start), v in updates.items()])
+                self.conn.executemany("""
+                    INSERT INTO observations (series_id, date, value, realtime_start, realtime_end)
+                    VALUES (?, ?, ?, ?, ?)
+                """, inserts)
+                self.conn.execute("""
+                    INSERT INTO sync_state (series_id, last_updated, realtime_start, rows, synced_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(series_id) DO UPDATE SET
+                        last_updated = excluded.last_updated,
+                        realtime_start = excluded.realtime_start,
+                        rows = rows + excluded.rows,
+                        synced_at = excluded.synced_at
+                """, (series_id, last_updated, today, len(inserts), self._now()))
+
+    def sync_updates(self, filter_value='all') -> list:
+        """
+        Ask FRED for the series updated since the last check, refresh their metadata, and re-pull the observations of
+        the stored series among them. When the last check is out of the window of the updates endpoint, the metadata
+        of every stored series is refreshed and their observations pulled if they changed.
+        :return: the ids of the series pulled
+        """
+        with self._lock:
+            now = self._clock()
+            checked_at = now.strftime('%Y%m%d%H%M')
+            start_time = self._get_meta('updates_checked_at')
+            tracked = [row[0] for row in self.conn.execute("SELECT series_id FROM sync_state ORDER BY series_id")]
+            if start_time is None or datetime.datetime.strptime(start_time, '%Y%m%d%H%M') < now - FRED_UPDATES_WINDOW:
+                seriess = [self.client.series(series_id) for series_id in tracked]
+                with self.conn:
+                    self._upsert('series', [c for c in SERIES_COLUMNS if c != 'release_id'], seriess,
+                                 {'synced_at': self._now()})
+                    self._set_meta('updates_checked_at', checked_at)
+                pulled = self.sync_observations(tracked)
+                logger.info(f"FRED updates: last check before {now - FRED_UPDATES_WINDOW:%Y-%m-%d}, metadata of "
+                            f"{len(tracked)} stored series refreshed, {len(pulled)} pulled")
+                return pulled
+
+            updated = self.client.updates(filter_value=filter_value, start_time=start_time, end_time=checked_at)
+            with self.conn:
+                known = [s for s in updated if self.series_info(s['id']) is not None]
+                self._upsert('series', [c for c in SERIES_COLUMNS if c != 'release_id'], known,
+                             {'synced_at': self._now()})
+                self._set_meta('updates_checked_at', checked_at)
+            pulled = self.sync_observations([s['id'] for s in updated if s['id'] in tracked])
+            logger.info(f"FRED updates: {len(updated)} series updated, {len(pulled)} stored series pulled")
+            return pulled
+
+    # ========================== Read ========================== #
+
+    def releases(self) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_sql("SELECT * FROM releases ORDER BY name", self.conn)
+
+    def release_series(self, release_id) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_sql("SELECT * FROM series WHERE release_id = ? ORDER BY title", self.conn,
+                               params=(str(release_id),))
+
+    def series_info(self, series_id) -> dict:
+        with self._lock:
+            cursor = self.conn.execute("SELECT * FROM series WHERE id = ?", (series_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([d[0] for d in cursor.description], row))
+
+    def observations(self, series_id, as_of=None) -> pd.Series:
+        """
+        Observations of a series, as currently published, or as known on the date as_of
+        """
+        with self._lock:
+            as_of = FRED_LATEST if as_of is None else str(as_of)
+            df = pd.read_sql("""
+                SELECT date, value FROM observations
+                WHERE series_id = ? AND realtime_start <= ? AND realtime_end >= ?
+                ORDER BY date
+            """, self.conn, params=(series_id, as_of, as_of))
+            return pd.Series(df['value'].to_numpy(), index=pd.DatetimeIndex(pd.to_datetime(df['date']), name='date'),
+                             name=series_id)
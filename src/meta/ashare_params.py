@@ -3,8 +3,122 @@ import zipfile
 import pandas as pd
 import io
 import os
+import json
+import hashlib
+import datetime
+import logging
+logger = logging.getLogger(__name__)
+
+import src.config as cfg
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+REFERENCE_CACHE_DIR = os.path.join(cfg.META_DIR, 'reference_cache')
+CSRC_INDUSTRY_URL = 'https://csi-web-dev.oss-cn-shanghai-finance-1-pub.aliyuncs.com/data_update/csrcindustry.zip'
+CSI_MAP_COLUMNS = ['证券代码', '证券代码简称', '中证一级行业分类简称', '中证二级行业分类简称', '中证三级行业分类简称',
+                   '中证四级行业分类简称']
+
+
+class ReferenceCache:
+    """
+    本地参考数据缓存。原始数据（下载的zip、本地Excel）只在内容变化时解析一次，结果保存为parquet快照，
+    文件名带内容哈希作为版本号，manifest.json记录每个数据集的当前版本、来源和获取时间。
+
+    Refresh policy: a snapshot younger than `max_age` is loaded without touching the source at all. Past that age (or
+    always, when max_age is None) the raw source is read and hashed, and only parsed again when its hash changed. When
+    the source cannot be fetched, the last snapshot is used.
+    """
+
+    def __init__(self, cache_dir=REFERENCE_CACHE_DIR, keep_versions=3):
+        self.cache_dir = cache_dir
+        self.keep_versions = keep_versions
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_manifest(self):
+        with open(self.manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+
+    def _snapshot_path(self, name, content_hash):
+        return os.path.join(self.cache_dir, f"{name}_{content_hash[:12]}.parquet")
+
+    def _read_snapshot(self, name):
+        entry = self.manifest[name]
+        return pd.read_parquet(self._snapshot_path(name, entry['hash']))
+
+    @staticmethod
+    def _to_snapshot(df):
+        # Excel columns can mix numbers and text, which parquet does not accept
+        df = df.copy()
+        for c in df.columns[df.dtypes == object]:
+            df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+        df.columns = [str(c) for c in df.columns]
+        return df
+
+    def _prune(self, name):
+        versions = self.manifest[name].setdefault('versions', [])
+        for old_hash in versions[:-self.keep_versions]:
+            old_path = self._snapshot_path(name, old_hash)
+            if os.path.exists(old_path):
+                os.remove(old_path)
+        self.manifest[name]['versions'] = versions[-self.keep_versions:]
+
+    def is_fresh(self, name, max_age=None):
+        entry = self.manifest.get(name)
+        if entry is None or max_age is None or not os.path.exists(self._snapshot_path(name, entry['hash'])):
+            return False
+        return datetime.datetime.now() - datetime.datetime.fromisoformat(entry['checked_at']) < max_age
+
+    def load(self, name, fetch_raw, parse, max_age=None, source=None, refresh=False) -> pd.DataFrame:
+        """
+        Load a reference dataset from its snapshot, refreshing the snapshot according to the policy above.
+        :param name: the dataset name
+        :param fetch_raw: callable returning the raw source as bytes
+        :param parse: callable turning the raw bytes into a dataframe
+        :param max_age: a datetime.timedelta, None to check the source on every load
+        :param source: description of the source (url or path) recorded in the manifest
+        :param refresh: check the source regardless of the snapshot age
+        """
+        if not refresh and self.is_fresh(name, max_age):
+            return self._read_snapshot(name)
+
+        entry = self.manifest.get(name)
+        try:
+            raw = fetch_raw()
+        except Exception as e:
+            if entry is None:
+                raise
+            logger.warning(f"Failed to fetch {name}, using the snapshot of {entry['fetched_at']}: {e}")
+            return self._read_snapshot(name)
+
+        now = datetime.datetime.now().isoformat()
+        content_hash = hashlib.sha256(raw).hexdigest()
+        if entry is not None and entry['hash'] == content_hash and \
+                os.path.exists(self._snapshot_path(name, content_hash)):
+            entry['checked_at'] = now
+            self._write_manifest()
+            return self._read_snapshot(name)
+
+        logger.info(f"Source of {name} changed, parsing a new snapshot")
+        df = self._to_snapshot(parse(raw))
+        df.to_parquet(self._snapshot_path(name, content_hash), index=False)
+        versions = [] if entry is None else entry.get('versions', [])
+        self.manifest[name] = {'hash': content_hash, 'source': source, 'fetched_at': now, 'checked_at': now,
+                               'rows': len(df), 'versions': [v for v in versions if v != content_hash] + [content_hash]}
+        self._prune(name)
+        self._write_manifest()
+        return df
+
+
+def _read_file_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
 
 def choose_column_language(df, chinese_columns=True):
     if chinese_columns:
@@ -13,17 +127,30 @@ def choose_column_language(df, chinese_columns=True):
         return df.rename(columns=lambda n: n.split('\n')[-1])
 
 
-def fetch_csrcindustry(chinese_name=True):
+def _download_csrcindustry():
+    response = requests.get(CSRC_INDUSTRY_URL, timeout=60)
+    response.raise_for_status()
+    return response.content
+
+
+def _parse_csrcindustry(raw):
+    zip_file = zipfile.ZipFile(io.BytesIO(raw))
+    excel_file_name = [f for f in zip_file.namelist() if f.endswith('.xlsx') or f.endswith('.xls')][0]
+    return pd.read_excel(io.BytesIO(zip_file.read(excel_file_name)))
+
+
+def fetch_csrcindustry(chinese_name=True, refresh=False, max_age_days=7, cache=None):
     """
     从CSI官网下载证监会行业分类数据。来自 https://www.csindex.com.cn/#/dataService/industryClassification
+    下载结果缓存为本地快照，max_age_days 天内不再重复下载。
     :param chinese_name: 是否返回中文行业名称
+    :param refresh: 是否忽略快照时效，重新下载
+    :param max_age_days: 快照的有效天数
+    :param cache: ReferenceCache，默认为 meta_data/reference_cache
     """
-    csrcindustry_url = 'https://csi-web-dev.oss-cn-shanghai-finance-1-pub.aliyuncs.com/data_update/csrcindustry.zip'
-    response = requests.get(csrcindustry_url)
-    zip_file = zipfile.ZipFile(io.BytesIO(response.content))
-    excel_file_name = [f for f in zip_file.namelist() if f.endswith('.xlsx') or f.endswith('.xls')][0]
-    extracted_file = zip_file.extract(excel_file_name, path=THIS_DIR)
-    df = pd.read_excel(extracted_file)
+    cache = cache or ReferenceCache()
+    df = cache.load('csrcindustry', _download_csrcindustry, _parse_csrcindustry,
+                    max_age=datetime.timedelta(days=max_age_days), source=CSRC_INDUSTRY_URL, refresh=refresh)
     df = choose_column_language(df, chinese_name)
     return df
 
@@ -38,19 +165,23 @@ def get_csi_industry_notes(update=False):
     return csi_industry_notes.fillna(method='ffill').set_index(['一级行业','二级行业','三级行业','四级行业'])['释义']
 
 
-def get_csi_industry_map():
-    csi_industry_map = pd.read_excel(os.path.join(THIS_DIR,'csi_industry_map.xlsx'))
-    csi_level_1_map = csi_industry_map.set_index('证券代码')['中证一级行业分类简称'].to_dict()
-    csi_level_2_map = csi_industry_map.set_index('证券代码')['中证二级行业分类简称'].to_dict()
-    csi_level_3_map = csi_industry_map.set_index('证券代码')['中证三级行业分类简称'].to_dict()
-    csi_level_4_map = csi_industry_map.set_index('证券代码')['中证四级行业分类简称'].to_dict()
-    csi_tic_name_map = csi_industry_map.set_index('证券代码')['证券代码简称'].to_dict()
+def get_csi_industry_map(path=None, cache=None):
+    """
+    中证行业分类：证券代码到一至四级行业及证券简称的映射。Excel只在文件内容变化时解析一次，之后从快照读取。
+    :param path: 中证行业分类Excel，默认为 meta/csi_industry_map.xlsx
+    :param cache: ReferenceCache，默认为 meta_data/reference_cache
+    """
+    path = path or os.path.join(THIS_DIR, 'csi_industry_map.xlsx')
+    cache = cache or ReferenceCache()
+    csi_industry_map = cache.load('csi_industry_map', lambda: _read_file_bytes(path),
+                                  lambda raw: pd.read_excel(io.BytesIO(raw))[CSI_MAP_COLUMNS], source=path)
+    csi_industry_map = csi_industry_map.set_index('证券代码')
     return {
-        'level_1': csi_level_1_map,
-        'level_2': csi_level_2_map,
-        'level_3': csi_level_3_map,
-        'level_4': csi_level_4_map,
-        'tic_name_map': csi_tic_name_map
+        'level_1': csi_industry_map['中证一级行业分类简称'].to_dict(),
+        'level_2': csi_industry_map['中证二级行业分类简称'].to_dict(),
+        'level_3': csi_industry_map['中证三级行业分类简称'].to_dict(),
+        'level_4': csi_industry_map['中证四级行业分类简称'].to_dict(),
+        'tic_name_map': csi_industry_map['证券代码简称'].to_dict()
     }
 
 if __name__ == '__main__':
@@ -2,58 +2,80 @@
 import numpy as np
 import pandas as pd
 import statsmodels.api as sm
-from sklearn.metrics import mean_absolute_error, mean_squared_error
-from scipy.stats import jarque_bera
 
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from src.model.macro.dfm_backtest import fit_dynamic_factor, rolling_origin_backtest, backtest_metrics
+from src.model.macro.dfm_pca import TwoStepDynamicFactor
+from src.model.macro.dfm_diagnostics import error_metrics, jarque_bera, model_diagnostics
+
+# panels wider than this are estimated by the two-step backend when backend='auto'
+PCA_BACKEND_MIN_SERIES = 30
+
 
 class DFM:
-    def __init__(self, endog, k_factors=1, factor_order=1, error_order=1):
+    def __init__(self, endog, k_factors=1, factor_order=1, error_order=1, backend='auto'):
         """
         Initialize the DFM model.
+        :param backend: 'statsmodels' for the maximum likelihood DynamicFactor, 'pca' for the two-step principal
+            components and Kalman smoother estimator of large panels (white noise errors, error_order is ignored),
+            'auto' to pick 'pca' above PCA_BACKEND_MIN_SERIES series
         """
         self.endog = endog
         self.k_factors = k_factors
         self.factor_order = factor_order
         self.error_order = error_order
+        if backend == 'auto':
+            backend = 'pca' if endog.shape[1] > PCA_BACKEND_MIN_SERIES else 'statsmodels'
+        if backend not in ('statsmodels', 'pca'):
+            raise ValueError(f"backend must be 'auto', 'statsmodels' or 'pca', got {backend}")
+        self.backend = backend
         self.model = None
         self.result = None
+        self.fit_status = None
+        self.cache = None
         self.train_data = None
         self.test_data = None
+        self.train_result = None
+        self.backtest_results = None
 
     # ------------------------------------------
     # In-Sample Fit
     # ------------------------------------------
 
-    def fit(self):
+    def fit(self, cache=None, refit=True):
         """
         Fit the DFM model.
+        :param cache: a DFMFitCache; unchanged data is then not fitted again, and appended data is warm-started. The
+            cache is kept for the training split of evaluate_outsample
+        :param refit: with a cache, whether appended data is optimized again or only filtered with the cached params
         """
-        self.model = sm.tsa.DynamicFactor(self.endog, k_factors=self.k_factors, factor_order=self.factor_order,
-                                          error_order=self.error_order)
-        self.result = self.model.fit()
+        if self.backend == 'pca':
+            self.model = TwoStepDynamicFactor(self.endog, k_factors=self.k_factors, factor_order=self.factor_order)
+            self.result = self.model.fit()
+            self.fit_status = 'fitted'
+        elif cache is None:
+            self.model = sm.tsa.DynamicFactor(self.endog, k_factors=self.k_factors, factor_order=self.factor_order,
+                                              error_order=self.error_order)
+            self.result = self.model.fit()
+            self.fit_status = 'fitted'
+        else:
+            self.cache = cache
+            self.result, self.fit_status = cache.fit(self.endog, self.k_factors, self.factor_order, self.error_order,
+                                                     refit=refit)
+            self.model = self.result.model
         return self.result.summary()
 
     def evaluate_insample(self):
         """
-        Evaluate in-sample fit using MAE, MSE, RMSE.
+        Evaluate in-sample fit using MAE, MSE, RMSE, MAPE.
         """
         if self.result is None:
             raise ValueError("Model not fitted yet. Call the `fit` method first.")
 
-        fitted_values = self.result.fittedvalues
-        metrics = {}
-        for col in self.endog.columns:
-            true_values = self.endog[col]
-            predicted_values = fitted_values[col]
-            metrics[col] = {
-                'MAE': mean_absolute_error(true_values, predicted_values),
-                'MSE': mean_squared_error(true_values, predicted_values),
-                'RMSE': np.sqrt(mean_squared_error(true_values, predicted_values))
-            }
-        self.in_sample_metrics = pd.DataFrame(metrics)
+        self.in_sample_metrics = error_metrics(self.endog, self.result.fittedvalues).drop(columns='n').T
+        return self.in_sample_metrics
 
     # ------------------------------------------
     # Out-of-Sample Forecast
@@ -78,25 +100,37 @@ class DFM:
 
     def evaluate_outsample(self, test_size=0.2):
         """
-        Evaluate out-of-sample forecasts using MAE, MSE, RMSE.
+        Evaluate out-of-sample forecasts using MAE, MSE, RMSE, MAPE. The model is refitted on the training set only and
+        forecasts the whole test set. The refit starts cold: the full-sample parameters have seen the test set. With the
+        cache of fit, an unchanged training split is not fitted again.
         """
-
-        if self.result is None or self.test_data is None:
-            raise ValueError("Model not fitted yet or data not split. Call the `fit` and `split_data` methods first.")
-
         self.split_data(test_size=test_size)
-
-        forecast_values = self.result.forecast(steps=len(self.test_data))
-        metrics = {}
-        for col in self.endog.columns:
-            true_values = self.test_data[col]
-            predicted_values = forecast_values[col]
-            metrics[col] = {
-                'MAE': mean_absolute_error(true_values, predicted_values),
-                'MSE': mean_squared_error(true_values, predicted_values),
-                'RMSE': np.sqrt(mean_squared_error(true_values, predicted_values))
-            }
-        self.out_of_sample_metrics = pd.DataFrame(metrics)
+        if self.backend == 'pca':
+            self.train_result = TwoStepDynamicFactor(self.train_data, self.k_factors, self.factor_order).fit()
+        elif self.cache is not None:
+            # the cache only warm-starts from fits of shorter prefixes of the training split, never the full sample
+            self.train_result, _ = self.cache.fit(self.train_data, self.k_factors, self.factor_order, self.error_order)
+        else:
+            self.train_result = fit_dynamic_factor(self.train_data.to_numpy(), self.k_factors, self.factor_order,
+                                                   self.error_order)
+
+        forecast_values = pd.DataFrame(np.asarray(self.train_result.forecast(steps=len(self.test_data))),
+                                       index=self.test_data.index, columns=self.endog.columns)
+        self.out_of_sample_metrics = error_metrics(self.test_data, forecast_values).drop(columns='n').T
+        return self.out_of_sample_metrics
+
+    def backtest(self, initial=None, step=1, horizons=(1,), window=None, max_workers=None, **fit_kwargs):
+        """
+        Rolling-origin out-of-sample evaluation with a refit at every origin, see rolling_origin_backtest.
+        :return: the tidy frame of forecasts; the metrics by variable and horizon are kept in backtest_metrics
+        """
+        if self.backend != 'statsmodels':
+            raise ValueError("The rolling-origin backtest refits the statsmodels backend only")
+        self.backtest_results = rolling_origin_backtest(
+            self.endog, self.k_factors, self.factor_order, self.error_order, initial=initial, step=step,
+            horizons=horizons, window=window, max_workers=max_workers, **fit_kwargs)
+        self.backtest_metrics = backtest_metrics(self.backtest_results)
+        return self.backtest_results
 
     # ------------------------------------------
     # Diagnostics
@@ -123,12 +157,16 @@ class DFM:
         if self.result is None:
             raise ValueError("Model not fitted yet. Call the `fit` method first.")
 
-        jb_test = {}
-        residuals = self.result.resid
-        for col in residuals.columns:
-            _, pvalue, _, _ = jarque_bera(residuals[col])
-            jb_test[col] = pvalue
-        return jb_test
+        return jarque_bera(self.result.resid)['jb_pvalue'].to_dict()
+
+    def diagnostics(self, lags=10, nlags=None):
+        """
+        In-sample error metrics, Jarque-Bera and Ljung-Box tests and residual autocorrelations of all series, in one
+        frame with a row per series.
+        """
+        if self.result is None:
+            raise ValueError("Model not fitted yet. Call the `fit` method first.")
+        return model_diagnostics(self.endog, self.result.fittedvalues, lags=lags, nlags=nlags)
 
     # ------------------------------------------
     # Comparisons
@@ -241,7 +279,8 @@ class DFM:
 
 
 class DFMConfig:
-    def __init__(self, data: pd.DataFrame, k_factors=1, factor_order=1, error_order=1, variable_names=None):
+    def __init__(self, data: pd.DataFrame, k_factors=1, factor_order=1, error_order=1, variable_names=None,
+                 backend='auto'):
         """
         Initialize the DFM configuration.
 
@@ -251,6 +290,7 @@ class DFMConfig:
         - k_factors: int, the number of unobserved factors
         - factor_order: int, the order of the factor AR model
         - error_order: int, the order of the AR errors
+        - backend: str, the estimation backend of DFM
         """
         if variable_names is None:
             variable_names = data.columns.tolist()
@@ -258,21 +298,24 @@ class DFMConfig:
         self.k_factors = k_factors
         self.factor_order = factor_order
         self.error_order = error_order
+        self.backend = backend
 
-    def run_DFM(self):
+    def run_DFM(self, cache=None):
         """
         Run the Dynamic Factor Model based on the given configuration.
+        :param cache: an optional DFMFitCache, see DFM.fit
         """
         # Initialize the DFM model
         dfm_model = DFM(
             endog=self.data,
             k_factors=self.k_factors,
             factor_order=self.factor_order,
-            error_order=self.error_order
+            error_order=self.error_order,
+            backend=self.backend
         )
 
         # Fit the model
-        dfm_model.fit()
+        dfm_model.fit(cache=cache)
 
         # Return the fitted model for further analysis
         return dfm_model
@@ -0,0 +1,137 @@
+import os, logging
+from concurrent.futures import ProcessPoolExecutor
+logger = logging.getLogger(__name__)
+
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+
+
+BACKTEST_COLUMNS = ['origin', 'horizon', 'date', 'variable', 'forecast', 'actual', 'error']
+
+
+def fit_dynamic_factor(endog, k_factors=1, factor_order=1, error_order=1, start_params=None, **fit_kwargs):
+    """
+    Fit a statsmodels DynamicFactor, optionally warm-started from the parameters of a previous fit
+    :param endog: array or dataframe of observations
+    """
+    model = sm.tsa.DynamicFactor(endog, k_factors=k_factors, factor_order=factor_order, error_order=error_order)
+    fit_kwargs.setdefault('disp', False)
+    return model.fit(start_params=start_params, **fit_kwargs)
+
+
+def forecast_origins(n_obs: int, initial: int, step: int = 1) -> list:
+    """
+    Positions of the forecast origins: the model of origin i is fitted on the observations before i, and forecasts
+    observations i, i + 1, ...
+    """
+    if initial < 1 or initial >= n_obs:
+        raise ValueError(f"initial must be between 1 and {n_obs - 1}, got {initial}")
+    return list(range(initial, n_obs, step))
+
+
+def _forecast(result, steps):
+    return np.asarray(result.forecast(steps=steps)).reshape(steps, -1)
+
+
+def _run_origins(values, origins, spec, horizons, window, start_params, fit_kwargs):
+    """
+    Fit the origins of one chunk in order, each fit warm-started from the parameters of the previous one. Runs in a
+    worker process, so it works on plain arrays.
+    :return: a list of (origin position, forecast matrix of max(horizons) x variables), and the parameters of the last
+        fit (start_params when no fit succeeded)
+    """
+    output = []
+    params = start_params
+    steps = max(horizons)
+    for origin in origins:
+        train = values[0 if window is None else max(0, origin - window):origin]
+        try:
+            result = fit_dynamic_factor(train, start_params=params, **spec, **fit_kwargs)
+        except Exception as e:
+            logger.warning(f"DFM fit failed at origin {origin}: {e}")
+            continue
+        params = result.params
+        output.append((origin, _forecast(result, steps)))
+    return output, params
+
+
+def rolling_origin_backtest(endog: pd.DataFrame, k_factors=1, factor_order=1, error_order=1, initial=None, step=1,
+                            horizons=(1,), window=None, max_workers=None, **fit_kwargs) -> pd.DataFrame:
+    """
+    Out-of-sample evaluation of a DynamicFactor specification over rolling forecast origins. At every origin the model
+    is refitted on the data before it only, so the forecasts never see the test period.
+
+    Every fit is warm-started from the nearest earlier fitted origin. The origins are split into contiguous chunks,
+    one per worker process: the first origin of each chunk is fitted here in order, each from the previous one, and
+    the workers then fit the rest of their chunk from it.
+    :param endog: dataframe of observations, dates x variables
+    :param initial: number of observations of the first training window, 80% of the sample by default
+    :param step: number of observations between two origins
+    :param horizons: forecast horizons to collect, in observations
+    :param window: length of a rolling training window, None for an expanding window
+    :param max_workers: number of worker processes, all cores by default, 1 to run in this process
+    :param fit_kwargs: passed to DynamicFactor.fit, e.g. maxiter
+    :return: one row per origin, horizon and variable, see BACKTEST_COLUMNS
+    """
+    values = endog.to_numpy(dtype='float64')
+    initial = int(len(endog) * 0.8) if initial is None else initial
+    origins = forecast_origins(len(endog), initial, step)
+    horizons = sorted(horizons)
+    spec = {'k_factors': k_factors, 'factor_order': factor_order, 'error_order': error_order}
+
+    first_train = values[0 if window is None else max(0, origins[0] - window):origins[0]]
+    first = fit_dynamic_factor(first_train, **spec, **fit_kwargs)
+    forecasts = [(origins[0], _forecast(first, max(horizons)))]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunks = [list(c) for c in np.array_split(origins, min(max_workers, len(origins)))]
+    if len(chunks) == 1:
+        forecasts += _run_origins(values, origins[1:], spec, horizons, window, first.params, fit_kwargs)[0]
+    else:
+        seeds = [first.params]
+        for chunk in chunks[1:]:
+            anchor, params = _run_origins(values, chunk[:1], spec, horizons, window, seeds[-1], fit_kwargs)
+            forecasts += anchor
+            seeds.append(params)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_run_origins, values, chunk[1:], spec, horizons, window, seed, fit_kwargs)
+                       for chunk, seed in zip(chunks, seeds)]
+            forecasts += [item for future in futures for item in future.result()[0]]
+    forecasts.sort(key=lambda item: item[0])
+
+    # gather the (origin, horizon, variable) cells that have an actual value
+    n_obs, n_vars = values.shape
+    positions, steps, blocks = [], [], []
+    for origin, forecast in forecasts:
+        for h in horizons:
+            if origin + h - 1 < n_obs:
+                positions.append(origin)
+                steps.append(h)
+                blocks.append(forecast[h - 1])
+    if not blocks:
+        return pd.DataFrame(columns=BACKTEST_COLUMNS)
+    positions, steps = np.repeat(positions, n_vars), np.repeat(steps, n_vars)
+    targets = positions + steps - 1
+    forecast = np.concatenate(blocks)
+    actual = values[targets, np.tile(np.arange(n_vars), len(blocks))]
+    return pd.DataFrame({
+        'origin': endog.index[positions - 1],
+        'horizon': steps,
+        'date': endog.index[targets],
+        'variable': np.tile(endog.columns.to_numpy(), len(blocks)),
+        'forecast': forecast,
+        'actual': actual,
+        'error': actual - forecast,
+    })
+
+
+def backtest_metrics(backtest: pd.DataFrame) -> pd.DataFrame:
+    """
+    MAE, MSE and RMSE of the backtest forecasts by variable and horizon
+    """
+    errors = backtest.assign(abs_error=backtest['error'].abs(), sq_error=backtest['error'] ** 2)
+    metrics = errors.groupby(['variable', 'horizon']).agg(MAE=('abs_error', 'mean'), MSE=('sq_error', 'mean'),
+                                                          n=('error', 'count'))
+    metrics.insert(2, 'RMSE', np.sqrt(metrics['MSE']))
+    return metrics
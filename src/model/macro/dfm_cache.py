@@ -0,0 +1,118 @@
+import json, hashlib, logging
+from pathlib import Path
+logger = logging.getLogger(__name__)
+
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+
+import src.config as cfg
+from src.model.macro.dfm_backtest import fit_dynamic_factor
+
+
+DFM_CACHE_DIR = cfg.MACRO_CACHE_DIR / 'dfm'
+
+
+def row_hashes(endog: pd.DataFrame) -> np.ndarray:
+    """
+    One uint64 hash per observation, covering the index and the values
+    """
+    return pd.util.hash_pandas_object(endog, index=True).to_numpy()
+
+
+def data_hash(hashes: np.ndarray) -> str:
+    return hashlib.sha256(np.ascontiguousarray(hashes).tobytes()).hexdigest()
+
+
+class DFMFitCache:
+    """
+    Fitted DynamicFactor parameters on disk, one json file per dataset and specification (k_factors, factor_order,
+    error_order): the files of a set of variables and specification are grouped in a directory, and named by the hash
+    of the data the parameters were fitted on.
+
+    The same data is not fitted again: the model is only smoothed with the cached parameters. Data extending cached
+    data with new observations starts the optimizer from the parameters of the longest cached prefix, or, with
+    refit=False, appends the new observations to that cached result without any optimization. Such appended entries
+    are saved as not optimized, and a later refit=True call on the same data optimizes them from their parameters.
+    """
+
+    def __init__(self, cache_dir=DFM_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _dir(self, endog, spec) -> Path:
+        key = json.dumps({'columns': [str(c) for c in endog.columns], **spec}, sort_keys=True)
+        return self.cache_dir / f"dfm_{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}"
+
+    def _path(self, endog, spec, digest) -> Path:
+        return self._dir(endog, spec) / f"{digest[:16]}.json"
+
+    def lookup(self, endog, spec):
+        """
+        :return: the cached entry and how it matches the data: 'exact', 'prefix' (the data extends the cached data,
+            the longest such entry), or (None, None)
+        """
+        hashes = row_hashes(endog)
+        path = self._path(endog, spec, data_hash(hashes))
+        if path.exists():
+            entry = json.loads(path.read_text())
+            if entry['nobs'] == len(endog) and entry['data_hash'] == data_hash(hashes):
+                return entry, 'exact'
+        best = None
+        for path in self._dir(endog, spec).glob('*.json'):
+            entry = json.loads(path.read_text())
+            nobs = entry['nobs']
+            if nobs < len(endog) and (best is None or nobs > best['nobs']) \
+                    and entry['data_hash'] == data_hash(hashes[:nobs]):
+                best = entry
+        return (best, 'prefix') if best is not None else (None, None)
+
+    def save(self, endog, spec, result, optimized=True):
+        digest = data_hash(row_hashes(endog))
+        path = self._path(endog, spec, digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({
+            **spec,
+            'columns': [str(c) for c in endog.columns],
+            'nobs': len(endog),
+            'data_hash': digest,
+            'param_names': list(result.model.param_names),
+            'params': np.asarray(result.params, dtype='float64').tolist(),
+            'llf': float(result.llf),
+            'optimized': optimized,
+            'saved_at': pd.Timestamp.now().isoformat(),
+        }, indent=2))
+
+    def fit(self, endog: pd.DataFrame, k_factors=1, factor_order=1, error_order=1, refit=True, **fit_kwargs):
+        """
+        Fit a DynamicFactor through the cache.
+        :param refit: when the data extends the cached data, optimize again from the cached parameters; otherwise
+            keep the cached parameters and only append the new observations
+        :return: the results and how they were obtained: 'cached', 'appended', 'warm_started' or 'fitted'
+        """
+        spec = {'k_factors': k_factors, 'factor_order': factor_order, 'error_order': error_order}
+        entry, match = self.lookup(endog, spec)
+        params = None if entry is None else np.asarray(entry['params'])
+
+        if match == 'exact' and (entry.get('optimized', True) or not refit):
+            return sm.tsa.DynamicFactor(endog, **spec).smooth(params), 'cached'
+        if match == 'exact':
+            result = fit_dynamic_factor(endog, start_params=params, **spec, **fit_kwargs)
+            status = 'warm_started'
+        elif match == 'prefix' and not refit:
+            nobs = entry['nobs']
+            try:
+                result = sm.tsa.DynamicFactor(endog.iloc[:nobs], **spec).smooth(params).append(endog.iloc[nobs:])
+            except ValueError:
+                # append needs an index that extends the cached one, otherwise filter the whole sample
+                result = sm.tsa.DynamicFactor(endog, **spec).smooth(params)
+            status = 'appended'
+        elif match == 'prefix':
+            result = fit_dynamic_factor(endog, start_params=params, **spec, **fit_kwargs)
+            status = 'warm_started'
+        else:
+            result = fit_dynamic_factor(endog, **spec, **fit_kwargs)
+            status = 'fitted'
+        self.save(endog, spec, result, optimized=status != 'appended')
+        logger.info(f"DFM {spec} on {endog.shape[0]} x {endog.shape[1]}: {status}")
+        return result, status
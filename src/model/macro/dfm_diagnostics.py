@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2
+
+
+def _values(frame):
+    return np.asarray(frame, dtype='float64')
+
+
+def error_metrics(actual, predicted) -> pd.DataFrame:
+    """
+    MAE, MSE, RMSE and MAPE (in percent) of every series at once, ignoring missing values
+    :param actual: dataframe of observations, dates x series
+    :param predicted: predictions of the same shape, aligned by position
+    :return: one row per series
+    """
+    y = _values(actual)
+    error = y - _values(predicted)
+    abs_error = np.abs(error)
+    mse = np.nanmean(error ** 2, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ape = np.where(y != 0, abs_error / np.abs(y), np.nan)
+    return pd.DataFrame({
+        'MAE': np.nanmean(abs_error, axis=0),
+        'MSE': mse,
+        'RMSE': np.sqrt(mse),
+        'MAPE': 100 * np.nanmean(ape, axis=0),
+        'n': np.sum(~np.isnan(error), axis=0),
+    }, index=pd.Index(actual.columns, name='variable'))
+
+
+def acf(resid, nlags=20) -> np.ndarray:
+    """
+    Sample autocorrelations of every column up to nlags, computed with one FFT over the residual matrix. Missing
+    values are set to the column mean.
+    :return: an array of (nlags + 1) x series, lag 0 first
+    """
+    x = _values(resid)
+    x = np.nan_to_num(x - np.nanmean(x, axis=0))
+    n_obs = len(x)
+    spectrum = np.fft.rfft(x, n=2 * n_obs, axis=0)
+    autocov = np.fft.irfft(spectrum * np.conj(spectrum), n=2 * n_obs, axis=0)[:nlags + 1]
+    return autocov / autocov[0]
+
+
+def jarque_bera(resid) -> pd.DataFrame:
+    """
+    Jarque-Bera normality test of every column, ignoring missing values
+    """
+    x = _values(resid)
+    n = np.sum(~np.isnan(x), axis=0)
+    d = x - np.nanmean(x, axis=0)
+    m2 = np.nanmean(d ** 2, axis=0)
+    skew = np.nanmean(d ** 3, axis=0) / m2 ** 1.5
+    kurtosis = np.nanmean(d ** 4, axis=0) / m2 ** 2
+    stat = n / 6 * (skew ** 2 + (kurtosis - 3) ** 2 / 4)
+    return pd.DataFrame({'jb_stat': stat, 'jb_pvalue': chi2.sf(stat, 2), 'skew': skew, 'kurtosis': kurtosis},
+                        index=pd.Index(resid.columns, name='variable'))
+
+
+def ljung_box(resid, lags=10, autocorr=None) -> pd.DataFrame:
+    """
+    Ljung-Box test of no autocorrelation up to lags of every column
+    :param autocorr: autocorrelations from acf, computed when not given
+    """
+    autocorr = acf(resid, lags) if autocorr is None else autocorr
+    n_obs = len(resid)
+    weights = 1.0 / (n_obs - np.arange(1, lags + 1))
+    stat = n_obs * (n_obs + 2) * (weights @ autocorr[1:lags + 1] ** 2)
+    return pd.DataFrame({'lb_stat': stat, 'lb_pvalue': chi2.sf(stat, lags)},
+                        index=pd.Index(resid.columns, name='variable'))
+
+
+def residual_diagnostics(resid, lags=10, nlags=None) -> pd.DataFrame:
+    """
+    Jarque-Bera and Ljung-Box tests, and the autocorrelations (acf_1 ... acf_nlags), of every residual series
+    :return: one row per series
+    """
+    nlags = lags if nlags is None else nlags
+    autocorr = acf(resid, max(lags, nlags))
+    acfs = pd.DataFrame(autocorr[1:nlags + 1].T, index=pd.Index(resid.columns, name='variable'),
+                        columns=[f"acf_{i}" for i in range(1, nlags + 1)])
+    return pd.concat([jarque_bera(resid), ljung_box(resid, lags, autocorr), acfs], axis=1)
+
+
+def model_diagnostics(actual, fitted, lags=10, nlags=None) -> pd.DataFrame:
+    """
+    Error metrics and residual diagnostics of a fit, for all series in one frame
+    """
+    resid = pd.DataFrame(_values(actual) - _values(fitted), index=actual.index, columns=actual.columns)
+    return pd.concat([error_metrics(actual, fitted), residual_diagnostics(resid, lags, nlags)], axis=1)
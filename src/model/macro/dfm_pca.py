@@ -0,0 +1,239 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import solve_discrete_lyapunov
+
+# initial variance of the factors when their VAR is not stationary, an approximate diffuse initialization
+DIFFUSE_STATE_VARIANCE = 1e6
+
+
+def standardize(values: np.ndarray):
+    """
+    :return: the columns scaled to zero mean and unit variance, ignoring missing values, with their means and stds
+    """
+    mean = np.nanmean(values, axis=0)
+    std = np.nanstd(values, axis=0)
+    std = np.where(std > 0, std, 1.0)
+    return (values - mean) / std, mean, std
+
+
+def pca_em(z: np.ndarray, k_factors: int, max_iter: int = 100, tol: float = 1e-6):
+    """
+    Principal component factors of a standardized panel with missing values: the missing entries start at zero and
+    are replaced by their common component until the fill converges (Stock and Watson, 2002).
+    :return: loadings (N x k), factors (T x k) normalized to F'F / T = I, and the number of iterations
+    """
+    missing = np.isnan(z)
+    x = np.where(missing, 0.0, z)
+    n_obs = len(z)
+    for iteration in range(1, max_iter + 1):
+        u, s, _ = np.linalg.svd(x, full_matrices=False)
+        factors = np.sqrt(n_obs) * u[:, :k_factors]
+        loadings = x.T @ factors / n_obs
+        if not missing.any():
+            break
+        common = factors @ loadings.T
+        change = np.sum((common[missing] - x[missing]) ** 2) / max(np.sum(x[missing] ** 2), 1e-12)
+        x[missing] = common[missing]
+        if change < tol:
+            break
+    return loadings, factors, iteration
+
+
+def fit_var(factors: np.ndarray, order: int):
+    """
+    OLS estimate of a VAR(order) without constant on the factors
+    :return: the coefficients (k x k * order, lag 1 first) and the innovation covariance (k x k)
+    """
+    k = factors.shape[1]
+    lags = np.hstack([factors[order - i - 1:len(factors) - i - 1] for i in range(order)])
+    target = factors[order:]
+    coefs = np.linalg.lstsq(lags, target, rcond=None)[0].T
+    resid = target - lags @ coefs.T
+    cov = resid.T @ resid / len(resid)
+    return coefs, cov + 1e-8 * np.eye(k)
+
+
+class TwoStepDynamicFactor:
+    """
+    Dynamic factor model for large panels, estimated in two steps (Doz, Giannone and Reichlin, 2011):
+        1. loadings, factors and idiosyncratic variances by principal components of the standardized panel, with the
+           missing values filled by EM, and a VAR on the factors
+        2. the factors re-estimated by a Kalman smoother given these parameters, which handles missing observations
+           and ragged edges directly
+
+    The observation update uses the diagonal idiosyncratic covariance, so that every step only solves k x k systems
+    and the cost grows linearly with the number of series. The idiosyncratic errors are white noise.
+    """
+
+    def __init__(self, endog: pd.DataFrame, k_factors=1, factor_order=1, max_iter=100, tol=1e-6):
+        self.endog = endog
+        self.k_factors = k_factors
+        self.factor_order = factor_order
+        self.max_iter = max_iter
+        self.tol = tol
+
+    def fit(self) -> 'TwoStepDynamicFactorResults':
+        z, mean, std = standardize(self.endog.to_numpy(dtype='float64'))
+        loadings, factors, n_iter = pca_em(z, self.k_factors, self.max_iter, self.tol)
+        resid = z - factors @ loadings.T
+        idio_var = np.maximum(np.nanmean(resid ** 2, axis=0), 1e-4)
+        coefs, factor_cov = fit_var(factors, self.factor_order)
+        logger.info(f"Two-step DFM: {z.shape[1]} series, {self.k_factors} factors, EM converged in {n_iter} iterations")
+        return TwoStepDynamicFactorResults(self, z, mean, std, loadings, idio_var, coefs, factor_cov)
+
+
+class TwoStepDynamicFactorResults:
+    """
+    Kalman filter and smoother of a TwoStepDynamicFactor, with the same results interface as the statsmodels
+    DynamicFactor results used by DFM: fittedvalues, resid, llf, aic, bic, forecast, impulse_responses and summary.
+
+    The filter starts from the unconditional distribution of the factors when their VAR is stationary. Otherwise,
+    e.g. on trending data, there is none: a warning is logged and the filter starts from an approximate diffuse
+    initialization, so the likelihood and forecasts are not comparable with those of a stationary fit.
+    """
+
+    def __init__(self, model, z, mean, std, loadings, idio_var, coefs, factor_cov):
+        self.model = model
+        self.mean, self.std = mean, std
+        self.loadings, self.idio_var = loadings, idio_var
+        self.coefs, self.factor_cov = coefs, factor_cov
+        self.nobs = len(z)
+
+        k, p = model.k_factors, model.factor_order
+        self.transition = np.zeros((k * p, k * p))
+        self.transition[:k] = coefs
+        self.transition[k:, :-k] = np.eye(k * (p - 1))
+        self.state_cov = np.zeros((k * p, k * p))
+        self.state_cov[:k, :k] = factor_cov
+        # the eigenvalues of the companion matrix are the inverse roots of the VAR
+        max_root = np.abs(np.linalg.eigvals(self.transition)).max()
+        self.stationary = bool(max_root < 1)
+        if not self.stationary:
+            logger.warning(f"Two-step DFM: the factor VAR is not stationary (largest root modulus {max_root:.4f}), "
+                           f"using a diffuse initialization")
+        self._filter(z)
+        self._smooth()
+
+    def _filter(self, z):
+        n_obs, k = len(z), self.model.k_factors
+        m = len(self.transition)
+        a = np.zeros(m)
+        if self.stationary:
+            P = solve_discrete_lyapunov(self.transition, self.state_cov)
+        else:
+            P = DIFFUSE_STATE_VARIANCE * np.eye(m)
+        self.predicted_state, self.predicted_cov = np.zeros((n_obs, m)), np.zeros((n_obs, m, m))
+        self.filtered_state, self.filtered_cov = np.zeros((n_obs, m)), np.zeros((n_obs, m, m))
+        llf_obs = np.zeros(n_obs)
+        for t in range(n_obs):
+            if t > 0:
+                a = self.transition @ a
+                P = self.transition @ P @ self.transition.T + self.state_cov
+            self.predicted_state[t], self.predicted_cov[t] = a, P
+            observed = ~np.isnan(z[t])
+            if observed.any():
+                # Woodbury identities on F = L Pff L' + R, R diagonal: only k x k systems are solved
+                L, r_inv = self.loadings[observed], 1.0 / self.idio_var[observed]
+                v = z[t, observed] - L @ a[:k]
+                M = L.T @ (r_inv[:, None] * L)
+                b = L.T @ (r_inv * v)
+                Pff = P[:k, :k]
+                G = np.linalg.solve(np.eye(k) + Pff @ M, Pff)
+                a = a + P[:, :k] @ (b - M @ G @ b)
+                P = P - P[:, :k] @ (M - M @ G @ M) @ P[:k, :]
+                logdet = np.sum(np.log(self.idio_var[observed])) + np.linalg.slogdet(np.eye(k) + Pff @ M)[1]
+                llf_obs[t] = -0.5 * (observed.sum() * np.log(2 * np.pi) + logdet + v @ (r_inv * v) - b @ G @ b)
+            self.filtered_state[t], self.filtered_cov[t] = a, P
+        self.llf_obs = llf_obs
+        self.llf = float(llf_obs.sum())
+
+    def _smooth(self):
+        smoothed = self.filtered_state.copy()
+        for t in range(self.nobs - 2, -1, -1):
+            gain = self.filtered_cov[t] @ self.transition.T @ np.linalg.pinv(self.predicted_cov[t + 1])
+            smoothed[t] = self.filtered_state[t] + gain @ (smoothed[t + 1] - self.predicted_state[t + 1])
+        self.smoothed_state = smoothed
+
+    def _to_frame(self, z, index):
+        return pd.DataFrame(self.mean + self.std * z, index=index, columns=self.model.endog.columns)
+
+    @property
+    def factors(self) -> pd.DataFrame:
+        k = self.model.k_factors
+        return pd.DataFrame(self.smoothed_state[:, :k], index=self.model.endog.index,
+                            columns=[f"factor_{i + 1}" for i in range(k)])
+
+    @property
+    def fittedvalues(self) -> pd.DataFrame:
+        """
+        One-step-ahead predictions, as for statsmodels state space results
+        """
+        k = self.model.k_factors
+        return self._to_frame(self.predicted_state[:, :k] @ self.loadings.T, self.model.endog.index)
+
+    @property
+    def smoothed_values(self) -> pd.DataFrame:
+        k = self.model.k_factors
+        return self._to_frame(self.smoothed_state[:, :k] @ self.loadings.T, self.model.endog.index)
+
+    @property
+    def resid(self) -> pd.DataFrame:
+        return self.model.endog - self.fittedvalues
+
+    @property
+    def k_params(self) -> int:
+        n, k, p = len(self.loadings), self.model.k_factors, self.model.factor_order
+        return n * k + n + k * k * p + k * (k + 1) // 2
+
+    @property
+    def aic(self) -> float:
+        return -2 * self.llf + 2 * self.k_params
+
+    @property
+    def bic(self) -> float:
+        return -2 * self.llf + self.k_params * np.log(self.nobs)
+
+    def _future_index(self, steps):
+        index = self.model.endog.index
+        if isinstance(index, pd.DatetimeIndex) and len(index) > 2:
+            freq = index.freq or pd.infer_freq(index)
+            if freq is not None:
+                return pd.date_range(index[-1], periods=steps + 1, freq=freq)[1:]
+        return pd.RangeIndex(self.nobs, self.nobs + steps)
+
+    def forecast(self, steps=1) -> pd.DataFrame:
+        k = self.model.k_factors
+        state, path = self.filtered_state[-1], np.zeros((steps, k))
+        for h in range(steps):
+            state = self.transition @ state
+            path[h] = state[:k]
+        return self._to_frame(path @ self.loadings.T, self._future_index(steps))
+
+    def impulse_responses(self, steps=1, impulse=0) -> pd.DataFrame:
+        """
+        Responses of the series, in their own units, to a one standard deviation orthogonalized shock to a factor
+        :return: steps + 1 rows, the impact first
+        """
+        k = self.model.k_factors
+        state = np.zeros(len(self.transition))
+        state[:k] = np.linalg.cholesky(self.factor_cov)[:, impulse]
+        path = np.zeros((steps + 1, k))
+        for h in range(steps + 1):
+            path[h] = state[:k]
+            state = self.transition @ state
+        return pd.DataFrame(self.std * (path @ self.loadings.T), columns=self.model.endog.columns)
+
+    def summary(self) -> str:
+        k = self.model.k_factors
+        loadings = pd.DataFrame(self.loadings, index=self.model.endog.columns,
+                                columns=[f"factor_{i + 1}" for i in range(k)])
+        loadings['idiosyncratic_var'] = self.idio_var
+        header = (f"Two-step dynamic factor model: {len(self.loadings)} series, {self.nobs} observations, {k} factors, "
+                  f"VAR({self.model.factor_order})\n"
+                  f"Log likelihood {self.llf:.3f}, AIC {self.aic:.3f}, BIC {self.bic:.3f}\n")
+        if not self.stationary:
+            header += "Warning: the factor VAR is not stationary, the filter used a diffuse initialization\n"
+        return header + loadings.to_string()
@@ -0,0 +1,203 @@
+import os, time, math, json, hashlib, logging, warnings
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+logger = logging.getLogger(__name__)
+
+import numpy as np
+import pandas as pd
+
+from src.model.macro.dfm_backtest import fit_dynamic_factor
+from src.model.macro.dfm_cache import DFM_CACHE_DIR, row_hashes, data_hash
+
+
+SEARCH_COLUMNS = ['model', 'variable', 'k_factors', 'factor_order', 'error_order', 'arima_order', 'maxiter', 'status',
+                  'llf', 'aic', 'bic', 'mae', 'rmse', 'seconds']
+SpecSearch = namedtuple('SpecSearch', ['ranking', 'arima'])
+
+
+class FitTimeout(Exception):
+    pass
+
+
+def _deadline(timeout):
+    """
+    Optimizer callback aborting a fit that runs longer than timeout seconds. It is only checked between optimizer
+    iterations, so a single slow iteration can overrun it: it is not a hard limit on a fit.
+    """
+    start = time.perf_counter()
+
+    def callback(*args):
+        if timeout is not None and time.perf_counter() - start > timeout:
+            raise FitTimeout(f"fit exceeded {timeout}s")
+    return callback
+
+
+def _errors(actual, forecast):
+    error = np.asarray(actual, dtype='float64') - np.asarray(forecast, dtype='float64')
+    return np.nanmean(np.abs(error)), np.sqrt(np.nanmean(error ** 2))
+
+
+def evaluate_candidate(candidate, train, test, timeout=None):
+    """
+    Fit one candidate on the training set, and forecast the test set. Runs in a worker process.
+    :param candidate: a row of the search, with model 'DFM' or 'ARIMA'
+    :param train: training observations, dates x variables array
+    :param test: test observations, dates x variables array
+    :return: the candidate with its status, information criteria and forecast errors
+    """
+    row = dict(candidate)
+    start = time.perf_counter()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            if row['model'] == 'DFM':
+                result = fit_dynamic_factor(train, row['k_factors'], row['factor_order'], row['error_order'],
+                                            maxiter=row['maxiter'], callback=_deadline(timeout))
+            else:
+                from statsmodels.tsa.arima.model import ARIMA
+                column = row['column']
+                result = ARIMA(train[:, column], order=tuple(row['arima_order'])).fit(
+                    method_kwargs={'maxiter': row['maxiter'], 'callback': _deadline(timeout)})
+                test = test[:, [column]]
+            forecast = np.asarray(result.forecast(steps=len(test))).reshape(len(test), -1)
+        row['mae'], row['rmse'] = _errors(test, forecast)
+        row.update(status='ok', llf=float(result.llf), aic=float(result.aic), bic=float(result.bic))
+    except FitTimeout:
+        row['status'] = 'timeout'
+    except Exception as e:
+        row['status'] = f"failed: {e}"
+    row['seconds'] = time.perf_counter() - start
+    return row
+
+
+def _candidate_key(row):
+    key = {k: row.get(k) for k in ['model', 'variable', 'arima_order']}
+    # integer columns holding None come back from parquet as floats
+    key.update({k: None if row.get(k) is None else int(row[k])
+                for k in ['k_factors', 'factor_order', 'error_order', 'maxiter']})
+    key['arima_order'] = None if key['arima_order'] is None else [int(x) for x in key['arima_order']]
+    return json.dumps(key)
+
+
+class SpecSearchCache:
+    """
+    Results of the candidates already evaluated on one dataset and split, in a parquet file per dataset, so that a
+    wider grid only fits the new cells. Only successful fits are kept: candidates that timed out or failed are fitted
+    again by the next search, e.g. with a longer timeout.
+    """
+
+    def __init__(self, cache_dir=DFM_CACHE_DIR / 'search'):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, endog, test_size) -> Path:
+        key = hashlib.sha256(f"{data_hash(row_hashes(endog))}|{test_size}".encode('utf-8')).hexdigest()
+        return self.cache_dir / f"search_{key[:16]}.parquet"
+
+    def load(self, endog, test_size) -> dict:
+        path = self._path(endog, test_size)
+        if not path.exists():
+            return {}
+        df = pd.read_parquet(path)
+        df = df[df['status'] == 'ok']
+        df['arima_order'] = df['arima_order'].map(lambda x: json.loads(x) if isinstance(x, str) else None)
+        rows = df.astype(object).where(df.notna(), None).to_dict('records')
+        return {_candidate_key(row): row for row in rows}
+
+    def save(self, endog, test_size, results: dict):
+        df = pd.DataFrame([r for r in results.values() if r['status'] == 'ok'], columns=SEARCH_COLUMNS)
+        df['arima_order'] = df['arima_order'].map(lambda x: None if x is None else json.dumps(list(x)))
+        df.to_parquet(self._path(endog, test_size), index=False)
+
+
+def dfm_candidates(k_factors, factor_orders, error_orders, maxiter):
+    return [{'model': 'DFM', 'variable': None, 'k_factors': k, 'factor_order': p, 'error_order': q,
+             'arima_order': None, 'maxiter': maxiter}
+            for k in k_factors for p in factor_orders for q in error_orders]
+
+
+def arima_candidates(columns, arima_orders, maxiter):
+    return [{'model': 'ARIMA', 'variable': str(c), 'k_factors': None, 'factor_order': None, 'error_order': None,
+             'arima_order': list(order), 'maxiter': maxiter}
+            for order in arima_orders for c in columns]
+
+
+def _run(candidates, endog, test_size, timeout, max_workers, cache, results):
+    """
+    Evaluate the candidates missing from results in a process pool, and add them to results
+    """
+    cutoff = int(len(endog) * (1 - test_size))
+    values = endog.to_numpy(dtype='float64')
+    columns = [str(c) for c in endog.columns]
+    todo = [c for c in candidates if _candidate_key(c) not in results]
+    for c in todo:
+        c['column'] = columns.index(c['variable']) if c['model'] == 'ARIMA' else None
+    if todo:
+        logger.info(f"Spec search: fitting {len(todo)} of {len(candidates)} candidates")
+        args = (values[:cutoff], values[cutoff:], timeout)
+        if max_workers == 1:
+            rows = [evaluate_candidate(c, *args) for c in todo]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                rows = list(executor.map(evaluate_candidate, todo, *[[a] * len(todo) for a in args]))
+        for row in rows:
+            row.pop('column', None)
+            results[_candidate_key(row)] = {k: row.get(k) for k in SEARCH_COLUMNS}
+        if cache is not None:
+            cache.save(endog, test_size, results)
+    return [results[_candidate_key(c)] for c in candidates]
+
+
+def spec_search(endog: pd.DataFrame, k_factors=(1, 2), factor_orders=(1, 2), error_orders=(1,),
+                arima_orders=((1, 0, 1),), test_size=0.2, method='grid', maxiter=500, min_maxiter=50, eta=3,
+                timeout=60, max_workers=None, cache=None) -> SpecSearch:
+    """
+    Rank DynamicFactor specifications, and per-variable ARIMA models, by their information criteria on the training
+    set and their forecast errors on the test set.
+    :param method: 'grid' fits every DFM candidate with maxiter iterations; 'halving' fits them all with min_maxiter
+        iterations, keeps the best 1/eta by BIC, and repeats with eta times the iterations until maxiter
+    :param timeout: seconds after which a single fit is aborted and marked 'timeout', checked between optimizer
+        iterations
+    :param max_workers: number of worker processes, all cores by default, 1 to run in this process
+    :param cache: a SpecSearchCache; candidates already evaluated on the same data and split are not fitted again
+    :return: SpecSearch of the ranking (DFM candidates, and every ARIMA order with its criteria summed over the
+        variables) and of the ARIMA results per variable
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    results = {} if cache is None else cache.load(endog, test_size)
+    run = lambda candidates: _run(candidates, endog, test_size, timeout, max_workers, cache, results)
+
+    if method == 'grid':
+        dfm_rows = run(dfm_candidates(k_factors, factor_orders, error_orders, maxiter))
+    elif method == 'halving':
+        candidates = dfm_candidates(k_factors, factor_orders, error_orders, min(min_maxiter, maxiter))
+        while True:
+            dfm_rows = run(candidates)
+            budget = candidates[0]['maxiter']
+            if budget >= maxiter or len(candidates) == 1:
+                break
+            survivors = sorted(dfm_rows, key=lambda r: np.inf if r['bic'] is None else r['bic'])
+            survivors = [r for r in survivors[:math.ceil(len(survivors) / eta)] if r['status'] == 'ok'] or survivors[:1]
+            candidates = [{**{k: r[k] for k in ['model', 'variable', 'k_factors', 'factor_order', 'error_order',
+                                                'arima_order']}, 'maxiter': min(budget * eta, maxiter)}
+                          for r in survivors]
+    else:
+        raise ValueError(f"method must be 'grid' or 'halving', got {method}")
+
+    arima = pd.DataFrame(run(arima_candidates(endog.columns, arima_orders, maxiter)), columns=SEARCH_COLUMNS)
+    arima['arima_order'] = arima['arima_order'].map(lambda x: None if x is None else tuple(x))
+
+    # univariate models are independent, so their log-likelihoods and criteria add up over the variables
+    summed = arima.groupby('arima_order', sort=False).agg(
+        llf=('llf', 'sum'), aic=('aic', 'sum'), bic=('bic', 'sum'), mae=('mae', 'mean'), seconds=('seconds', 'sum'),
+        status=('status', lambda s: 'ok' if (s == 'ok').all() else 'partial'), maxiter=('maxiter', 'first'))
+    summed = summed.reset_index().assign(model='ARIMA', variable=None)
+    summed['rmse'] = arima.groupby('arima_order', sort=False)['rmse'].apply(lambda x: np.sqrt((x ** 2).mean())).values
+
+    ranking = pd.concat([pd.DataFrame(dfm_rows, columns=SEARCH_COLUMNS), summed.reindex(columns=SEARCH_COLUMNS)],
+                        ignore_index=True)
+    ranking[['llf', 'aic', 'bic', 'mae', 'rmse']] = ranking[['llf', 'aic', 'bic', 'mae', 'rmse']].astype('float64')
+    ranking = ranking.sort_values(['bic', 'rmse'], na_position='last', ignore_index=True)
+    ranking.insert(0, 'rank', np.arange(1, len(ranking) + 1))
+    return SpecSearch(ranking, arima)
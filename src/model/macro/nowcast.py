@@ -0,0 +1,124 @@
+import logging, warnings
+logger = logging.getLogger(__name__)
+
+import pandas as pd
+import statsmodels.api as sm
+
+
+def to_period_frame(data: pd.DataFrame, freq: str, how='mean') -> pd.DataFrame:
+    """
+    Aggregate series of any higher frequency (daily, weekly, ...) to periods of freq ('M' or 'Q'), keeping the
+    missing periods, e.g. the ragged edge of series not published yet, as NaN.
+    :param how: aggregation of the observations within a period, e.g. 'mean' for rates, 'last' for stocks
+    """
+    if isinstance(data.index, pd.PeriodIndex):
+        index = data.index.asfreq(freq, how='end')
+    else:
+        index = pd.DatetimeIndex(data.index).to_period(freq)
+    output = data.groupby(index).agg(how)
+    full = pd.period_range(output.index.min(), output.index.max(), freq=freq)
+    return output.reindex(full)
+
+
+def _month(period) -> pd.Period:
+    period = pd.Period(period)
+    return period.asfreq('M', how='end') if period.freqstr != 'M' else period
+
+
+class Nowcaster:
+    """
+    Mixed-frequency nowcasting with a dynamic factor model of monthly and quarterly series (statsmodels
+    DynamicFactorMQ): quarterly series are tied to the monthly factors by the Mariano-Murasawa aggregation
+    constraint, and every missing observation, including the ragged edge of late releases, is handled by the Kalman
+    filter instead of being dropped.
+
+    The parameters are estimated once by EM in fit. New releases are absorbed by update, which runs the filter over
+    the new vintage with the same parameters and decomposes the revision of the nowcast into the news of each release.
+    """
+
+    def __init__(self, monthly: pd.DataFrame, quarterly: pd.DataFrame = None, factors=1, factor_orders=1,
+                 idiosyncratic_ar1=True, how='mean'):
+        """
+        :param monthly: series of monthly or higher frequency, aggregated to months with how
+        :param quarterly: quarterly series, e.g. GDP growth, indexed by any date within the quarter
+        """
+        self.factors = factors
+        self.factor_orders = factor_orders
+        self.idiosyncratic_ar1 = idiosyncratic_ar1
+        self.how = how
+        self.monthly, self.quarterly = self._prepare(monthly, quarterly)
+        self.results = None
+        self.vintages = []
+
+    def _prepare(self, monthly, quarterly):
+        monthly = to_period_frame(monthly, 'M', self.how)
+        if quarterly is None:
+            return monthly, None
+        quarterly = to_period_frame(quarterly, 'Q', 'last')
+        # both panels span the same months, from the first month of the first quarter to the last month of the last
+        start = min(monthly.index.min(), quarterly.index.min().asfreq('M', how='start'))
+        end = max(monthly.index.max(), quarterly.index.max().asfreq('M', how='end'))
+        monthly = monthly.reindex(pd.period_range(start, end, freq='M'))
+        quarterly = quarterly.reindex(pd.period_range(start.asfreq('Q'), end.asfreq('Q'), freq='Q'))
+        return monthly, quarterly
+
+    @property
+    def variables(self) -> list:
+        return list(self.monthly.columns) + ([] if self.quarterly is None else list(self.quarterly.columns))
+
+    def fit(self, maxiter=500, **fit_kwargs):
+        model = sm.tsa.DynamicFactorMQ(self.monthly, endog_quarterly=self.quarterly, factors=self.factors,
+                                       factor_orders=self.factor_orders, idiosyncratic_ar1=self.idiosyncratic_ar1)
+        fit_kwargs.setdefault('disp', False)
+        self.results = model.fit(maxiter=maxiter, **fit_kwargs)
+        self.vintages = [self.results]
+        logger.info(f"Nowcasting model fitted on {len(self.monthly)} months x {len(self.variables)} series")
+        return self.results
+
+    def _check_fitted(self):
+        if self.results is None:
+            raise ValueError("Model not fitted yet. Call the `fit` method first.")
+
+    def nowcasts(self, target: str, horizon: int = 0) -> pd.Series:
+        """
+        Smoothed monthly path of a series over the sample, extended with horizon months of forecasts. For a quarterly
+        series the value of the last month of a quarter is the estimate of that quarter.
+        """
+        self._check_fitted()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            path = self.results.predict(information_set='smoothed')[target]
+            if horizon > 0:
+                path = pd.concat([path, self.results.forecast(horizon)[target]])
+        return path
+
+    def nowcast(self, target: str, period=None) -> float:
+        """
+        Estimate of a series in a period (a month or a quarter), by default the last month of the panel
+        """
+        month = self.monthly.index[-1] if period is None else _month(period)
+        horizon = max(0, (month - self.monthly.index[-1]).n)
+        return float(self.nowcasts(target, horizon).loc[month])
+
+    def update(self, monthly: pd.DataFrame, quarterly: pd.DataFrame = None, target: str = None, period=None):
+        """
+        Absorb a new data vintage, with new releases or revisions, without estimating the parameters again.
+        :param monthly: the new vintage of the monthly panel, same series as the fitted one
+        :param quarterly: the new vintage of the quarterly panel
+        :param target: when given, the impact of the new releases on the nowcast of this series is returned
+        :param period: period of the nowcast whose revision is decomposed, by default the last month of the panel
+        :return: the statsmodels NewsResults of the update when a target is given
+        """
+        self._check_fitted()
+        previous = self.results
+        self.monthly, self.quarterly = self._prepare(monthly, self.quarterly if quarterly is None else quarterly)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.results = previous.apply(self.monthly, endog_quarterly=self.quarterly)
+        self.vintages.append(self.results)
+        if target is None:
+            return None
+        month = self.monthly.index[-1] if period is None else _month(period)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return self.results.news(previous, impact_date=month, impacted_variable=target, comparison_type='previous')
@@ -0,0 +1,230 @@
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+
+
+# ------------------------------------------
+# Panel kernels: arrays of shape (dates, tickers)
+# ------------------------------------------
+
+def rolling_sum(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Rolling sum over `window` rows for every column at once, from the difference of two cumulative sums. A window with
+    any missing value is NaN, as with pandas rolling(window).sum().
+    """
+    n_dates, n_tickers = values.shape
+    finite = np.isfinite(values)
+    zeros = np.zeros((1, n_tickers))
+    cum_values = np.vstack([zeros, np.cumsum(np.where(finite, values, 0.0), axis=0)])
+    cum_counts = np.vstack([zeros, np.cumsum(finite, axis=0)])
+    output = np.full(values.shape, np.nan)
+    if window > n_dates:
+        return output
+    sums = cum_values[window:] - cum_values[:-window]
+    counts = cum_counts[window:] - cum_counts[:-window]
+    output[window - 1:] = np.where(counts == window, sums, np.nan)
+    return output
+
+
+def recursive_ewm(values: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    Exponentially weighted mean y[t] = alpha * x[t] + (1 - alpha) * y[t-1], run as one linear filter over all columns.
+    Each column starts at its first valid value; gaps hold the last value.
+    """
+    filled = pd.DataFrame(values).ffill()
+    leading = filled.isna().to_numpy()
+    filled = filled.bfill().to_numpy()
+    smoothed, _ = lfilter([alpha], [1.0, alpha - 1.0], filled, axis=0, zi=(1.0 - alpha) * filled[:1])
+    smoothed[leading] = np.nan
+    return smoothed
+
+
+def true_range(close: np.ndarray, high: np.ndarray, low: np.ndarray) -> np.ndarray:
+    prev_close = np.vstack([np.full((1, close.shape[1]), np.nan), close[:-1]])
+    # fmax ignores a missing previous close on the first bar
+    return np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+
+class IndicatorEngine:
+    """
+    Technical indicators for a whole panel of tickers (dates x tickers close matrix) at once, for many windows per
+    pass: SMA and Bollinger bands from cumulative sums, EMA, RSI and ATR from recursive filters.
+
+    EMAs are recursive (pandas ewm(span=window, adjust=False)); RSI and ATR use Wilder's smoothing
+    (alpha = 1 / window). The last state of every filter is kept so that `update` can add one new bar in
+    O(tickers x windows) without recomputing the history, with the same warm-up mask on RSI and ATR.
+    """
+
+    def __init__(self, close: pd.DataFrame, high: pd.DataFrame = None, low: pd.DataFrame = None,
+                 sma_windows=(5, 10, 20, 50, 100, 200), ema_windows=(5, 10, 20, 30, 50, 100),
+                 rsi_windows=(14,), atr_windows=(14,), bb_windows=(20,), bb_k=2.0):
+        self.close = close.sort_index()
+        self.tickers = self.close.columns
+        self.high = None if high is None else high.reindex(index=self.close.index, columns=self.tickers)
+        self.low = None if low is None else low.reindex(index=self.close.index, columns=self.tickers)
+        self.sma_windows = tuple(sma_windows)
+        self.ema_windows = tuple(ema_windows)
+        self.rsi_windows = tuple(rsi_windows)
+        self.atr_windows = tuple(atr_windows) if self.high is not None and self.low is not None else ()
+        self.bb_windows = tuple(bb_windows)
+        self.bb_k = bb_k
+        self.state = {}
+        self.indicators = None
+
+    @classmethod
+    def from_long(cls, df: pd.DataFrame, date_col='date', ticker_col='ticker', close_col='close',
+                  high_col=None, low_col=None, **kwargs):
+        """
+        Build the engine from long-format prices, e.g. the historical_price table
+        """
+        panels = {col: df.pivot_table(index=date_col, columns=ticker_col, values=col)
+                  for col in [close_col, high_col, low_col] if col is not None}
+        return cls(panels[close_col], high=panels.get(high_col), low=panels.get(low_col), **kwargs)
+
+    @staticmethod
+    def _label(name, window):
+        return f"{name}_{window}"
+
+    def compute(self) -> pd.DataFrame:
+        """
+        Compute every indicator over the full history.
+        :return: a dataframe indexed by date with (indicator, ticker) columns, e.g. ('sma_20', 'AAPL')
+        """
+        close = self.close.to_numpy(dtype=float)
+        output = {}
+
+        # SMA and Bollinger bands from cumulative sums; demean each column first to keep sums of squares accurate
+        shift = np.nanmean(close, axis=0)
+        shift = np.where(np.isnan(shift), 0.0, shift)
+        centered = close - shift
+        for window in sorted(set(self.sma_windows) | set(self.bb_windows)):
+            mean = rolling_sum(centered, window) / window
+            if window in self.sma_windows:
+                output[self._label('sma', window)] = mean + shift
+            if window in self.bb_windows:
+                mean_sq = rolling_sum(centered ** 2, window) / window
+                std = np.sqrt(np.maximum(mean_sq - mean ** 2, 0.0) * window / max(window - 1, 1))
+                output[self._label('bb_mid', window)] = mean + shift
+                output[self._label('bb_upper', window)] = mean + shift + self.bb_k * std
+                output[self._label('bb_lower', window)] = mean + shift - self.bb_k * std
+
+        for window in self.ema_windows:
+            ema = recursive_ewm(close, 2.0 / (window + 1.0))
+            output[self._label('ema', window)] = ema
+            self.state[self._label('ema', window)] = ema[-1]
+
+        filled_close = pd.DataFrame(close).ffill().to_numpy()
+        delta = np.diff(filled_close, axis=0, prepend=np.nan)
+        gain = np.where(delta > 0, delta, np.where(np.isnan(delta), np.nan, 0.0))
+        loss = np.where(delta < 0, -delta, np.where(np.isnan(delta), np.nan, 0.0))
+        for window in self.rsi_windows:
+            avg_gain = recursive_ewm(gain, 1.0 / window)
+            avg_loss = recursive_ewm(loss, 1.0 / window)
+            rsi = self._rsi(avg_gain, avg_loss)
+            rsi[self._warmup_mask(gain, window)] = np.nan
+            output[self._label('rsi', window)] = rsi
+            self.state[self._label('rsi', window)] = (avg_gain[-1], avg_loss[-1])
+        # the number of valid values seen by the filters, for the warm-up mask of update
+        self.state['rsi_seen'] = np.isfinite(gain).sum(axis=0)
+
+        if self.atr_windows:
+            tr = true_range(close, self.high.to_numpy(dtype=float), self.low.to_numpy(dtype=float))
+            self.state['atr_seen'] = np.isfinite(tr).sum(axis=0)
+            for window in self.atr_windows:
+                atr = recursive_ewm(tr, 1.0 / window)
+                self.state[self._label('atr', window)] = atr[-1].copy()
+                atr[self._warmup_mask(tr, window)] = np.nan
+                output[self._label('atr', window)] = atr
+
+        max_window = max(self.sma_windows + self.bb_windows + (1,))
+        self.state['tail'] = close[-max_window:]
+        self.state['last_close'] = filled_close[-1]
+
+        self.indicators = self._to_frame(output, self.close.index)
+        return self.indicators
+
+    @staticmethod
+    def _rsi(avg_gain, avg_loss):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return 100.0 * avg_gain / (avg_gain + avg_loss)
+
+    @staticmethod
+    def _warmup_mask(values, window):
+        """
+        Mask the first `window - 1` rows after each column's first valid value, before the smoothing has warmed up
+        """
+        seen = np.cumsum(np.isfinite(values), axis=0)
+        return seen < window
+
+    def _to_frame(self, output: dict, index) -> pd.DataFrame:
+        columns = pd.MultiIndex.from_product([list(output.keys()), self.tickers], names=['indicator', 'ticker'])
+        return pd.DataFrame(np.hstack(list(output.values())), index=index, columns=columns)
+
+    def update(self, close: pd.Series, high: pd.Series = None, low: pd.Series = None, date=None) -> pd.Series:
+        """
+        Add one new bar for all tickers and return the latest indicator values, updating the filter states in place
+        instead of recomputing the history.
+        :param close: close price by ticker for the new bar
+        :return: a series indexed by (indicator, ticker)
+        """
+        if not self.state:
+            self.compute()
+        new_close = close.reindex(self.tickers).to_numpy(dtype=float)
+        last_close = self.state['last_close']
+        filled = np.where(np.isnan(new_close), last_close, new_close)
+        tail = np.vstack([self.state['tail'], new_close[None, :]])[-len(self.state['tail']):]
+        output = {}
+
+        shift = np.nanmean(tail, axis=0)
+        shift = np.where(np.isnan(shift), 0.0, shift)
+        for window in sorted(set(self.sma_windows) | set(self.bb_windows)):
+            centered = tail[-window:] - shift
+            complete = (len(centered) == window) & np.isfinite(centered).all(axis=0)
+            mean = np.where(complete, centered.mean(axis=0), np.nan)
+            if window in self.sma_windows:
+                output[self._label('sma', window)] = mean + shift
+            if window in self.bb_windows:
+                std = np.where(complete, centered.std(axis=0, ddof=1) if window > 1 else 0.0, np.nan)
+                output[self._label('bb_mid', window)] = mean + shift
+                output[self._label('bb_upper', window)] = mean + shift + self.bb_k * std
+                output[self._label('bb_lower', window)] = mean + shift - self.bb_k * std
+
+        for window in self.ema_windows:
+            label = self._label('ema', window)
+            alpha = 2.0 / (window + 1.0)
+            prev = self.state[label]
+            ema = np.where(np.isnan(prev), filled, alpha * filled + (1.0 - alpha) * prev)
+            output[label] = self.state[label] = ema
+
+        delta = filled - last_close
+        gain = np.where(np.isnan(delta), np.nan, np.maximum(delta, 0.0))
+        loss = np.where(np.isnan(delta), np.nan, np.maximum(-delta, 0.0))
+        self.state['rsi_seen'] = self.state['rsi_seen'] + np.isfinite(gain)
+        for window in self.rsi_windows:
+            label = self._label('rsi', window)
+            alpha = 1.0 / window
+            prev_gain, prev_loss = self.state[label]
+            avg_gain = np.where(np.isnan(prev_gain), gain, alpha * gain + (1.0 - alpha) * prev_gain)
+            avg_loss = np.where(np.isnan(prev_loss), loss, alpha * loss + (1.0 - alpha) * prev_loss)
+            self.state[label] = (avg_gain, avg_loss)
+            output[label] = np.where(self.state['rsi_seen'] < window, np.nan, self._rsi(avg_gain, avg_loss))
+
+        if self.atr_windows:
+            new_high = high.reindex(self.tickers).to_numpy(dtype=float)
+            new_low = low.reindex(self.tickers).to_numpy(dtype=float)
+            tr = true_range(np.vstack([last_close, new_close]), np.vstack([new_high, new_high]),
+                            np.vstack([new_low, new_low]))[-1]
+            self.state['atr_seen'] = self.state['atr_seen'] + np.isfinite(tr)
+            for window in self.atr_windows:
+                label = self._label('atr', window)
+                alpha = 1.0 / window
+                prev = self.state[label]
+                atr = np.where(np.isnan(prev), tr, np.where(np.isnan(tr), prev, alpha * tr + (1.0 - alpha) * prev))
+                self.state[label] = atr
+                output[label] = np.where(self.state['atr_seen'] < window, np.nan, atr)
+
+        self.state['tail'] = tail
+        self.state['last_close'] = filled
+        latest = self._to_frame({k: v[None, :] for k, v in output.items()}, [date]).iloc[0]
+        latest.name = date
+        return latest
@@ -1,4 +1,5 @@
-import sys, logging
+import sys, logging, time, datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from pathlib import Path
 
@@ -10,53 +11,73 @@ if str(ROOT_DIR) not in sys.path:
     logging.info(f"Added {str(ROOT_DIR)} to sys.path")
 
 from data.equity_data.yfinance import Stock
-from data.database.db_manager import DBManager
+from data.database.db_manager import DBManager, FinancialStatementDB
+from sqlalchemy import Column, insert, inspect, text
 
 import pandas as pd
 
 
-def populate_quarterly_income_stmt(asset, db_manager):
-    input_df = (
-        asset.quarterly_income_stmt
-        .stack().rename('value').reset_index()
-        .rename(columns={'level_0': 'income_item', 'level_1': 'date'})
-        .assign(ticker=asset.ticker)
-        .assign(date=lambda x: pd.to_datetime(x['date']).apply(lambda y: y.date()))
-        .dropna(subset=['date'])
-    )
+CHECKPOINT_TABLE = 'build_checkpoint'
+# days of already stored price history re-requested on a refresh, so that restated bars (e.g. dividend adjustments)
+# overwrite the stored ones
+OVERLAP_DAYS = 5
 
-    logger.info(f"Populating quarterly income statement for {asset.ticker}")
-    db_manager.create_table_from_df(table_name='quarterly_income_stmt', df=input_df)
-    db_manager.insert_data_from_df(table_name='quarterly_income_stmt', df=input_df)
-
-
-def populate_quarterly_balance_sheet(asset, db_manager):
-    input_df = (
-        asset.quarterly_balance_sheet
-        .stack().rename('value').reset_index()
-        .rename(columns={'level_0': 'balance_sheet_item', 'level_1': 'date'})
-        .assign(ticker=asset.ticker)
-        .assign(date=lambda x: pd.to_datetime(x['date']).apply(lambda y: y.date()))
-        .dropna(subset=['date'])
-    )
 
-    logger.info(f"Populating quarterly balance sheet for {asset.ticker}")
-    db_manager.create_table_from_df(table_name='quarterly_balance_sheet', df=input_df)
-    db_manager.insert_data_from_df(table_name='quarterly_balance_sheet', df=input_df)
+def prepare_quarterly_income_stmt(asset):
+    return FinancialStatementDB.statement_to_long(asset.quarterly_income_stmt, asset.ticker)
 
 
-def populate_historical_price(asset, db_manager):
+def prepare_quarterly_balance_sheet(asset):
+    return FinancialStatementDB.statement_to_long(asset.quarterly_balance_sheet, asset.ticker)
+
 
-    input_df = asset.history(period='max').assign(ticker=asset.ticker).rename(lambda x: pd.to_datetime(x).date())
+def prepare_historical_price(asset, start=None):
+    if start is None:
+        input_df = asset.history(period='max')
+    else:
+        input_df = asset.history(start=start)
+    input_df = input_df.assign(ticker=asset.ticker)
+    input_df.index = pd.DatetimeIndex(input_df.index).date
     input_df.rename(columns=lambda x: x.lower().replace(' ', '_'), inplace=True)
     input_df.index.name = 'date'
-    input_df = input_df.reset_index()
+    return input_df.reset_index()
+
+
+# dataset (and table) name -> function turning a yfinance asset into the rows of that table
+DATASETS = {
+    'quarterly_income_stmt': prepare_quarterly_income_stmt,
+    'quarterly_balance_sheet': prepare_quarterly_balance_sheet,
+    'historical_price': prepare_historical_price,
+}
+# statements written into the fact table of FinancialStatementDB rather than a table of their own
+STATEMENT_DATASETS = ('quarterly_income_stmt', 'quarterly_balance_sheet')
+# primary keys of the tables written with insert-or-replace, so that re-downloaded rows overwrite instead of duplicate
+PRIMARY_KEYS = {
+    'historical_price': ['ticker', 'date'],
+}
+
+
+def populate_quarterly_income_stmt(asset, db_manager: FinancialStatementDB):
+    input_df = prepare_quarterly_income_stmt(asset)
+    logger.info(f"Populating quarterly income statement for {asset.ticker}")
+    db_manager.load_statement_facts(statement='quarterly_income_stmt', facts=input_df)
+
+
+def populate_quarterly_balance_sheet(asset, db_manager: FinancialStatementDB):
+    input_df = prepare_quarterly_balance_sheet(asset)
+    logger.info(f"Populating quarterly balance sheet for {asset.ticker}")
+    db_manager.load_statement_facts(statement='quarterly_balance_sheet', facts=input_df)
+
+
+def populate_historical_price(asset, db_manager):
+    input_df = prepare_historical_price(asset)
     logger.info(f"Populating historical price for {asset.ticker}")
-    db_manager.create_table_from_df(table_name='historical_price', df=input_df)
+    db_manager.create_table_from_df(table_name='historical_price', df=input_df,
+                                    primary_keys=PRIMARY_KEYS.get('historical_price'))
     db_manager.insert_data_from_df(table_name='historical_price', df=input_df)
 
 
-def populate_asset_data(ticker:str, db_manager:DBManager):
+def populate_asset_data(ticker:str, db_manager:FinancialStatementDB):
     asset = Stock.load_stock(ticker)
     asset.history(period='max')
     asset.get_financials()
@@ -65,16 +86,236 @@ def populate_asset_data(ticker:str, db_manager:DBManager):
     populate_historical_price(asset, db_manager)
 
 
-def main():
+# ========================== Checkpoint ========================== #
+
+def create_checkpoint_table(db_manager: DBManager) -> None:
+    """
+    Create the table recording which (ticker, dataset) pairs have been written, and up to which date.
+    """
+    columns = [
+        Column('ticker', db_manager.dtype_map.get('str'), primary_key=True),
+        Column('dataset', db_manager.dtype_map.get('str'), primary_key=True),
+        Column('last_date', db_manager.dtype_map.get('str')),
+        Column('rows', db_manager.dtype_map.get('int')),
+        Column('updated_at', db_manager.dtype_map.get('datetime')),
+    ]
+    db_manager.create_table(table_name=CHECKPOINT_TABLE, columns=columns)
+
+
+def load_checkpoint(db_manager: DBManager) -> pd.DataFrame:
+    """
+    Load the checkpoint table as a dataframe indexed by (ticker, dataset).
+    """
+    create_checkpoint_table(db_manager)
+    result = db_manager.query_data(CHECKPOINT_TABLE, ['ticker', 'dataset', 'last_date', 'rows'])
+    return pd.DataFrame(result, columns=['ticker', 'dataset', 'last_date', 'rows']).set_index(['ticker', 'dataset'])
+
+
+def load_last_price_dates(db_manager: DBManager) -> dict:
+    """
+    Get the last stored date of every ticker in the historical price table in one query, answered from the
+    (ticker, date) primary key index.
+    :return: a dictionary of ticker -> last stored date
+    """
+    if not inspect(db_manager.engine).has_table('historical_price'):
+        return {}
+    with db_manager.engine.begin() as connection:
+        result = connection.execute(text("SELECT ticker, MAX(date) FROM historical_price GROUP BY ticker")).fetchall()
+    return {tic: pd.to_datetime(last_date).date() for tic, last_date in result if last_date is not None}
+
+
+def ensure_unique_keys(db_manager: DBManager, table_name: str, keys: list) -> None:
+    """
+    Give a table created before it had a primary key (e.g. an older historical_price) a unique index on its keys, so
+    that insert-or-replace overwrites re-downloaded rows. The duplicates already stored are dropped first, keeping the
+    last row written.
+    """
+    table = db_manager.tables[table_name]
+    if [c.name for c in table.primary_key.columns] == keys:
+        return
+    indexes = inspect(db_manager.engine).get_indexes(table_name)
+    if any(index['unique'] and index['column_names'] == keys for index in indexes):
+        return
+    logger.warning(f"Adding a unique index on {keys} to {table_name}, dropping duplicated rows")
+    with db_manager.engine.begin() as connection:
+        connection.execute(text(f"DELETE FROM {table_name} WHERE rowid NOT IN "
+                                f"(SELECT MAX(rowid) FROM {table_name} GROUP BY {', '.join(keys)})"))
+        connection.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table_name}_{'_'.join(keys)} "
+                                f"ON {table_name} ({', '.join(keys)})"))
+
+
+def _checkpoint_row(ticker, dataset, df):
+    last_date = None
+    if (not df.empty) and ('date' in df.columns):
+        last_date = max(df['date'])
+        if dataset in STATEMENT_DATASETS:
+            last_date = FinancialStatementDB.decode_date([last_date])[0].date()
+        last_date = str(last_date)
+    return {'ticker': ticker, 'dataset': dataset, 'last_date': last_date, 'rows': len(df),
+            'updated_at': datetime.datetime.now()}
+
+
+# ========================== Parallel Build ========================== #
+
+def fetch_asset_data(ticker: str, datasets: list, asset_loader=Stock.load_stock, start=None) -> dict:
+    """
+    Download one ticker and turn it into a dataframe per requested dataset. Runs inside the worker pool, so it must not
+    touch the database.
+    :param start: first date of price history to request, the full history when None
+    """
+    asset = asset_loader(ticker)
+    output = {}
+    for name in datasets:
+        if name == 'historical_price':
+            output[name] = prepare_historical_price(asset, start=start)
+        else:
+            output[name] = DATASETS[name](asset)
+    return output
+
+
+def flush_batch(db_manager: FinancialStatementDB, frames: dict, checkpoint_rows: list) -> int:
+    """
+    Write the buffered frames of several tickers and their checkpoint rows in a single transaction, so a checkpoint is
+    never recorded for data that was not committed.
+    :param frames: dataset name -> list of dataframes to be inserted
+    :param checkpoint_rows: list of checkpoint records for the tickers in the batch
+    :return: the number of data rows written
+    """
+    batch = {name: pd.concat(dfs, ignore_index=True) for name, dfs in frames.items() if len(dfs) > 0}
+    batch = {name: df for name, df in batch.items() if not df.empty}
+
+    # table creation runs on its own connection, so do it before opening the write transaction. A table stored by an
+    # earlier run is reflected from the database rather than defined from this batch.
+    for name, df in batch.items():
+        if name not in STATEMENT_DATASETS:
+            db_manager.create_table_from_df(table_name=name, df=df, primary_keys=PRIMARY_KEYS.get(name))
+            if name in PRIMARY_KEYS:
+                ensure_unique_keys(db_manager, name, PRIMARY_KEYS[name])
+
+    with db_manager.engine.begin() as connection:
+        for name, df in batch.items():
+            if name in STATEMENT_DATASETS:
+                db_manager.load_statement_facts(statement=name, facts=df, connection=connection)
+                continue
+            # tickers may carry extra columns (e.g. capital gains for funds) that the table was not created with
+            table = db_manager.tables[name]
+            df = df.reindex(columns=[c.name for c in table.columns])
+            query = insert(table).prefix_with('OR REPLACE') if name in PRIMARY_KEYS else insert(table)
+            connection.execute(query, df.to_dict(orient='records'))
+        if checkpoint_rows:
+            connection.execute(insert(db_manager.tables[CHECKPOINT_TABLE]).prefix_with('OR REPLACE'), checkpoint_rows)
+
+    return sum(len(df) for df in batch.values())
+
+
+def build_cache(db_manager: FinancialStatementDB, tickers: list, asset_loader=Stock.load_stock, datasets: list = None,
+                max_workers: int = 8, batch_size: int = 50, resume: bool = True, overlap_days: int = OVERLAP_DAYS,
+                desc: str = 'Populating universe') -> dict:
+    """
+    Download the given tickers with a pool of workers and write them to the database in batches. Pairs of
+    (ticker, dataset) already recorded in the checkpoint table are skipped, so an interrupted build resumes where it
+    stopped. Price history is only requested from the last stored date of each ticker (less an overlap window).
+    :param db_manager: the database to write to, a FinancialStatementDB when statements are built
+    :param tickers: list of tickers to build
+    :param asset_loader: callable returning a yfinance-like asset for a ticker
+    :param datasets: subset of DATASETS to build, all by default
+    :param max_workers: number of download threads
+    :param batch_size: number of tickers buffered before a write
+    :param resume: skip the (ticker, dataset) pairs found in the checkpoint table
+    :param overlap_days: number of days before the last stored date to re-request price history from
+    :return: a dictionary of run statistics
+    """
+    datasets = list(DATASETS.keys()) if datasets is None else datasets
+    create_checkpoint_table(db_manager)
+    done = load_checkpoint(db_manager).index if resume else []
+    last_dates = load_last_price_dates(db_manager) if 'historical_price' in datasets else {}
+    pending = {}
+    for tic in dict.fromkeys(tickers):
+        todo = [d for d in datasets if (tic, d) not in done]
+        if todo:
+            pending[tic] = todo
+
+    stats = {'tickers': 0, 'skipped': len(set(tickers)) - len(pending), 'failed': 0, 'rows': 0, 'elapsed': 0.0}
+    frames = {name: [] for name in datasets}
+    checkpoint_rows = []
+    n_buffered = 0
+    start = time.perf_counter()
+
+    def flush():
+        # a batch that fails to write is not checkpointed, so its tickers are built again by the next run
+        try:
+            stats['rows'] += flush_batch(db_manager, frames, checkpoint_rows)
+            stats['tickers'] += n_buffered
+        except Exception as e:
+            logger.exception(f"Failed to write a batch of {n_buffered} tickers: {e}")
+            stats['failed'] += n_buffered
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for tic, todo in pending.items():
+            price_start = None
+            if tic in last_dates:
+                price_start = last_dates[tic] - datetime.timedelta(days=overlap_days)
+            futures[executor.submit(fetch_asset_data, tic, todo, asset_loader, price_start)] = tic
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+            tic = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.exception(f"Failed to populate data for {tic}: {e}")
+                stats['failed'] += 1
+                continue
+
+            for name, df in result.items():
+                frames[name].append(df)
+                # a refresh without new bars keeps the checkpoint of the stored history
+                if not (df.empty and name == 'historical_price' and tic in last_dates):
+                    checkpoint_rows.append(_checkpoint_row(tic, name, df))
+            n_buffered += 1
+
+            if n_buffered >= batch_size:
+                flush()
+                frames = {name: [] for name in datasets}
+                checkpoint_rows = []
+                n_buffered = 0
+
+    if n_buffered > 0:
+        flush()
+
+    stats['elapsed'] = time.perf_counter() - start
+    return stats
+
+
+def refresh_historical_price(db_manager: DBManager, tickers: list, asset_loader=Stock.load_stock,
+                             overlap_days: int = OVERLAP_DAYS, **kwargs) -> dict:
+    """
+    Bring the stored price history of the given tickers up to date, downloading only the bars after the last stored
+    date of each ticker and overwriting the overlap window. Tickers without stored history get their full history.
+    """
+    return build_cache(db_manager, tickers, asset_loader=asset_loader, datasets=['historical_price'], resume=False,
+                       overlap_days=overlap_days, **kwargs)
+
+
+def report_throughput(stats: dict, label: str = '') -> str:
+    elapsed = max(stats['elapsed'], 1e-9)
+    return (
+        f"{label}: built {stats['tickers']} tickers ({stats['rows']} rows) in {stats['elapsed']:.1f}s "
+        f"-> {stats['tickers'] / elapsed:.2f} tickers/s, {stats['rows'] / elapsed:.0f} rows/s; "
+        f"{stats['skipped']} skipped from checkpoint, {stats['failed']} failed"
+    )
+
+
+def main(fresh=False, refresh=False, max_workers=8, batch_size=50):
     # suppress logging from sqlalchemy
     logging.getLogger('db_manager').setLevel(logging.ERROR)
     logging.getLogger('build_yfinance_db_cache').setLevel(logging.WARNING)
 
-    # clear the db cache
-    DBManager.drop_db(db_name='yfinance')
+    # clear the db cache only when asked to, otherwise resume from the checkpoint table
+    if fresh:
+        DBManager.drop_db(db_name='yfinance')
 
     # create database
-    db_manager = DBManager(db_name='yfinance')
+    db_manager = FinancialStatementDB(db_name='yfinance')
 
     # load universe from trading view data
     us_universe_df = pd.read_csv(ROOT_DIR / 'data' / 'equity_market' / '3_fundamental' / 'raw' / 'us_2023-07-28.csv')
@@ -88,13 +329,15 @@ def main():
     }
 
     for mkt, universe_tics in universe_spec.items():
-        for tic in tqdm(universe_tics, desc=f"Populating {mkt} universe"):
-            try:
-                populate_asset_data(tic, db_manager)
-            except Exception as e:
-                logger.exception(f"Failed to populate data for {tic}: {e}")
+        if refresh:
+            stats = refresh_historical_price(db_manager, universe_tics, max_workers=max_workers,
+                                             batch_size=batch_size, desc=f"Refreshing {mkt} prices")
+        else:
+            stats = build_cache(db_manager, universe_tics, max_workers=max_workers, batch_size=batch_size,
+                                desc=f"Populating {mkt} universe")
+        print(report_throughput(stats, label=mkt))
 
 
 if __name__ == "__main__":
 
-    main()
\ No newline at end of file
+    main()
@@ -1,6 +1,6 @@
 import logging
 logger = logging.getLogger(__name__)
-import os
+import os, sys
 import re
 from datetime import datetime
 import time
@@ -13,6 +13,9 @@ from io import StringIO
 import requests
 
 ROOT_DIR = Path(__file__).parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+from src.utils.general_utils import convert_series_to_float, MISSING_VALUES
 print(ROOT_DIR)
 ETF_CACHE_DIR=ROOT_DIR/'data'/'equity_market'/'1_ishares_etf'
 ETF_META_DIR=ROOT_DIR/'src'/'meta'/'ishares_etf'
@@ -23,6 +26,8 @@ if not os.path.exists(ETF_CACHE_DIR):
 
 
 base_url = 'https://www.ishares.com/us/products'
+# the iShares holdings exports also mark missing values with dashes
+ETF_MISSING_VALUES = MISSING_VALUES + ['——', '-', '—-']
 
 
 def cache_etf_by_group(etf_url_meta_file):
@@ -131,7 +136,7 @@ def cache_all_etf(chunk_size=None, update_cache=False):
 
     try:
         for c in ['Market Value', 'Weight (%)', 'Notional Value', 'Shares', 'Price', 'FX Rate']:
-            etf_dfs[c] = etf_dfs[c].apply(_convert_to_float)
+            etf_dfs[c] = convert_series_to_float(etf_dfs[c], missing_values=ETF_MISSING_VALUES).values
         etf_dfs.to_parquet(ETF_CACHE_DIR/f'ishares_holdings_{as_of_date}.parquet')
     except:
         print(f"Failed to save parquet file for {as_of_date}")
@@ -272,21 +277,6 @@ def _extract_shares_outstanding(text):
         return None
 
 
-def _convert_to_float(x):
-    if isinstance(x, float):
-        return x
-    elif isinstance(x, int):
-        return float(x)
-    elif isinstance(x, str):
-        if x.strip() in ['——','-','—-','nan','none','null','n/a','N/A','None','NULL','NaN','NA']:
-            return np.nan
-        try:
-            return float(x.replace(',',''))
-        except Exception as e:
-            print(f'Failed to convert {x} to float: {e}')
-            return x
-
-
 if __name__ == '__main__':
 
     chunks = cache_all_etf(chunk_size=None, update_cache=True)
\ No newline at end of file
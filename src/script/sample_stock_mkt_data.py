@@ -1,4 +1,5 @@
-import sys, logging, time, datetime
+import sys, logging, time, datetime, asyncio
+from collections import namedtuple
 from pathlib import Path
 logger = logging.getLogger(__name__)
 
@@ -10,51 +11,232 @@ if str(ROOT_DIR) not in sys.path:
 import src.config as cfg
 from data.equity_data.yfinance import Stock
 from data.database.db_manager import DBManager
-from sqlalchemy import Column
+from data.equity_data.tick_buffer import TickBufferStore, TickFlusher
+from sqlalchemy import Column, insert
 
 import numpy as np
 import pandas as pd
 
 
-def sample_current_price(asset, db_manager):
-    """
-    Sample current price and insert into database.
-    :param asset:
-    :param db_manager:
-    :return:
-    """
-    current_time=datetime.datetime.now()
-    current_price = asset.get_info().get('currentPrice', np.nan)
-    if np.isnan(current_price):
-        logger.warning(f"Current price for {asset.ticker} is not available.")
-    input_df = pd.DataFrame({'ticker': [asset.ticker], 'datetime': [current_time], 'price': [current_price]})
-    db_manager.insert_data_from_df(table_name='market_price', df=input_df)
+Quote = namedtuple('Quote', ['ticker', 'datetime', 'price', 'volume'])
 
 
-def main():
-    print(str(cfg.DB_DIR / 'yfinance'))
-    db_manager = DBManager(db_name=str(cfg.DB_DIR / 'yfinance'))
+def create_market_price_table(db_manager):
     columns = [
         Column('ticker', db_manager.dtype_map.get('str'), primary_key=True),
         Column('datetime', db_manager.dtype_map.get('datetime'), primary_key=True),
-        Column('price', db_manager.dtype_map.get('float'))
+        Column('price', db_manager.dtype_map.get('float')),
+        Column('volume', db_manager.dtype_map.get('float'))
     ]
     db_manager.create_table(table_name='market_price', columns=columns)
 
-    asset = Stock.load_stock('RIVN')
-    logger.info(f"Successfully loaded {asset.ticker} from yfinance.")
 
-    # for every 30 seconds, run sample_current_price
-    while True:
+def write_market_price(db_manager, ticks: pd.DataFrame):
+    """
+    Write ticks (ticker, datetime, price, volume) to the market_price table in one executemany. The volume is dropped
+    for tables created before it had a volume column.
+    """
+    table = db_manager.tables['market_price']
+    volumes = ticks['volume'] if 'volume' in ticks.columns else [np.nan] * len(ticks)
+    rows = [{'ticker': tic, 'datetime': pd.Timestamp(dt).to_pydatetime(), 'price': float(price),
+             'volume': None if pd.isna(volume) else float(volume)}
+            for tic, dt, price, volume in zip(ticks['ticker'], ticks['datetime'], ticks['price'], volumes)]
+    if 'volume' not in table.c:
+        rows = [{k: v for k, v in row.items() if k != 'volume'} for row in rows]
+    with db_manager.engine.begin() as connection:
+        connection.execute(insert(table), rows)
+
+
+class YFinanceQuoteSource:
+    """
+    Quote source backed by yfinance. get_info() blocks, so each request runs in the event loop's thread pool.
+    """
+
+    def __init__(self):
+        self.assets = {}
+
+    def _get_quote(self, ticker):
+        if ticker not in self.assets:
+            self.assets[ticker] = Stock.load_stock(ticker)
+        info = self.assets[ticker].get_info()
+        return Quote(ticker, datetime.datetime.now(), info.get('currentPrice', np.nan), info.get('volume', np.nan))
+
+    async def get_quote(self, ticker) -> Quote:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._get_quote, ticker)
+
+
+class AsyncPriceSampler:
+    """
+    Poll the current price of a list of tickers concurrently at a fixed cadence. Ticks are buffered and written to the
+    market_price table in micro-batches with a single executemany.
+
+    Any quote source with an ``async get_quote(ticker) -> Quote`` method can be plugged in. When a TickBufferStore is
+    given, ticks go to its in-memory ring buffers instead, and persisting them is left to a TickFlusher.
+    """
+
+    def __init__(self, tickers, db_manager, quote_source=None, interval=30, timeout=None, batch_size=100,
+                 tick_store: TickBufferStore = None, max_retries=3):
+        """
+        :param tickers: list of tickers to sample
+        :param db_manager: the database holding the market_price table
+        :param quote_source: the quote source, yfinance by default
+        :param interval: seconds between two sampling rounds
+        :param timeout: seconds to wait for a quote before counting the tick as missed, the interval by default
+        :param batch_size: number of buffered ticks that triggers a write
+        :param tick_store: in-memory tick buffers to append to instead of writing to the database
+        :param max_retries: number of flushes a failed batch is retried on before its ticks are written one by one and
+            the failing ones dropped
+        """
+        self.tickers = list(dict.fromkeys(tickers))
+        self.db_manager = db_manager
+        self.quote_source = quote_source or YFinanceQuoteSource()
+        self.interval = interval
+        self.timeout = interval if timeout is None else timeout
+        self.batch_size = batch_size
+        self.tick_store = tick_store
+        self.max_retries = max_retries
+        self.buffer = []
+        self.failed_flushes = 0
+        self.dropped = 0
+        self.rounds = 0
+        self.stats = {tic: {'samples': 0, 'missed': 0, 'received': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+                      for tic in self.tickers}
+        create_market_price_table(self.db_manager)
+
+    async def _sample_ticker(self, ticker):
+        stats = self.stats[ticker]
+        start = time.perf_counter()
+        try:
+            quote = await asyncio.wait_for(self.quote_source.get_quote(ticker), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Timed out sampling {ticker} after {self.timeout}s")
+            stats['missed'] += 1
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to sample {ticker}: {e}")
+            stats['missed'] += 1
+            return None
+
+        latency = time.perf_counter() - start
+        stats['received'] += 1
+        stats['latency_total'] += latency
+        stats['latency_max'] = max(stats['latency_max'], latency)
+        if quote.price is None or np.isnan(quote.price):
+            logger.warning(f"Current price for {ticker} is not available.")
+            stats['missed'] += 1
+            return None
+        stats['samples'] += 1
+        return quote
+
+    async def sample_once(self) -> list:
+        """
+        Sample every ticker once, concurrently, and buffer the quotes received.
+        """
+        quotes = await asyncio.gather(*[self._sample_ticker(tic) for tic in self.tickers])
+        quotes = [q for q in quotes if q is not None]
+        self.rounds += 1
+        if self.tick_store is not None:
+            for q in quotes:
+                self.tick_store.append(q.ticker, q.datetime, q.price, q.volume)
+            return quotes
+        self.buffer.extend(quotes)
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+        return quotes
+
+    def _write(self, quotes):
+        write_market_price(self.db_manager, pd.DataFrame(quotes, columns=Quote._fields))
+
+    def _write_each(self, quotes) -> int:
+        """
+        Write the quotes one at a time, so that a row the database rejects does not take the batch with it
+        :return: the number of quotes that failed to write
+        """
+        lost = 0
+        for quote in quotes:
+            try:
+                self._write([quote])
+            except Exception as e:
+                logger.warning(f"Failed to write {quote.ticker} at {quote.datetime}: {e}")
+                lost += 1
+        return lost
+
+    async def flush(self):
+        """
+        Write the buffered quotes to the database in one executemany, off the event loop. A batch that fails to write
+        goes back to the buffer and is retried on the next flush, so sampling goes on. After max_retries failed
+        flushes in a row, the buffered quotes are written one by one and those still failing are dropped and counted.
+        """
+        if not self.buffer:
+            return
+        quotes, self.buffer = self.buffer, []
+        loop = asyncio.get_running_loop()
         try:
-            sample_current_price(asset, db_manager)
-            db_manager.cursor.close()
-            logger.info(f"Successfully sampled current price for {asset.ticker}")
+            await loop.run_in_executor(None, self._write, quotes)
         except Exception as e:
-            logger.exception(f"Failed to sample current price for {asset.ticker}: {e}")
+            self.failed_flushes += 1
+            if self.failed_flushes <= self.max_retries:
+                logger.exception(f"Failed to write {len(quotes)} ticks, retrying on the next flush "
+                                 f"({self.failed_flushes}/{self.max_retries}): {e}")
+                self.buffer = quotes + self.buffer
+                return
+            self.failed_flushes = 0
+            lost = await loop.run_in_executor(None, self._write_each, quotes)
+            self.dropped += lost
+            logger.error(f"Failed to write {len(quotes)} ticks after {self.max_retries} retries, wrote them one by one "
+                         f"and dropped {lost} ({self.dropped} dropped in total): {e}")
+            return
+        self.failed_flushes = 0
+        logger.info(f"Wrote {len(quotes)} ticks to market_price")
+
+    async def run(self, n_rounds=None):
+        """
+        Sample every `interval` seconds until cancelled or `n_rounds` rounds are done. Rounds are scheduled on a fixed
+        clock: when a round overruns, the rounds it ran over are skipped and counted as missed ticks.
+        """
+        loop = asyncio.get_running_loop()
+        next_round = loop.time()
+        try:
+            while n_rounds is None or self.rounds < n_rounds:
+                await self.sample_once()
+                next_round += self.interval
+                now = loop.time()
+                if now > next_round:
+                    skipped = int((now - next_round) // self.interval) + 1
+                    logger.warning(f"Sampling round overran by {now - next_round:.2f}s, skipping {skipped} round(s)")
+                    for stats in self.stats.values():
+                        stats['missed'] += skipped
+                    next_round += skipped * self.interval
+                await asyncio.sleep(next_round - now)
+        finally:
+            await self.flush()
 
-        time.sleep(30)
+    def get_stats(self) -> pd.DataFrame:
+        """
+        Per-ticker sample counts, missed ticks and quote latency in seconds.
+        """
+        stats = pd.DataFrame(self.stats).T
+        stats['latency_mean'] = stats['latency_total'] / stats['received'].clip(lower=1)
+        return stats.drop(columns=['latency_total'])
+
+
+def main(tickers=('RIVN',), interval=30, flush_interval=300):
+    print(str(cfg.DB_DIR / 'yfinance'))
+    db_manager = DBManager(db_name=str(cfg.DB_DIR / 'yfinance'))
+    tick_store = TickBufferStore()
+    sampler = AsyncPriceSampler(tickers, db_manager, interval=interval, tick_store=tick_store)
+    flusher = TickFlusher(tick_store, lambda ticks: write_market_price(db_manager, ticks), interval=flush_interval)
+    flusher.start()
+    logger.info(f"Sampling {', '.join(sampler.tickers)} every {interval} seconds.")
+    try:
+        asyncio.run(sampler.run())
+    except KeyboardInterrupt:
+        logger.info("Stopping the sampler...")
+    finally:
+        flusher.stop()
+        print(sampler.get_stats().to_string())
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,54 @@
+import sqlite3
+import threading
+import pandas as pd
+
+from src.data.equity_data.ashare_history import download_history_quote, load_state
+
+
+class FixtureQuoteSource:
+    """A local stand-in for efinance serving a fixed number of business days per ticker."""
+
+    def __init__(self, periods=3, fail=()):
+        self.periods = periods
+        self.fail = set(fail)
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def get_quote_history(self, code, beg='19000101'):
+        with self._lock:
+            self.requests.append((code, beg))
+        if code in self.fail:
+            raise ConnectionError(f"no data for {code}")
+        dates = pd.bdate_range('2023-07-03', periods=self.periods)
+        df = pd.DataFrame({'股票名称': 'name', '股票代码': code, '日期': dates.strftime('%Y-%m-%d'),
+                           '收盘': range(self.periods), '成交量': 100})
+        # like efinance, ignore the bars before beg
+        return df[df['日期'] >= pd.Timestamp(beg).strftime('%Y-%m-%d')].reset_index(drop=True)
+
+
+def test_download_is_resumable_and_incremental(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'ashare.db')
+    first = download_history_quote(conn, ['600000', '000001', '300750'], source=FixtureQuoteSource(fail=['000001']),
+                                   max_workers=2, batch_size=2)
+    assert (first['tickers'], first['failed'], first['rows']) == (2, 1, 6)
+
+    # the failed ticker is downloaded in full, the others only from the day after their last bar
+    source = FixtureQuoteSource(periods=5)
+    second = download_history_quote(conn, ['600000', '000001', '300750'], source=source)
+    assert dict(source.requests) == {'600000': '20230706', '000001': '19000101', '300750': '20230706'}
+    assert second['rows'] == 2 + 5 + 2
+
+    history = pd.read_sql("SELECT * FROM history_quote", conn)
+    assert len(history) == 15
+    assert not history.duplicated(['股票代码', '日期']).any()
+    assert load_state(conn) == {'600000': '2023-07-07', '000001': '2023-07-07', '300750': '2023-07-07'}
+
+    # without incremental mode, stored tickers are skipped
+    third = download_history_quote(conn, ['600000', '688981'], source=FixtureQuoteSource(), incremental=False)
+    assert (third['skipped'], third['tickers']) == (1, 1)
+
+
+def test_state_is_seeded_from_existing_history(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'ashare.db')
+    FixtureQuoteSource().get_quote_history('600000').to_sql('history_quote', conn, index=False)
+    assert load_state(conn) == {'600000': '2023-07-05'}
@@ -0,0 +1,147 @@
+import logging
+logger = logging.getLogger('test_build_yfinance_db_cache')
+import pandas as pd
+
+from src.data.database.db_manager import DBManager, FinancialStatementDB
+from src.script.build_yfinance_db_cache import build_cache, load_checkpoint, report_throughput, DATASETS
+from src.script.build_yfinance_db_cache import refresh_historical_price, load_last_price_dates, prepare_historical_price
+
+
+class FakeAsset:
+    """A stand-in for yfinance.Ticker serving a fixed set of frames."""
+
+    def __init__(self, ticker, periods=3, close_shift=0.0):
+        self.ticker = ticker
+        self.periods = periods
+        self.close_shift = close_shift
+        self.history_starts = []
+        quarters = pd.to_datetime(['2023-03-31', '2023-06-30'])
+        self.quarterly_income_stmt = pd.DataFrame([[1.0, 2.0], [3.0, 4.0]],
+                                                  index=['Total Revenue', 'Net Income'], columns=quarters)
+        self.quarterly_balance_sheet = pd.DataFrame([[5.0, 6.0]], index=['Total Assets'], columns=quarters)
+
+    def history(self, period='max', start=None, **kwargs):
+        self.history_starts.append(start)
+        dates = pd.date_range('2023-07-03', periods=self.periods, freq='B')
+        prices = pd.Series(range(self.periods), index=dates, dtype=float)
+        history = pd.DataFrame({'Open': prices + 1.0, 'Close': prices + 1.5 + self.close_shift,
+                                'Volume': prices * 100 + 100, 'Stock Splits': prices * 0.0})
+        if start is not None:
+            history = history[history.index >= pd.Timestamp(start)]
+        return history
+
+    def get_financials(self):
+        return None
+
+
+class FakeLoader:
+
+    def __init__(self, fail=(), **asset_kwargs):
+        self.fail = set(fail)
+        self.asset_kwargs = asset_kwargs
+        self.calls = []
+        self.assets = {}
+
+    def __call__(self, ticker):
+        self.calls.append(ticker)
+        if ticker in self.fail:
+            raise ConnectionError(f"no data for {ticker}")
+        self.assets[ticker] = FakeAsset(ticker, **self.asset_kwargs)
+        return self.assets[ticker]
+
+
+def test_build_cache_writes_all_datasets(tmp_path):
+    db_manager = FinancialStatementDB(str(tmp_path / 'yfinance'))
+    stats = build_cache(db_manager, ['AAA', 'BBB', 'CCC'], asset_loader=FakeLoader(), max_workers=2, batch_size=2)
+    logger.info(report_throughput(stats, label='test'))
+
+    assert stats['tickers'] == 3
+    assert stats['failed'] == 0
+    assert len(db_manager.query_data('historical_price', ['*'])) == 9
+    assert len(db_manager.query_data('financial_fact', ['*'])) == 18
+    assert len(db_manager.query_data('financial_item', ['*'])) == 3
+    assert len(db_manager.query_data('ticker_dim', ['*'])) == 3
+
+    checkpoint = load_checkpoint(db_manager)
+    assert len(checkpoint) == 3 * len(DATASETS)
+    assert checkpoint.loc[('AAA', 'historical_price'), 'last_date'] == '2023-07-05'
+    assert checkpoint.loc[('AAA', 'quarterly_income_stmt'), 'last_date'] == '2023-06-30'
+
+    revenue = db_manager.query_cross_section('quarterly_income_stmt', 'Total Revenue', '2023-06-30')
+    assert sorted(revenue['ticker']) == ['AAA', 'BBB', 'CCC']
+    assert (revenue['value'] == 2.0).all()
+    statement = db_manager.query_statement('quarterly_income_stmt', 'BBB')
+    pd.testing.assert_frame_equal(statement, FakeAsset('BBB').quarterly_income_stmt.sort_index(),
+                                  check_names=False, check_freq=False, check_index_type=False,
+                                  check_column_type=False)
+
+
+def test_build_cache_resumes_from_checkpoint(tmp_path):
+    db_manager = FinancialStatementDB(str(tmp_path / 'yfinance'))
+    first = build_cache(db_manager, ['AAA', 'BBB', 'CCC'], asset_loader=FakeLoader(fail=['BBB']), batch_size=1)
+    assert first['tickers'] == 2
+    assert first['failed'] == 1
+
+    loader = FakeLoader()
+    second = build_cache(db_manager, ['AAA', 'BBB', 'CCC'], asset_loader=loader, batch_size=1)
+    assert loader.calls == ['BBB']
+    assert second['skipped'] == 2
+    assert len(db_manager.query_data('historical_price', ['*'])) == 9
+
+
+def test_refresh_historical_price_requests_missing_range(tmp_path):
+    db_manager = DBManager(str(tmp_path / 'yfinance'))
+    build_cache(db_manager, ['AAA', 'BBB'], asset_loader=FakeLoader(), datasets=['historical_price'])
+    assert load_last_price_dates(db_manager)['AAA'].isoformat() == '2023-07-05'
+
+    # two new bars arrive and the stored ones are restated
+    loader = FakeLoader(periods=5, close_shift=10.0)
+    stats = refresh_historical_price(db_manager, ['AAA', 'BBB', 'CCC'], asset_loader=loader, overlap_days=1)
+    assert stats['tickers'] == 3
+    assert loader.assets['AAA'].history_starts == [pd.Timestamp('2023-07-04').date()]
+    assert loader.assets['CCC'].history_starts == [None]
+
+    rows = db_manager.query_data('historical_price', ['date', 'close'], where="ticker='AAA'", order_by='date')
+    assert [r[0] for r in rows] == ['2023-07-03', '2023-07-04', '2023-07-05', '2023-07-06', '2023-07-07']
+    assert rows[0][1] == 1.5
+    assert rows[1][1] == 12.5
+
+
+def test_rolled_back_dimension_ids_are_not_cached(tmp_path):
+    db_manager = FinancialStatementDB(str(tmp_path / 'yfinance'))
+    facts = FinancialStatementDB.statement_to_long(FakeAsset('AAA').quarterly_income_stmt, 'AAA')
+    try:
+        with db_manager.engine.begin() as connection:
+            db_manager.load_statement_facts('quarterly_income_stmt', facts, connection=connection)
+            raise RuntimeError("batch failed")
+    except RuntimeError:
+        pass
+    assert db_manager.ticker_ids == {}
+    assert db_manager.item_ids == {}
+
+    # the dimension rows are inserted again, and the facts point to them
+    other = FinancialStatementDB.statement_to_long(FakeAsset('BBB').quarterly_income_stmt, 'BBB')
+    db_manager.load_statement_facts('quarterly_income_stmt', other)
+    db_manager.load_statement_facts('quarterly_income_stmt', facts)
+    revenue = db_manager.query_cross_section('quarterly_income_stmt', 'Total Revenue', '2023-06-30')
+    assert sorted(revenue['ticker']) == ['AAA', 'BBB']
+
+
+def test_refresh_migrates_a_stored_table_and_keeps_checkpoints(tmp_path):
+    # an older build stored the prices without a primary key, with a column this run does not download
+    legacy = DBManager(str(tmp_path / 'yfinance'))
+    rows = prepare_historical_price(FakeAsset('AAA')).assign(capital_gains=0.0)
+    legacy.create_table_from_df(table_name='historical_price', df=rows)
+    legacy.insert_data_from_df(table_name='historical_price', df=pd.concat([rows, rows.tail(1)]))
+
+    db_manager = DBManager(str(tmp_path / 'yfinance'))
+    build_cache(db_manager, ['AAA'], asset_loader=FakeLoader(), datasets=['historical_price'], resume=False)
+    before = load_checkpoint(db_manager).loc[('AAA', 'historical_price')]
+
+    # no new bar: the overlap is overwritten in place and the checkpoint is kept
+    stats = refresh_historical_price(db_manager, ['AAA'], asset_loader=FakeLoader(), overlap_days=1)
+    assert stats['failed'] == 0
+    dates = [r[0] for r in db_manager.query_data('historical_price', ['date'], where="ticker='AAA'")]
+    assert sorted(dates) == ['2023-07-03', '2023-07-04', '2023-07-05']
+    after = load_checkpoint(db_manager).loc[('AAA', 'historical_price')]
+    assert after['last_date'] == before['last_date'] == '2023-07-05'
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.model.macro.dfm_backtest as dfm_backtest
+from src.model.macro.dfm_backtest import rolling_origin_backtest, backtest_metrics, forecast_origins
+
+
+@pytest.fixture
+def endog():
+    rng = np.random.default_rng(7)
+    factor = np.zeros(60)
+    for t in range(1, 60):
+        factor[t] = 0.7 * factor[t - 1] + rng.normal()
+    loadings = np.array([1.0, 0.5, -0.8])
+    values = factor[:, None] * loadings + 0.3 * rng.normal(size=(60, 3))
+    return pd.DataFrame(values, index=pd.date_range('2015-01-31', periods=60, freq='ME'), columns=['a', 'b', 'c'])
+
+
+def test_forecast_origins():
+    assert forecast_origins(10, 6, 2) == [6, 8]
+    with pytest.raises(ValueError):
+        forecast_origins(10, 10)
+
+
+def test_rolling_origin_backtest(endog):
+    backtest = rolling_origin_backtest(endog, initial=48, step=4, horizons=(1, 3), max_workers=2, maxiter=50)
+    assert backtest.columns.tolist() == ['origin', 'horizon', 'date', 'variable', 'forecast', 'actual', 'error']
+    # origins 48, 52, 56: three variables, two horizons each
+    assert len(backtest) == 3 * 2 * 3
+    assert (backtest['date'] > backtest['origin']).all()
+    first = backtest[(backtest['origin'] == endog.index[47]) & (backtest['horizon'] == 3)]
+    assert (first['date'] == endog.index[50]).all()
+    assert first['actual'].tolist() == endog.iloc[50].tolist()
+    np.testing.assert_allclose(backtest['error'], backtest['actual'] - backtest['forecast'])
+
+    # the result does not depend on how the origins are spread over the workers
+    serial = rolling_origin_backtest(endog, initial=48, step=4, horizons=(1, 3), max_workers=1, maxiter=50)
+    pd.testing.assert_frame_equal(serial[['origin', 'horizon', 'date', 'variable', 'actual']],
+                                  backtest[['origin', 'horizon', 'date', 'variable', 'actual']])
+
+    metrics = backtest_metrics(backtest)
+    assert metrics.columns.tolist() == ['MAE', 'MSE', 'RMSE', 'n']
+    assert metrics.loc[('a', 1), 'n'] == 3
+    assert np.isclose(metrics.loc[('a', 1), 'RMSE'] ** 2, metrics.loc[('a', 1), 'MSE'])
+
+
+def test_every_origin_is_fitted_once_from_the_previous_one(endog, monkeypatch):
+    fits, original = [], dfm_backtest.fit_dynamic_factor
+
+    def fit(train, start_params=None, **kwargs):
+        fits.append((len(train), start_params is None))
+        return original(train, start_params=start_params, **kwargs)
+
+    monkeypatch.setattr(dfm_backtest, 'fit_dynamic_factor', fit)
+    rolling_origin_backtest(endog, initial=48, step=4, max_workers=1, maxiter=20)
+    assert fits == [(48, True), (52, False), (56, False)]
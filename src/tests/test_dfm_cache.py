@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.model.macro.dfm_cache import DFMFitCache
+
+
+@pytest.fixture
+def endog():
+    rng = np.random.default_rng(3)
+    factor = np.zeros(64)
+    for t in range(1, 64):
+        factor[t] = 0.6 * factor[t - 1] + rng.normal()
+    values = factor[:, None] * np.array([1.0, 0.7, -0.5]) + 0.3 * rng.normal(size=(64, 3))
+    return pd.DataFrame(values, index=pd.date_range('2010-01-31', periods=64, freq='ME'), columns=['x', 'y', 'z'])
+
+
+def test_fit_cache(endog, tmp_path):
+    cache = DFMFitCache(tmp_path)
+    first, status = cache.fit(endog.iloc[:60], maxiter=100)
+    assert status == 'fitted'
+
+    # same data and spec from a new cache instance: no optimization, same parameters
+    cached, status = DFMFitCache(tmp_path).fit(endog.iloc[:60])
+    assert status == 'cached'
+    np.testing.assert_allclose(cached.params, first.params)
+    assert np.isclose(cached.llf, first.llf)
+
+    # another specification is a separate entry
+    assert cache.fit(endog.iloc[:60], factor_order=2, maxiter=20)[1] == 'fitted'
+
+    # appended observations keep the cached parameters, or warm-start the optimizer
+    appended, status = cache.fit(endog.iloc[:62], refit=False)
+    assert status == 'appended'
+    assert appended.nobs == 62
+    np.testing.assert_allclose(appended.params, first.params)
+    assert cache.fit(endog.iloc[:62], refit=False)[1] == 'cached'
+    # the appended parameters were never optimized on these observations: refit=True optimizes them
+    assert cache.fit(endog.iloc[:62], maxiter=20)[1] == 'warm_started'
+    assert cache.fit(endog.iloc[:62])[1] == 'cached'
+    warm, status = cache.fit(endog, maxiter=100)
+    assert status == 'warm_started'
+    assert warm.nobs == 64
+
+    # revised history is not a prefix, it is fitted from scratch
+    revised = endog.copy()
+    revised.iloc[0, 0] += 1.0
+    assert cache.fit(revised, maxiter=20)[1] == 'fitted'
+
+    # the original data is still cached next to the revised one
+    assert cache.fit(endog, maxiter=20)[1] == 'cached'
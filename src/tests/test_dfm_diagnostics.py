@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import scipy.stats
+from statsmodels.tsa.stattools import acf as sm_acf
+from statsmodels.stats.diagnostic import acorr_ljungbox
+
+from src.model.macro.dfm_diagnostics import error_metrics, acf, jarque_bera, ljung_box, model_diagnostics
+
+
+def make_frame(seed=1, n_obs=120, n_series=4):
+    rng = np.random.default_rng(seed)
+    values = rng.standard_t(5, size=(n_obs, n_series)).cumsum(axis=0) * 0.1 + rng.normal(size=(n_obs, n_series))
+    return pd.DataFrame(values, columns=[f"v{i}" for i in range(n_series)])
+
+
+def test_error_metrics():
+    actual, predicted = make_frame(1) + 5, make_frame(2) + 5
+    metrics = error_metrics(actual, predicted)
+    error = actual - predicted
+    np.testing.assert_allclose(metrics['MAE'], error.abs().mean())
+    np.testing.assert_allclose(metrics['RMSE'], np.sqrt((error ** 2).mean()))
+    np.testing.assert_allclose(metrics['MAPE'], 100 * (error.abs() / actual.abs()).mean())
+
+    actual.iloc[0, 0] = np.nan
+    assert error_metrics(actual, predicted).loc['v0', 'n'] == 119
+
+
+def test_residual_tests_match_reference_implementations():
+    resid = make_frame(3)
+    np.testing.assert_allclose(acf(resid, 12)[:, 2], sm_acf(resid['v2'], nlags=12, fft=False))
+
+    jb = jarque_bera(resid)
+    for col in resid.columns:
+        stat, pvalue = scipy.stats.jarque_bera(resid[col])
+        assert np.isclose(jb.loc[col, 'jb_stat'], stat) and np.isclose(jb.loc[col, 'jb_pvalue'], pvalue)
+
+    lb = ljung_box(resid, lags=8)
+    reference = acorr_ljungbox(resid['v1'], lags=[8])
+    assert np.isclose(lb.loc['v1', 'lb_stat'], reference['lb_stat'].iloc[0])
+    assert np.isclose(lb.loc['v1', 'lb_pvalue'], reference['lb_pvalue'].iloc[0])
+
+
+def test_model_diagnostics_frame():
+    actual, fitted = make_frame(4), make_frame(5)
+    frame = model_diagnostics(actual, fitted, lags=5, nlags=3)
+    assert frame.index.tolist() == ['v0', 'v1', 'v2', 'v3']
+    assert frame.columns.tolist() == ['MAE', 'MSE', 'RMSE', 'MAPE', 'n', 'jb_stat', 'jb_pvalue', 'skew', 'kurtosis',
+                                      'lb_stat', 'lb_pvalue', 'acf_1', 'acf_2', 'acf_3']
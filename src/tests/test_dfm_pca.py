@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+from scipy.linalg import solve_discrete_lyapunov
+
+from src.model.macro.dfm_pca import DIFFUSE_STATE_VARIANCE, TwoStepDynamicFactor, pca_em, standardize
+
+
+def simulate(n_obs, n_series, k=2, missing=0.1, seed=5):
+    rng = np.random.default_rng(seed)
+    A = np.array([[0.7, 0.1], [0.0, 0.5]])[:k, :k]
+    factors = np.zeros((n_obs, k))
+    for t in range(1, n_obs):
+        factors[t] = A @ factors[t - 1] + rng.normal(size=k)
+    loadings = rng.normal(size=(n_series, k))
+    values = factors @ loadings.T + 0.5 * rng.normal(size=(n_obs, n_series)) + rng.normal(size=n_series) * 10
+    values[rng.random(values.shape) < missing] = np.nan
+    index = pd.date_range('2000-01-31', periods=n_obs, freq='ME')
+    return pd.DataFrame(values, index=index, columns=[f"s{i}" for i in range(n_series)]), factors
+
+
+def dense_llf(result, z):
+    """Textbook Kalman filter with the full observation covariance."""
+    k = result.model.k_factors
+    a, P = np.zeros(len(result.transition)), solve_discrete_lyapunov(result.transition, result.state_cov)
+    llf = 0.0
+    for t in range(len(z)):
+        if t > 0:
+            a = result.transition @ a
+            P = result.transition @ P @ result.transition.T + result.state_cov
+        obs = ~np.isnan(z[t])
+        Z = np.zeros((obs.sum(), len(a)))
+        Z[:, :k] = result.loadings[obs]
+        F = Z @ P @ Z.T + np.diag(result.idio_var[obs])
+        v = z[t, obs] - Z @ a
+        llf += -0.5 * (obs.sum() * np.log(2 * np.pi) + np.linalg.slogdet(F)[1] + v @ np.linalg.solve(F, v))
+        K = P @ Z.T @ np.linalg.inv(F)
+        a, P = a + K @ v, P - K @ Z @ P
+    return llf, a
+
+
+def test_collapsed_filter_matches_dense_filter():
+    endog, _ = simulate(40, 6, missing=0.2)
+    result = TwoStepDynamicFactor(endog, k_factors=2, factor_order=2).fit()
+    z, _, _ = standardize(endog.to_numpy())
+    llf, last_state = dense_llf(result, z)
+    assert np.isclose(result.llf, llf)
+    np.testing.assert_allclose(result.filtered_state[-1], last_state, atol=1e-8)
+
+
+def test_pca_em_fills_missing_values():
+    endog, factors = simulate(200, 50, missing=0.15)
+    z, _, _ = standardize(endog.to_numpy())
+    loadings, estimated, n_iter = pca_em(z, 2)
+    assert loadings.shape == (50, 2) and estimated.shape == (200, 2)
+    assert n_iter > 1
+    # the estimated factors span the true ones
+    beta = np.linalg.lstsq(estimated, factors, rcond=None)[0]
+    r2 = 1 - ((factors - estimated @ beta) ** 2).sum(axis=0) / (factors ** 2).sum(axis=0)
+    assert (r2 > 0.9).all()
+
+
+def test_two_step_results_interface():
+    endog, _ = simulate(150, 200, missing=0.1)
+    # ragged edge: the last observations of half of the panel are not published yet
+    endog.iloc[-3:, :100] = np.nan
+    result = TwoStepDynamicFactor(endog, k_factors=2, factor_order=1).fit()
+    assert result.fittedvalues.shape == endog.shape
+    assert not result.fittedvalues.isna().any().any()
+    assert result.resid.isna().sum().sum() == endog.isna().sum().sum()
+    assert np.isfinite(result.llf) and result.bic > result.aic
+
+    forecast = result.forecast(steps=4)
+    assert forecast.shape == (4, 200)
+    assert forecast.index[0] == pd.Timestamp('2012-07-31')
+    irf = result.impulse_responses(steps=6, impulse=1)
+    assert irf.shape == (7, 200)
+    assert result.factors.shape == (150, 2)
+    assert 'Two-step dynamic factor model' in result.summary()
+
+
+def test_non_stationary_factor_var_uses_a_diffuse_initialization(caplog):
+    rng = np.random.default_rng(7)
+    trend = np.cumsum(0.5 + rng.normal(size=120))
+    values = trend[:, None] * rng.normal(size=20) + rng.normal(size=(120, 20))
+    endog = pd.DataFrame(values, index=pd.date_range('2000-01-31', periods=120, freq='ME'))
+    with caplog.at_level('WARNING'):
+        result = TwoStepDynamicFactor(endog, k_factors=1, factor_order=1).fit()
+    assert not result.stationary
+    assert 'not stationary' in caplog.text and 'not stationary' in result.summary()
+    np.testing.assert_allclose(result.predicted_cov[0], DIFFUSE_STATE_VARIANCE * np.eye(1))
+    assert np.isfinite(result.llf)
+    assert np.isfinite(result.forecast(steps=3).to_numpy()).all()
+
+    stationary, _ = simulate(120, 20)
+    assert TwoStepDynamicFactor(stationary, k_factors=2).fit().stationary
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.model.macro.dfm_search import spec_search, SpecSearchCache
+
+
+@pytest.fixture
+def endog():
+    rng = np.random.default_rng(11)
+    factor = np.zeros(80)
+    for t in range(1, 80):
+        factor[t] = 0.5 * factor[t - 1] + rng.normal()
+    values = factor[:, None] * np.array([1.0, 0.6, -0.4]) + 0.4 * rng.normal(size=(80, 3))
+    return pd.DataFrame(values, columns=['u', 'v', 'w'])
+
+
+def test_grid_search_is_cached(endog, tmp_path):
+    cache = SpecSearchCache(tmp_path)
+    search = spec_search(endog, k_factors=(1,), factor_orders=(1, 2), error_orders=(0,), arima_orders=((1, 0, 0),),
+                         maxiter=30, max_workers=2, cache=cache)
+    ranking = search.ranking
+    assert ranking['rank'].tolist() == [1, 2, 3]
+    assert sorted(ranking['model'].tolist()) == ['ARIMA', 'DFM', 'DFM']
+    assert (ranking['status'] == 'ok').all()
+    assert ranking['bic'].is_monotonic_increasing
+    assert search.arima['variable'].tolist() == ['u', 'v', 'w']
+    arima_row = ranking[ranking['model'] == 'ARIMA'].iloc[0]
+    assert np.isclose(arima_row['bic'], search.arima['bic'].sum())
+
+    # a wider grid only fits the new cell
+    wider = spec_search(endog, k_factors=(1, 2), factor_orders=(1, 2), error_orders=(0,),
+                        arima_orders=((1, 0, 0),), maxiter=30, max_workers=1, cache=SpecSearchCache(tmp_path))
+    assert len(wider.ranking) == 5
+    merged = wider.ranking.merge(ranking, on=['model', 'k_factors', 'factor_order'], suffixes=('', '_first'))
+    np.testing.assert_allclose(merged['seconds'], merged['seconds_first'])
+
+
+def test_halving_and_timeout(endog, tmp_path):
+    search = spec_search(endog, k_factors=(1, 2), factor_orders=(1, 2), error_orders=(0,), arima_orders=(),
+                         method='halving', min_maxiter=10, maxiter=30, eta=3, max_workers=1)
+    dfm = search.ranking[search.ranking['model'] == 'DFM']
+    # four candidates at 10 iterations, the best two at 30
+    assert len(dfm) == 2
+    assert (dfm['maxiter'] == 30).all()
+
+    search = spec_search(endog, k_factors=(1,), factor_orders=(1,), error_orders=(0,), arima_orders=(),
+                         timeout=0, max_workers=1, cache=SpecSearchCache(tmp_path))
+    assert search.ranking['status'].tolist() == ['timeout']
+    # the timed out cell is not cached, so a longer timeout fits it
+    search = spec_search(endog, k_factors=(1,), factor_orders=(1,), error_orders=(0,), arima_orders=(),
+                         timeout=None, max_workers=1, cache=SpecSearchCache(tmp_path))
+    assert search.ranking['status'].tolist() == ['ok']
@@ -0,0 +1,249 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+from src.data.macro_data.fed_h8 import FederalReserveH8, latest_release_time
+
+
+H8_CSV = '''"Series Description","Bank credit, all commercial banks, not seasonally adjusted","Real estate loans: Residential real estate loans: Revolving home equity loans, all commercial banks, not seasonally adjusted"
+"Unit:","Currency","Currency"
+"Multiplier:","1000000","1000000"
+"Currency:","USD","USD"
+"Unique Identifier:","H8/H8/B1001NCBAM","H8/H8/B1047NCBAM"
+"Time Period","B1001NCBAM","B1047NCBAM"
+2024-01-03,17300.5,250.1
+2024-01-10,17310.25,
+'''
+
+
+class H8Handler(BaseHTTPRequestHandler):
+    """Stand-in for the Fed data download program, answering conditional requests."""
+    etag = '"v1"'
+    body = H8_CSV
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        payload = self.body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    H8Handler.requests = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), H8Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/h8.csv"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_latest_release_time():
+    # friday 2024-05-10 16:15 New York is 20:15 UTC
+    assert latest_release_time('2024-05-10 20:00') == pd.Timestamp('2024-05-03 20:15', tz='UTC')
+    assert latest_release_time('2024-05-10 20:30') == pd.Timestamp('2024-05-10 20:15', tz='UTC')
+    assert latest_release_time('2024-05-14 09:00') == pd.Timestamp('2024-05-10 20:15', tz='UTC')
+
+
+def test_package_is_revalidated_once_per_release(server, tmp_path):
+    h8 = FederalReserveH8(cache_dir=tmp_path, url_map={'all_commercial': server})
+    assert h8.build_h8_cache('all_commercial') == 'downloaded'
+    data = h8.data_cache['all_commercial']
+    assert data.shape == (2, 2)
+    assert data.loc['2024-01-03', 'b1001ncbam'] == 17300.5
+    assert pd.isna(data.loc['2024-01-10', 'b1047ncbam'])
+    assert h8.label2code_map['all_commercial']['bank_credit|all|nsa'] == 'b1001ncbam'
+
+    # a new instance is served from disk until the next release
+    h8 = FederalReserveH8(cache_dir=tmp_path, url_map={'all_commercial': server})
+    assert h8.build_h8_cache('all_commercial') == 'cached'
+    assert H8Handler.requests == [None]
+    pd.testing.assert_frame_equal(h8.data_cache['all_commercial'], data)
+
+    # after the release the package is revalidated with its ETag
+    assert h8.build_h8_cache('all_commercial', refresh=True) == 'not_modified'
+    assert H8Handler.requests == [None, '"v1"']
+
+    H8Handler.etag = '"v2"'
+    try:
+        assert h8.build_h8_cache('all_commercial', refresh=True) == 'downloaded'
+    finally:
+        H8Handler.etag = '"v1"'
+
+
+def test_cached_package_is_served_offline(server, tmp_path):
+    h8 = FederalReserveH8(cache_dir=tmp_path, url_map={'all_commercial': server})
+    h8.build_h8_cache('all_commercial')
+
+    h8 = FederalReserveH8(cache_dir=tmp_path, url_map={'all_commercial': 'http://127.0.0.1:9/h8.csv'})
+    assert h8.build_h8_cache('all_commercial', refresh=True) == 'offline'
+    assert h8.data_cache['all_commercial'].shape == (2, 2)
+
+
+def test_parse_csv_reads_quoted_labels_and_missing_values():
+    text = H8_CSV.replace('"Bank credit, all', '"Bank credit,incl. leases, all').replace('17310.25', 'ND')
+    metadata, data = FederalReserveH8.parse_csv(text)
+    assert metadata.index.tolist() == ['b1001ncbam', 'b1047ncbam']
+    assert metadata.loc['b1001ncbam', 'label'] == 'bank_credit,incl._leases|all|nsa'
+    assert metadata.loc['b1047ncbam', 'label'] == (
+        'real_estate_loans:residential_real_estate_loans:revolving_home_equity_loans|all|nsa')
+    assert metadata.loc['b1001ncbam', 'multiplier'] == '1000000'
+    assert (data.dtypes == 'float64').all()
+    assert data.index.tolist() == [pd.Timestamp('2024-01-03'), pd.Timestamp('2024-01-10')]
+    assert data['b1001ncbam'].tolist()[0] == 17300.5
+    assert data.isna().sum().tolist() == [1, 1]
+
+
+def make_package(group_label, labels, n_dates=3):
+    """An H8-style csv of the given item labels, valued 1000 * (item number + 1)."""
+    codes = [f"B{i:04d}NCBAM" for i in range(len(labels))]
+    rows = ['"Series Description",' + ','.join(f'"{label}, {group_label}, not seasonally adjusted"' for label in labels),
+            '"Unit:",' + ','.join(['"Currency"'] * len(labels)),
+            '"Multiplier:",' + ','.join(['"1000000"'] * len(labels)),
+            '"Currency:",' + ','.join(['"USD"'] * len(labels)),
+            '"Unique Identifier:",' + ','.join(f'"H8/H8/{c}"' for c in codes),
+            '"Time Period",' + ','.join(f'"{c}"' for c in codes)]
+    for date in pd.date_range('2024-01-03', periods=n_dates, freq='7D'):
+        rows.append(date.strftime('%Y-%m-%d') + ',' + ','.join(str(1000.0 * (i + 1)) for i in range(len(labels))))
+    return '\n'.join(rows)
+
+
+CRE_LABELS = ['Real estate loans: Commercial real estate loans: Construction and land development loans',
+              'Real estate loans: Commercial real estate loans: Secured by farmland',
+              'Real estate loans: Commercial real estate loans: Secured by multifamily properties',
+              'Real estate loans: Commercial real estate loans: Secured by nonfarm nonresidential properties']
+
+
+@pytest.fixture
+def h8(tmp_path):
+    h8 = FederalReserveH8(cache_dir=tmp_path)
+    for group, group_label, labels in [
+        ('all_commercial', 'all commercial banks', ['Commercial and industrial loans', 'Real estate loans'] + CRE_LABELS),
+        # small banks publish no C&I loans in this stand-in
+        ('small_domestic', 'small domestically chartered commercial banks', ['Real estate loans'] + CRE_LABELS),
+    ]:
+        h8.add_package(group, *h8.parse_package(group, make_package(group_label, labels)))
+    return h8
+
+
+def test_tree_index(h8):
+    assert [n.name for n in h8.tree_children['real_estate_loans']] == ['residential_real_estate_loans',
+                                                                       'commercial_real_estate_loans']
+    non_mbs = [node for node in h8.tree_paths if node.name == 'non-mbs']
+    assert len(non_mbs) == 2
+    assert h8.tree_paths[h8.tree_children['commercial_real_estate_loans'][0]] == (
+        'bank_credit', 'loans_and_leases_in_bank_credit', 'real_estate_loans', 'commercial_real_estate_loans',
+        'construction_and_land_development_loans')
+    codes = h8.tree_codes['all_commercial']
+    assert codes[h8.tree_children['loans_and_leases_in_bank_credit'][0]] == 'b0000ncbam'
+    assert codes[h8.tree_children['commercial_real_estate_loans'][1]] == 'b0003ncbam'
+
+
+def test_get_subtree_selects_all_groups_at_once(h8):
+    subtree = h8.get_subtree('real_estate_loans', groups=['all_commercial', 'small_domestic'], depth=2)
+    assert subtree.columns.names == ['group', 'node']
+    assert subtree.columns.get_level_values('node').tolist()[:3] == [
+        'residential_real_estate_loans', 'commercial_real_estate_loans', 'revolving_home_equity_loans']
+    assert subtree[('all_commercial', 'secured_by_farmland')].iloc[0] == 4.0
+    assert subtree[('small_domestic', 'secured_by_farmland')].iloc[0] == 3.0
+    assert subtree[('small_domestic', 'residential_real_estate_loans')].isna().all()
+
+    cre = h8.get_cre_holdings('all_commercial')
+    assert cre.columns.tolist() == ['construction_and_land_development_loans', 'secured_by_farmland',
+                                    'secured_by_multifamily_properties', 'secured_by_nonfarm_nonresidential_properties']
+    assert cre.iloc[0].tolist() == [3.0, 4.0, 5.0, 6.0]
+
+    level3 = h8.get_level3_holdings('small_domestic')
+    assert level3['real_estate_loans'].iloc[0] == 1.0
+    assert level3['commercial_and_industrial_loans'].isna().all()
+
+    # duplicated names are qualified by their parent
+    securities = h8.get_subtree('securities_in_bank_credit', groups=['all_commercial'], depth=None)
+    assert 'treasury_and_agency_securities|non-mbs' in securities['all_commercial'].columns
+
+
+def test_build_all_aligns_groups(tmp_path):
+    packages = {'all_commercial': make_package('all commercial banks', ['Real estate loans'] + CRE_LABELS, 3),
+                'foreign': make_package('foreign-related institutions', ['Real estate loans'], 2)}
+
+    class Handler(H8Handler):
+        def do_GET(self):
+            self.body = packages[self.path.strip('/')]
+            super().do_GET()
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f"http://127.0.0.1:{httpd.server_address[1]}"
+        h8 = FederalReserveH8(cache_dir=tmp_path, url_map={g: f"{url}/{g}" for g in packages})
+        panel = h8.build_all(groups=list(packages))
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+    assert h8.build_status == {'all_commercial': 'downloaded', 'foreign': 'downloaded'}
+    assert panel.shape == (3, 6)
+    assert panel.columns.names == ['group', 'item']
+    assert panel[('foreign', 'b0000ncbam')].isna().tolist() == [False, False, True]
+
+    long = h8.to_long()
+    assert long.columns.tolist() == ['date', 'item', 'value', 'group']
+    assert len(long) == panel.notna().sum().sum()
+    assert long.groupby('group').size().to_dict() == {'all_commercial': 15, 'foreign': 2}
+    single = FederalReserveH8.wide_to_long(h8.data_cache['foreign'], 'foreign')
+    pd.testing.assert_frame_equal(single, long[long['group'] == 'foreign'].reset_index(drop=True),
+                                  check_dtype=False)
+
+
+def test_build_all_skips_groups_without_cache_or_snapshot(server, tmp_path):
+    # nothing listens on a closed server's port, and neither the cache nor the snapshot directory has any file
+    closed = ThreadingHTTPServer(('127.0.0.1', 0), H8Handler)
+    offline_url = f"http://127.0.0.1:{closed.server_address[1]}/h8.csv"
+    closed.server_close()
+    h8 = FederalReserveH8(cache_dir=tmp_path / 'cache', url_map={'all_commercial': server, 'foreign': offline_url})
+    h8.snapshot_dir = tmp_path / 'snapshots'
+
+    panel = h8.build_all(groups=['all_commercial', 'foreign'])
+    assert h8.build_status == {'all_commercial': 'downloaded', 'foreign': 'unavailable'}
+    assert panel.columns.get_level_values('group').unique().tolist() == ['all_commercial']
+    assert h8.build_h8_cache('foreign') == 'unavailable'
+
+
+def test_build_all_skips_groups_that_fail_to_parse(tmp_path):
+    packages = {'all_commercial': make_package('all commercial banks', ['Real estate loans'], 3),
+                'foreign': 'not,an,h8,package\n1,2,3,4\n'}
+
+    class Handler(H8Handler):
+        def do_GET(self):
+            self.body = packages[self.path.strip('/')]
+            super().do_GET()
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{httpd.server_address[1]}"
+        h8 = FederalReserveH8(cache_dir=tmp_path / 'cache', url_map={g: f"{url}/{g}" for g in packages})
+        h8.snapshot_dir = tmp_path / 'snapshots'
+        panel = h8.build_all(groups=list(packages))
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+    assert h8.build_status == {'all_commercial': 'downloaded', 'foreign': 'unavailable'}
+    assert panel.columns.get_level_values('group').unique().tolist() == ['all_commercial']
@@ -0,0 +1,187 @@
+import json
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from src.data.macro_data.fred_store import FREDClient, FREDStore, FRED_LATEST
+
+TODAY = datetime.date.today().isoformat()
+TOMORROW = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+
+
+def previous_day(date):
+    return (datetime.date.fromisoformat(date) - datetime.timedelta(days=1)).isoformat()
+
+
+class StubFRED:
+    """In-memory FRED: two releases, two series, and the vintages of their observations."""
+
+    def __init__(self):
+        self.requests = []
+        self.releases = [{'id': 10, 'name': 'Employment Situation'}, {'id': 53, 'name': 'Gross Domestic Product'}]
+        self.series = {
+            'PAYEMS': {'id': 'PAYEMS', 'title': 'All Employees, Total Nonfarm', 'frequency_short': 'M',
+                       'last_updated': '2024-05-03 07:50:00-05'},
+            'UNRATE': {'id': 'UNRATE', 'title': 'Unemployment Rate', 'frequency_short': 'M',
+                       'last_updated': '2024-05-03 07:48:00-05'},
+        }
+        # (series, date, value, realtime_start, realtime_end)
+        self.vintages = [('PAYEMS', f"2024-0{m}-01", 100.0 + m, '2024-01-01', FRED_LATEST) for m in range(1, 5)]
+        self.vintages += [('UNRATE', f"2024-0{m}-01", 3.5, '2024-01-01', FRED_LATEST) for m in range(1, 5)]
+        self.updated = []
+        self.today = TODAY
+
+    def revise(self, series_id, date, value, published=TOMORROW):
+        """A revision published on a date: the current vintage ends the day before."""
+        for i, v in enumerate(self.vintages):
+            if v[0] == series_id and v[1] == date and v[4] == FRED_LATEST:
+                self.vintages[i] = v[:4] + (previous_day(published),)
+        self.vintages.append((series_id, date, value, published, FRED_LATEST))
+        self.series[series_id]['last_updated'] = f"{published} 07:50:00-05"
+        self.updated.append(self.series[series_id])
+
+    def handle(self, path, params):
+        self.requests.append(path)
+        if path == 'releases':
+            return {'count': len(self.releases), 'releases': self.releases}
+        if path == 'release/series':
+            seriess = list(self.series.values()) if params['release_id'] == '10' else []
+            return {'count': len(seriess), 'seriess': seriess}
+        if path == 'series':
+            return {'seriess': [self.series[params['series_id']]]}
+        if path == 'series/updates':
+            updated, self.updated = self.updated, []
+            return {'count': len(updated), 'seriess': updated}
+        if path == 'series/observations':
+            rows = [v for v in self.vintages if v[0] == params['series_id']]
+            if 'realtime_start' not in params:
+                observations = [{'date': v[1], 'value': str(v[2]), 'realtime_start': self.today,
+                                 'realtime_end': self.today} for v in rows if v[3] <= self.today <= v[4]]
+            else:
+                start = params['realtime_start']
+                observations = [{'date': v[1], 'value': str(v[2]), 'realtime_start': max(v[3], start),
+                                 'realtime_end': v[4]} for v in rows if v[4] >= start]
+            # one observation per page, to exercise the paging
+            offset = int(params.get('offset', 0))
+            return {'count': len(observations), 'observations': observations[offset:offset + 1]}
+        raise KeyError(path)
+
+
+@pytest.fixture
+def fred():
+    stub = StubFRED()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            payload = json.dumps(stub.handle(url.path.split('/fred/', 1)[1], params)).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield stub, f"http://127.0.0.1:{httpd.server_address[1]}/fred"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_store_syncs_incrementally(fred, tmp_path):
+    stub, url = fred
+    store = FREDStore(tmp_path / 'fred.db', client=FREDClient(api_key='test', base_url=url))
+
+    assert store.sync_releases() == 2
+    assert store.sync_release_series(10) == 2
+    assert store.releases()['name'].tolist() == ['Employment Situation', 'Gross Domestic Product']
+    assert store.release_series(10)['id'].tolist() == ['PAYEMS', 'UNRATE']
+    assert store.series_info('PAYEMS')['title'] == 'All Employees, Total Nonfarm'
+
+    assert store.sync_observations(['PAYEMS', 'UNRATE']) == ['PAYEMS', 'UNRATE']
+    assert store.observations('PAYEMS').tolist() == [101.0, 102.0, 103.0, 104.0]
+
+    # nothing changed: the page reads locally without any request
+    n_requests = len(stub.requests)
+    assert store.sync_releases() == 0
+    assert store.sync_release_series(10) == 0
+    assert store.sync_observations(['PAYEMS', 'UNRATE']) == []
+    assert len(stub.requests) == n_requests
+
+    # only the revised series is pulled again, and both vintages are kept
+    stub.revise('PAYEMS', '2024-03-01', 150.0)
+    assert store.sync_updates() == ['PAYEMS']
+    assert store.series_info('PAYEMS')['last_updated'] == f"{TOMORROW} 07:50:00-05"
+    assert store.observations('PAYEMS').tolist() == [101.0, 102.0, 150.0, 104.0]
+    assert store.observations('PAYEMS', as_of=TODAY).tolist() == [101.0, 102.0, 103.0, 104.0]
+    assert store.observations('UNRATE').tolist() == [3.5] * 4
+
+    # the next check has no update and pulls nothing
+    assert store.sync_updates() == []
+    # later checks only ask the updates endpoint
+    stub.revise('UNRATE', '2024-02-01', 3.7)
+    n_requests = len(stub.requests)
+    assert store.sync_updates() == ['UNRATE']
+    assert 'series' not in stub.requests[n_requests:]
+    store.close()
+
+
+def test_store_refreshes_every_stored_series_after_the_updates_window(fred, tmp_path, monkeypatch):
+    stub, url = fred
+    store = FREDStore(tmp_path / 'fred.db', client=FREDClient(api_key='test', base_url=url))
+    store.sync_release_series(10)
+    store.sync_observations(['PAYEMS', 'UNRATE'])
+
+    def check_on(clock):
+        monkeypatch.setattr(FREDStore, '_clock', staticmethod(lambda: clock))
+        n_requests = len(stub.requests)
+        return store.sync_updates(), stub.requests[n_requests:]
+
+    start = datetime.datetime(2024, 6, 1, 12)
+    assert check_on(start) == ([], ['series', 'series'])
+
+    # a revision that is out of the updates window by the next check
+    stub.revise('UNRATE', '2024-02-01', 3.7)
+    stub.updated = []
+    pulled, requests = check_on(start + datetime.timedelta(days=20))
+    assert pulled == ['UNRATE']
+    assert 'series/updates' not in requests
+    assert store.series_info('UNRATE')['last_updated'] == f"{TOMORROW} 07:50:00-05"
+    assert store.observations('UNRATE').tolist() == [3.5, 3.7, 3.5, 3.5]
+
+    # back within the window, the updates endpoint is used again
+    assert check_on(start + datetime.timedelta(days=21)) == ([], ['series/updates'])
+    store.close()
+
+
+def test_store_keeps_one_current_vintage_across_sync_days(fred, tmp_path, monkeypatch):
+    stub, url = fred
+    store = FREDStore(tmp_path / 'fred.db', client=FREDClient(api_key='test', base_url=url))
+
+    def sync_on(day, first=False):
+        stub.today = day
+        monkeypatch.setattr(FREDStore, '_today', staticmethod(lambda: day))
+        return store.sync_observations(['PAYEMS']) if first else store.sync_updates()
+
+    store.sync_release_series(10)
+    sync_on('2024-06-01', first=True)
+    stub.revise('PAYEMS', '2024-03-01', 150.0, published='2024-06-05')
+    assert sync_on('2024-06-10') == ['PAYEMS']
+    stub.revise('PAYEMS', '2024-01-01', 200.0, published='2024-06-12')
+    assert sync_on('2024-06-15') == ['PAYEMS']
+
+    assert store.observations('PAYEMS').tolist() == [200.0, 102.0, 150.0, 104.0]
+    assert store.observations('PAYEMS', as_of='2024-06-02').tolist() == [101.0, 102.0, 103.0, 104.0]
+    assert store.observations('PAYEMS', as_of='2024-06-07').tolist() == [101.0, 102.0, 150.0, 104.0]
+    assert store.observations('PAYEMS', as_of='2024-06-12').tolist() == [200.0, 102.0, 150.0, 104.0]
+    # unchanged values extend their vintage instead of adding rows under the clipped real-time start
+    n_rows = store.conn.execute("SELECT COUNT(*) FROM observations WHERE series_id = 'PAYEMS'").fetchone()[0]
+    assert n_rows == 6
+    store.close()
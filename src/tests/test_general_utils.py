@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from src.utils.general_utils import convert_series_to_float, convert_to_float
+
+
+def test_convert_series_to_float_matches_scalar_rules():
+    values = pd.Series(['1,234.5', '—', 'N/A', None, 3, 4.5, 'abc', ' 7 '], dtype=object)
+    result = convert_series_to_float(values, multiplier=2.0, default=-1.0)
+
+    np.testing.assert_array_equal(result.values, [2469.0, -1.0, -1.0, np.nan, 6.0, 9.0, -1.0, 14.0])
+    np.testing.assert_array_equal(result.failed, [False] * 6 + [True, False])
+    assert result.counts == {'total': 8, 'converted': 4, 'missing': 3, 'failed': 1}
+
+    assert convert_to_float('1,000', multiplier=1e-3) == 1.0
+    assert np.isnan(convert_to_float('NULL'))
+    assert convert_to_float(True) == 1.0
+    assert convert_to_float(np.int64(3), multiplier=2.0) == 6.0
+    assert convert_to_float('abc', default=-1.0) == -1.0
+    np.testing.assert_array_equal(convert_series_to_float(np.array([1, 2])).values, [1.0, 2.0])
+
+
+def test_float_conversion_logs_failures_once_per_column(caplog):
+    with caplog.at_level('WARNING'):
+        assert np.isnan(convert_to_float('abc'))
+        convert_series_to_float(pd.Series(['abc', 'def', '1'], dtype=object))
+    assert len(caplog.records) == 1
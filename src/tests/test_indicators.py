@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from src.model.technical.indicators import IndicatorEngine
+
+
+def make_panel(n_dates=60, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2023-01-02', periods=n_dates)
+    close = pd.DataFrame(100 + rng.normal(size=(n_dates, 3)).cumsum(axis=0), index=dates, columns=['AAA', 'BBB', 'CCC'])
+    close.iloc[:7, 2] = np.nan  # CCC lists later
+    high = close + rng.uniform(0.1, 1.0, size=close.shape)
+    low = close - rng.uniform(0.1, 1.0, size=close.shape)
+    return close, high, low
+
+
+def test_engine_matches_pandas():
+    close, high, low = make_panel()
+    engine = IndicatorEngine(close, high, low, sma_windows=(5, 20), ema_windows=(10,), rsi_windows=(14,),
+                             atr_windows=(14,), bb_windows=(20,))
+    result = engine.compute()
+
+    for ticker in close.columns:
+        series = close[ticker]
+        np.testing.assert_allclose(result[('sma_20', ticker)], series.rolling(20).mean(), equal_nan=True)
+        np.testing.assert_allclose(result[('ema_10', ticker)], series.ewm(span=10, adjust=False).mean(),
+                                   equal_nan=True)
+        upper = series.rolling(20).mean() + 2 * series.rolling(20).std()
+        np.testing.assert_allclose(result[('bb_upper_20', ticker)], upper, equal_nan=True)
+
+        delta = series.diff()
+        avg_gain = delta.clip(lower=0).ewm(alpha=1 / 14, adjust=False).mean()
+        avg_loss = (-delta).clip(lower=0).ewm(alpha=1 / 14, adjust=False).mean()
+        rsi = 100 * avg_gain / (avg_gain + avg_loss)
+        rsi[delta.notna().cumsum() < 14] = np.nan
+        np.testing.assert_allclose(result[('rsi_14', ticker)], rsi, equal_nan=True)
+
+    assert result[('sma_5', 'CCC')].first_valid_index() == close.index[11]
+
+
+def test_update_matches_full_recompute():
+    close, high, low = make_panel()
+    kwargs = dict(sma_windows=(5, 20), ema_windows=(10,), rsi_windows=(14,), atr_windows=(14,), bb_windows=(20,))
+    engine = IndicatorEngine(close.iloc[:-1], high.iloc[:-1], low.iloc[:-1], **kwargs)
+    engine.compute()
+    latest = engine.update(close.iloc[-1], high.iloc[-1], low.iloc[-1], date=close.index[-1])
+
+    expected = IndicatorEngine(close, high, low, **kwargs).compute().iloc[-1]
+    pd.testing.assert_series_equal(latest, expected, check_names=False)
+
+
+def test_update_during_warm_up_matches_full_recompute():
+    close, high, low = make_panel()
+    kwargs = dict(sma_windows=(5,), ema_windows=(10,), rsi_windows=(14,), atr_windows=(14,), bb_windows=(5,))
+    engine = IndicatorEngine(close.iloc[:8], high.iloc[:8], low.iloc[:8], **kwargs)
+    engine.compute()
+    for n in range(9, 25):
+        latest = engine.update(close.iloc[n - 1], high.iloc[n - 1], low.iloc[n - 1], date=close.index[n - 1])
+        expected = IndicatorEngine(close.iloc[:n], high.iloc[:n], low.iloc[:n], **kwargs).compute().iloc[-1]
+        pd.testing.assert_series_equal(latest, expected, check_names=False)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.model.macro.nowcast import Nowcaster, to_period_frame
+
+
+@pytest.fixture
+def panel():
+    rng = np.random.default_rng(0)
+    n_months = 120
+    factor = np.zeros(n_months)
+    for t in range(1, n_months):
+        factor[t] = 0.7 * factor[t - 1] + rng.normal()
+    months = pd.date_range('2010-01-31', periods=n_months, freq='ME')
+    monthly = pd.DataFrame(factor[:, None] * [1.0, 0.8, -0.6] + 0.5 * rng.normal(size=(n_months, 3)),
+                           index=months, columns=['a', 'b', 'c'])
+    quarters = pd.date_range('2010-03-31', periods=n_months // 3, freq='QE')
+    quarterly = pd.DataFrame({'gdp': factor.reshape(-1, 3).mean(axis=1) * 1.5 + 0.2 * rng.normal(size=n_months // 3)},
+                             index=quarters)
+    return monthly, quarterly
+
+
+def test_to_period_frame_keeps_ragged_edge():
+    days = pd.date_range('2024-01-01', '2024-03-31', freq='D')
+    daily = pd.DataFrame({'rate': np.arange(len(days), dtype=float)}, index=days)
+    daily.loc['2024-02', 'rate'] = np.nan
+    monthly = to_period_frame(daily, 'M')
+    assert monthly.index.tolist() == list(pd.period_range('2024-01', '2024-03', freq='M'))
+    assert monthly['rate'].iloc[0] == 15.0
+    assert np.isnan(monthly['rate'].iloc[1])
+
+    weekly = pd.DataFrame({'x': [1.0, 3.0, 5.0]}, index=pd.to_datetime(['2024-01-03', '2024-01-24', '2024-02-07']))
+    assert to_period_frame(weekly, 'M')['x'].tolist() == [2.0, 5.0]
+
+
+def test_nowcast_is_updated_without_refit(panel):
+    monthly, quarterly = panel
+    # the vintage: the last quarter of gdp and the last months of two series are not published yet
+    vintage = monthly.copy()
+    vintage.iloc[-2:, 0] = np.nan
+    vintage.iloc[-1:, 1] = np.nan
+    nowcaster = Nowcaster(vintage, quarterly.iloc[:-1], factors=1, factor_orders=1)
+    results = nowcaster.fit(maxiter=50)
+    assert nowcaster.variables == ['a', 'b', 'c', 'gdp']
+    assert len(nowcaster.monthly) == 120 and len(nowcaster.quarterly) == 40
+
+    before = nowcaster.nowcast('gdp', '2019Q4')
+    assert np.isfinite(before)
+    assert nowcaster.nowcast('gdp') == before
+
+    # series a is released for the last two months
+    news = nowcaster.update(monthly, target='gdp', period='2019Q4')
+    after = nowcaster.nowcast('gdp', '2019Q4')
+    np.testing.assert_allclose(nowcaster.results.params, results.params)
+    assert np.isclose(after - before, news.total_impacts['gdp'].iloc[0])
+    assert len(nowcaster.vintages) == 2
+
+    # a forecast beyond the panel
+    assert np.isfinite(nowcaster.nowcast('gdp', '2020Q1'))
@@ -0,0 +1,42 @@
+import sqlite3
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from src.data.equity_data.tick_buffer import TickBufferStore
+from src.data.equity_data.yfinance import OptionCache
+
+OptionChain = namedtuple('OptionChain', ['calls', 'puts'])
+
+
+def make_chain(symbol, price):
+    return pd.DataFrame({
+        'contractSymbol': [symbol], 'lastTradeDate': [pd.Timestamp('2024-05-03 15:59', tz='UTC')],
+        'strike': [100.0], 'lastPrice': [price], 'bid': [price - 0.1], 'ask': [price + 0.1], 'change': [0.5],
+        'percentChange': [10.0], 'volume': [np.int64(12)], 'openInterest': [np.int64(340)],
+        'impliedVolatility': [0.25], 'inTheMoney': [True], 'contractSize': ['REGULAR'], 'currency': ['USD']
+    })
+
+
+class FakeStock:
+    ticker = 'AAA'
+
+    def get_option_chain(self):
+        return {'2024-06-21': OptionChain(make_chain('AAA240621C00100000', 5.0), make_chain('AAA240621P00100000', 2.0))}
+
+
+def test_option_chain_is_stored_and_buffered(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tick_store = TickBufferStore()
+    cache = OptionCache([], tick_store=tick_store)
+    cache.fetch_and_save_option_chain(FakeStock())
+
+    rows = sqlite3.connect(tmp_path / 'option_cache.db').execute(
+        "SELECT option_type, contractSymbol, lastTradeDate, lastPrice, volume, inTheMoney FROM option_chains "
+        "ORDER BY option_type").fetchall()
+    last_trade = int(pd.Timestamp('2024-05-03 15:59', tz='UTC').timestamp())
+    assert rows == [('call', 'AAA240621C00100000', last_trade, 5.0, 12, 1),
+                    ('put', 'AAA240621P00100000', last_trade, 2.0, 12, 1)]
+    assert tick_store.latest_prices().to_dict() == {'AAA240621C00100000': 5.0, 'AAA240621P00100000': 2.0}
+    cache.conn.close()
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from src.utils.pandas_utils import df_filter
+
+
+def make_frame():
+    return pd.DataFrame({
+        'Date': ['2023-09-01', '2023-09-01', '2023-09-04', '2023-09-05'],
+        'Sector': ['Tech', 'Energy', 'Tech', 'Tech'],
+        'Price': [10.0, 20.0, 30.0, 40.0],
+    })
+
+
+def test_combined_predicates():
+    df = make_frame()
+    result = df_filter(df, {'Sector': 'Tech', 'Price': slice(15, None), 'Date': None})
+    assert result.index.tolist() == [2, 3]
+    assert df_filter(df, {'Sector': ['Energy'], 'Price': lambda x: x > 5}).index.tolist() == [1]
+    assert df_filter(df, {'Date': slice('2023-09-02', '2023-09-04')}).index.tolist() == [2]
+    assert df_filter(df, None) is df
+
+    result.loc[2, 'Price'] = 0.0
+    assert df.loc[2, 'Price'] == 30.0
+
+
+def test_sorted_index_fast_path():
+    df = make_frame().set_index('Date')
+    day = df_filter(df, {'Date': '2023-09-01'}, view=True)
+    assert day['Price'].tolist() == [10.0, 20.0]
+    assert np.shares_memory(day['Price'].to_numpy(), df['Price'].to_numpy())
+
+    week = df_filter(df, {'Date': slice('2023-09-02', None), 'Sector': 'Tech'})
+    assert week['Price'].tolist() == [30.0, 40.0]
+    assert df_filter(df, {'Date': '2023-09-02'}).empty
@@ -0,0 +1,41 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from src.data.database.panel_store import PanelStore
+
+
+def make_history_quote(path):
+    dates = pd.bdate_range('2023-01-02', periods=5).strftime('%Y-%m-%d')
+    rows = []
+    for i, tic in enumerate(['600000', '000001', '300750']):
+        for j, dt in enumerate(dates):
+            if tic == '300750' and j == 2:
+                continue  # suspended
+            rows.append({'股票代码': tic, '日期': dt, '收盘': 10.0 * (i + 1) + j, '成交量': 1000 + j})
+    history = pd.DataFrame(rows)
+    conn = sqlite3.connect(path)
+    history.to_sql('history_quote', conn, index=False)
+    return conn, history
+
+
+def test_build_and_slice_panel_store(tmp_path):
+    conn, history = make_history_quote(tmp_path / 'ashare.db')
+    store = PanelStore.build(conn, tmp_path / 'panel', chunksize=4)
+    assert store.shape == (5, 3)
+
+    expected = history.pivot(index='日期', columns='股票代码', values='收盘')
+    expected.index = pd.to_datetime(expected.index)
+    pd.testing.assert_frame_equal(store.frame('close'), expected[store.tickers], check_names=False, check_index_type=False,
+                                  check_freq=False)
+
+    # reopened from disk, a ticker's history is a view on the memory map
+    reopened = PanelStore(tmp_path / 'panel')
+    series = reopened.series('close', '600000', start='2023-01-03')
+    assert isinstance(series.base, np.memmap) or isinstance(series, np.memmap)
+    np.testing.assert_array_equal(series, [11.0, 12.0, 13.0, 14.0])
+
+    returns = reopened.frame('returns', tickers=['300750'])['300750']
+    assert np.isnan(returns.iloc[2])
+    assert returns.iloc[3] == np.float32(33.0 / 31.0 - 1)
+    assert reopened.get('volume').dtype == np.float32
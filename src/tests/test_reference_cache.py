@@ -0,0 +1,55 @@
+import io
+import datetime
+import pandas as pd
+
+from src.meta.ashare_params import ReferenceCache
+
+
+class CsvSource:
+    """A local source counting how often it is fetched and parsed."""
+
+    def __init__(self, content):
+        self.content = content
+        self.fetches = 0
+        self.parses = 0
+        self.fail = False
+
+    def fetch(self):
+        self.fetches += 1
+        if self.fail:
+            raise ConnectionError('offline')
+        return self.content.encode('utf-8')
+
+    def parse(self, raw):
+        self.parses += 1
+        return pd.read_csv(io.BytesIO(raw), dtype={'证券代码': str})
+
+
+def test_snapshot_is_parsed_once_per_version(tmp_path):
+    source = CsvSource('证券代码,level_1\n000001,金融\n600000,金融\n')
+    cache = ReferenceCache(tmp_path)
+    first = cache.load('csi', source.fetch, source.parse)
+    assert first['证券代码'].tolist() == ['000001', '600000']
+
+    # unchanged content is hashed but not parsed again, also from a new process
+    second = ReferenceCache(tmp_path).load('csi', source.fetch, source.parse)
+    pd.testing.assert_frame_equal(first, second)
+    assert (source.fetches, source.parses) == (2, 1)
+
+    source.content += '300750,工业\n'
+    cache = ReferenceCache(tmp_path)
+    assert len(cache.load('csi', source.fetch, source.parse)) == 3
+    assert source.parses == 2
+    assert len(cache.manifest['csi']['versions']) == 2
+
+
+def test_max_age_and_offline_fallback(tmp_path):
+    source = CsvSource('证券代码,level_1\n000001,金融\n')
+    cache = ReferenceCache(tmp_path)
+    cache.load('csrc', source.fetch, source.parse, max_age=datetime.timedelta(days=7))
+    cache.load('csrc', source.fetch, source.parse, max_age=datetime.timedelta(days=7))
+    assert source.fetches == 1
+
+    source.fail = True
+    df = cache.load('csrc', source.fetch, source.parse, refresh=True)
+    assert df['证券代码'].tolist() == ['000001']
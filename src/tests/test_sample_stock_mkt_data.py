@@ -0,0 +1,105 @@
+import asyncio
+import datetime
+import numpy as np
+
+from src.data.database.db_manager import DBManager
+from src.data.equity_data.tick_buffer import TickBufferStore, TickFlusher
+from src.script.sample_stock_mkt_data import AsyncPriceSampler, Quote, write_market_price
+
+
+class FakeQuoteSource:
+    """A local quote feed: fixed prices, one ticker that errors and one that never answers in time."""
+
+    def __init__(self, prices, failing=(), slow=(), delay=1.0):
+        self.prices = prices
+        self.failing = set(failing)
+        self.slow = set(slow)
+        self.delay = delay
+        self.requests = []
+
+    async def get_quote(self, ticker):
+        self.requests.append(ticker)
+        if ticker in self.failing:
+            raise ConnectionError(f"feed down for {ticker}")
+        if ticker in self.slow:
+            await asyncio.sleep(self.delay)
+        return Quote(ticker, datetime.datetime.now(), self.prices.get(ticker, np.nan), 100.0)
+
+
+def test_sampler_batches_ticks_and_tracks_misses(tmp_path):
+    db_manager = DBManager(str(tmp_path / 'market'))
+    source = FakeQuoteSource({'AAA': 10.0, 'BBB': 20.0, 'SLOW': 30.0}, failing=['BAD'], slow=['SLOW'])
+    sampler = AsyncPriceSampler(['AAA', 'BBB', 'BAD', 'SLOW', 'NAN'], db_manager, quote_source=source,
+                                interval=0.05, timeout=0.02, batch_size=4)
+    asyncio.run(sampler.run(n_rounds=3))
+
+    rows = db_manager.query_data('market_price', ['ticker', 'price'])
+    assert sorted(rows) == [('AAA', 10.0)] * 3 + [('BBB', 20.0)] * 3
+    assert sampler.buffer == []
+
+    stats = sampler.get_stats()
+    assert stats.loc['AAA', 'samples'] == 3
+    assert stats.loc['BAD', 'missed'] >= 3
+    assert stats.loc['SLOW', 'missed'] >= 3
+    assert stats.loc['NAN', 'received'] == 3
+    assert stats.loc['NAN', 'samples'] == 0
+
+
+def test_sampler_with_tick_store_serves_memory_and_flushes_in_background(tmp_path):
+    db_manager = DBManager(str(tmp_path / 'market'))
+    tick_store = TickBufferStore(capacity=2)
+    source = FakeQuoteSource({'AAA': 10.0, 'BBB': 20.0})
+    sampler = AsyncPriceSampler(['AAA', 'BBB'], db_manager, quote_source=source, interval=0.01,
+                                tick_store=tick_store)
+    flusher = TickFlusher(tick_store, lambda ticks: write_market_price(db_manager, ticks), interval=0.01)
+    flusher.start()
+    asyncio.run(sampler.run(n_rounds=4))
+    flusher.stop()
+
+    assert tick_store.latest_prices().to_dict() == {'AAA': 10.0, 'BBB': 20.0}
+    assert len(tick_store.latest('AAA', 10)) == 2
+    assert tick_store.rolling_stats(2).loc['BBB', 'vwap'] == 20.0
+    rows = db_manager.query_data('market_price', ['ticker', 'volume'])
+    assert len(rows) + tick_store.dropped == 8
+    assert {volume for _, volume in rows} == {100.0}
+
+
+def test_failed_write_is_retried_without_stopping_the_sampler(tmp_path):
+    db_manager = DBManager(str(tmp_path / 'market'))
+    source = FakeQuoteSource({'AAA': 10.0})
+    sampler = AsyncPriceSampler(['AAA'], db_manager, quote_source=source, interval=0.01, batch_size=2)
+    write, failures = sampler._write, []
+
+    def flaky_write(quotes):
+        if not failures:
+            failures.append(len(quotes))
+            raise RuntimeError("database is locked")
+        write(quotes)
+
+    sampler._write = flaky_write
+    asyncio.run(sampler.run(n_rounds=4))
+
+    assert failures == [2]
+    assert sampler.buffer == []
+    assert len(db_manager.query_data('market_price', ['ticker'])) == 4
+
+
+def test_rows_failing_every_retry_are_dropped(tmp_path):
+    db_manager = DBManager(str(tmp_path / 'market'))
+    source = FakeQuoteSource({'AAA': 10.0, 'BAD': 20.0})
+    sampler = AsyncPriceSampler(['AAA', 'BAD'], db_manager, quote_source=source, interval=0.01, batch_size=2,
+                                max_retries=1)
+    write = sampler._write
+
+    def rejecting_write(quotes):
+        # a row the database always rejects, e.g. a duplicate key
+        if any(q.ticker == 'BAD' for q in quotes):
+            raise RuntimeError("UNIQUE constraint failed")
+        write(quotes)
+
+    sampler._write = rejecting_write
+    asyncio.run(sampler.run(n_rounds=4))
+
+    assert sampler.buffer == []
+    assert sampler.dropped == 4
+    assert sorted(db_manager.query_data('market_price', ['ticker'])) == [('AAA',)] * 4
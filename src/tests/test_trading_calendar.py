@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils.general_utils import get_previous_trading_day
+from src.utils.trading_calendar import get_calendar
+
+
+def test_us_calendar_queries():
+    calendar = get_calendar('US')
+    # Independence Day on a Tuesday, and a weekend
+    assert calendar.previous_trading_day('2023-07-05') == pd.Timestamp('2023-07-03')
+    assert calendar.next_trading_day('2023-07-01') == pd.Timestamp('2023-07-03')
+    assert not calendar.is_trading_day('2023-07-04')
+    assert get_previous_trading_day('2024-01-02') == '2023-12-29'
+    with pytest.raises(ValueError):
+        get_previous_trading_day('1990-01-01')
+    with pytest.raises(ValueError):
+        get_previous_trading_day('2040-01-02')
+
+    dates = pd.to_datetime(['2023-07-01', '2023-07-03', '2023-07-05'])
+    np.testing.assert_array_equal(calendar.offset(dates, 1), pd.to_datetime(['2023-07-03', '2023-07-05',
+                                                                             '2023-07-06']))
+    np.testing.assert_array_equal(calendar.offset(dates, 0), pd.to_datetime(['2023-06-30', '2023-07-03',
+                                                                             '2023-07-05']))
+    np.testing.assert_array_equal(calendar.month_end(pd.to_datetime(['2023-09-05', '2024-03-01'])),
+                                  pd.to_datetime(['2023-09-29', '2024-03-28']))
+    assert calendar.count_sessions('2023-06-30', '2023-07-07') == 4
+    assert pd.isna(calendar.previous_trading_day('1980-01-01'))
+
+
+def test_china_and_hong_kong_calendars():
+    # the National Day golden week closes Shanghai and Shenzhen; Hong Kong only closes on October 2nd
+    assert get_calendar('CN').next_trading_day('2023-09-28') == pd.Timestamp('2023-10-09')
+    assert get_calendar('HK').next_trading_day('2023-09-29') == pd.Timestamp('2023-10-03')
@@ -0,0 +1,66 @@
+import os
+import pandas as pd
+
+from src.data.equity_data.tv_snapshots import SnapshotStore
+
+
+def write_snapshot(raw_dir, file_name, tickers, prices, rating='Buy'):
+    pd.DataFrame({'Ticker': tickers, 'Description': 'name', 'Price': prices, 'Technical Rating': rating,
+                  'Market Capitalization': 1e9}).to_csv(raw_dir / file_name, index=False)
+
+
+def test_incremental_ingest_and_loads(tmp_path):
+    raw_dir = tmp_path / 'raw'
+    raw_dir.mkdir()
+    write_snapshot(raw_dir, 'china_2023-09-01.csv', ['000001', '600000'], [10.0, 7.0])
+    write_snapshot(raw_dir, 'china_2023-09-04_1130.csv', ['000001', '600000'], [10.5, 'N/A'])
+    write_snapshot(raw_dir, 'hongkong_2023-09-04.csv', ['0700'], [300.0], rating=None)
+    (raw_dir / 'notes.txt').write_text('not a snapshot')
+
+    store = SnapshotStore(raw_dir=raw_dir, root_dir=tmp_path / 'store')
+    assert store.ingest() == 3
+    assert store.ingest() == 0
+    assert store.available_dates() == ['2023-09-01', '2023-09-04']
+
+    day = store.load(dt='2023-09-04')
+    assert sorted(day['Ticker']) == ['000001', '0700', '600000']
+    assert set(day['Time']) == {'1130', 'close'}
+    assert day['Price'].dtype == 'float64'
+    assert day['Price'].isna().sum() == 1
+
+    # a new export is picked up without re-reading the old ones
+    write_snapshot(raw_dir, 'china_2023-09-05.csv', ['000001'], [11.0])
+    store = SnapshotStore(raw_dir=raw_dir, root_dir=tmp_path / 'store')
+    assert store.pending_files() == ['china_2023-09-05.csv']
+    store.ingest()
+    china = store.load(start='2023-09-04', end='2023-09-05', universe='CHINA', columns=['Ticker', 'Price', 'Date'])
+    assert list(china.columns) == ['Ticker', 'Price', 'Date']
+    assert sorted(china['Date'].unique()) == ['2023-09-04', '2023-09-05']
+    assert store.load(dt='2023-09-08') is None
+
+
+def test_materialized_metrics_are_joined_on_load(tmp_path):
+    raw_dir = tmp_path / 'raw'
+    raw_dir.mkdir()
+    write_snapshot(raw_dir, 'china_2023-09-01.csv', ['000001', '600000'], [10.0, 7.0])
+    write_snapshot(raw_dir, 'china_2023-09-04.csv', ['000001', '600000'], [12.0, 7.0])
+    store = SnapshotStore(raw_dir=raw_dir, root_dir=tmp_path / 'store')
+    store.ingest()
+
+    calls = []
+
+    def metrics(df):
+        calls.append(len(df))
+        return pd.DataFrame({'log_price': df['Price'].transform('log')}, index=df.index)
+
+    assert store.materialize('metrics', metrics, columns=['Price']) == 2
+    assert store.materialize('metrics', metrics, columns=['Price']) == 0
+    assert calls == [2, 2]
+
+    # derived files do not leak into the snapshot dataset
+    day = store.load(dt='2023-09-04', metrics='metrics')
+    assert len(day) == 2
+    assert day.set_index('Ticker')['log_price']['000001'] == pd.Series([12.0]).transform('log')[0]
+
+    panel = store.load_metrics('metrics', columns=['Ticker', 'Date', 'log_price'])
+    assert len(panel) == 4
@@ -1,3 +1,7 @@
+import logging
+from collections import namedtuple
+logger = logging.getLogger(__name__)
+
 import numpy as np
 import pandas as pd
 import datetime
@@ -8,9 +12,55 @@ def get_method_names(obj):
     return [attr for attr in dir(obj) if callable(getattr(obj, attr))]
 
 
+# strings standing for a missing value in screener and ETF holdings exports
+MISSING_VALUES = ['—', 'nan', 'none', 'null', 'n/a', 'N/A', 'None', 'NULL', 'NaN', 'NA']
+
+FloatConversion = namedtuple('FloatConversion', ['values', 'failed', 'counts'])
+
+
+def convert_series_to_float(values, multiplier=1.0, default=np.nan, missing_values=MISSING_VALUES, log=True):
+    """
+    Converts a whole Series or array to floats with vectorized string operations, applying a multiplier if provided.
+
+    Args:
+        values: The Series, array or list to be converted.
+        multiplier: Optional. The multiplier to be applied to the converted values. Default is 1.0.
+        default: Optional. The value given to the missing-value strings and to the failed conversions. Default is np.nan.
+        missing_values: Optional. The strings standing for a missing value.
+        log: Optional. Whether to log the failures. Default is True.
+
+    Returns:
+        A FloatConversion of the float array, the mask of the values that failed to convert, and the counts of
+        converted, missing and failed values. Failures are logged once, with a few examples.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        floats = series.to_numpy(dtype=float, na_value=np.nan) * multiplier
+        failed = np.zeros(len(series), dtype=bool)
+        missing = np.isnan(floats)
+    else:
+        text = series.astype('string')
+        sentinel = text.isin(missing_values).to_numpy(dtype=bool, na_value=False)
+        cleaned = text.str.replace(',', '', regex=False).str.strip()
+        floats = pd.to_numeric(cleaned, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        failed = np.isnan(floats) & text.notna().to_numpy(dtype=bool) & ~sentinel
+        missing = text.isna().to_numpy(dtype=bool) | sentinel
+        floats = floats * multiplier
+        floats[sentinel | failed] = default
+
+    counts = {'total': len(series), 'converted': int((~missing & ~failed).sum()), 'missing': int(missing.sum()),
+              'failed': int(failed.sum())}
+    if log and counts['failed'] > 0:
+        examples = series[failed].astype(str).unique()[:5].tolist()
+        logger.warning(f"Failed to convert {counts['failed']} of {counts['total']} values to float, e.g. {examples}")
+    return FloatConversion(floats, failed, counts)
+
+
 def convert_to_float(x, multiplier=1.0, default=np.nan):
     """
-    Converts the input value to a float, applying a multiplier if provided.
+    Converts the input value to a float, applying a multiplier if provided, with the string rules of
+    convert_series_to_float. Failures are not logged, use convert_series_to_float for whole columns, which logs them
+    once per column.
 
     Args:
         x: The value to be converted.
@@ -20,19 +70,16 @@ def convert_to_float(x, multiplier=1.0, default=np.nan):
     Returns:
         The converted float value, multiplied by the multiplier if provided. If the conversion fails, returns the default value.
     """
-    if isinstance(x, float):
-        return x * multiplier
-    elif isinstance(x, int):
+    if isinstance(x, (int, float, np.number)):
         return float(x) * multiplier
-    elif isinstance(x, str):
-        # remove bad values and convert to float np.nan
-        if x in ['—','nan','none','null','n/a','N/A','None','NULL','NaN','NA']:
-            return default
-        try:
-            return float(x.replace(',','')) * multiplier
-        except Exception as e:
-            print(f'Failed to convert {x} to float: {e}')
+    if isinstance(x, str):
+        if x in MISSING_VALUES:
             return default
+        x = x.replace(',', '')
+    try:
+        return float(x) * multiplier
+    except (TypeError, ValueError):
+        return default
 
 
 def check_group_by_input(func):
@@ -85,21 +132,25 @@ def assign_market_cap_group(x):
         return "N/A"
     
 
-def get_previous_trading_day(date):
+def get_previous_trading_day(date, market='US'):
     """
     Returns the previous trading day before the given date.
 
     Parameters:
     date (str or datetime): The date for which to find the previous trading day.
+    market (str): 'US', 'CN' or 'HK', see utils.trading_calendar.
 
     Returns:
     str: The previous trading day in ISO format (YYYY-MM-DD).
+
+    Raises:
+    ValueError: If there is no trading day before the date within the calendar range.
     """
-    date = pd.to_datetime(date)
-    import holidays
-    us_holidays = [pd.to_datetime(dt) for dt in holidays.US(years=date.year).keys()]
-    while True:
-        date = date - pd.Timedelta(days=1)
-        day = date.day_of_week
-        if day < 5 and date not in us_holidays:
-            return date.date().isoformat()
\ No newline at end of file
+    from src.utils.trading_calendar import get_calendar
+    calendar = get_calendar(market)
+    previous_day = calendar.previous_trading_day(date)
+    # past the end of the calendar, the sessions between its end and the date are unknown
+    if pd.isna(previous_day) or pd.Timestamp(date) > pd.Timestamp(calendar.end) + pd.Timedelta(days=1):
+        raise ValueError(f"No {market} trading day before {date} within the calendar range "
+                         f"{calendar.start} to {calendar.end}")
+    return previous_day.date().isoformat()
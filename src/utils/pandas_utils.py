@@ -1,17 +1,75 @@
+import numpy as np
 import pandas as pd
 
 
-def df_filter(df, filter_dict=None):
+def _predicate_mask(values, predicate) -> np.ndarray:
+    """
+    Boolean mask of one filter predicate:
+        list, tuple, set, array or Index: membership
+        slice(lo, hi): range, both ends inclusive, either end may be None
+        callable: called on the column, returns a boolean mask
+        anything else: equality
+    """
+    if callable(predicate):
+        return np.asarray(predicate(values), dtype=bool)
+    if isinstance(predicate, slice):
+        mask = np.ones(len(values), dtype=bool)
+        if predicate.start is not None:
+            mask &= np.asarray(values >= predicate.start, dtype=bool)
+        if predicate.stop is not None:
+            mask &= np.asarray(values <= predicate.stop, dtype=bool)
+        return mask
+    if isinstance(predicate, (list, tuple, set, np.ndarray, pd.Index)):
+        return np.asarray(values.isin(list(predicate)), dtype=bool)
+    return np.asarray(values == predicate, dtype=bool)
+
+
+def _index_slice(df, key, predicate):
+    """
+    Positions of a scalar or range predicate on a sorted single-level index, found by binary search.
+    :return: a (start, stop) pair, or None when the fast path does not apply
+    """
+    index = df.index
+    if isinstance(index, pd.MultiIndex) or index.name != key or key in df.columns or not index.is_monotonic_increasing:
+        return None
+    if isinstance(predicate, slice) and predicate.step is None:
+        return index.slice_locs(predicate.start, predicate.stop)
+    if not callable(predicate) and not isinstance(predicate, (slice, list, tuple, set, np.ndarray, pd.Index)):
+        return index.searchsorted(predicate, side='left'), index.searchsorted(predicate, side='right')
+    return None
+
+
+def df_filter(df, filter_dict=None, view=False):
+    """
+    Filter the rows of a dataframe with all the predicates of filter_dict combined into a single mask.
+    :param df: the dataframe to be filtered
+    :param filter_dict: column (or index level) name -> predicate, see _predicate_mask; None predicates are skipped
+    :param view: when True, a filter on a sorted index alone returns a slice of df instead of a copy, and no defensive
+        copy is made; the result must then be treated as read-only
+    :return: the filtered dataframe
+    """
     if filter_dict is None:
         return df
-    df = df.copy()
-    for column, value in filter_dict.items():
-        if value is not None:
-            if isinstance(value, list) or isinstance(value, tuple):
-                df = df[df[column].isin(value)]
-            else:
-                df = df[df[column] == value]
-    return df
+    start, stop = 0, len(df)
+    mask = None
+    for key, predicate in filter_dict.items():
+        if predicate is None:
+            continue
+        locs = _index_slice(df, key, predicate)
+        if locs is not None:
+            start, stop = max(start, locs[0]), min(stop, locs[1])
+            continue
+        values = df[key] if key in df.columns else df.index.get_level_values(key)
+        key_mask = _predicate_mask(values, predicate)
+        mask = key_mask if mask is None else mask & key_mask
+
+    stop = max(start, stop)
+    if mask is None:
+        output = df.iloc[start:stop]
+        return output if view else output.copy()
+    positions = start + np.flatnonzero(mask[start:stop])
+    # take returns a new frame, not a chained-indexing copy of df
+    return df.take(positions)
 
 
 def set_cols_numeric(df, cols):
@@ -1,5 +1,6 @@
 import streamlit as st
 import pandas as pd
+from src.utils.pandas_utils import df_filter
 
 def filter_dataframe(df, default_cols=None, key=None):
 
@@ -35,10 +36,13 @@ def filter_dataframe(df, default_cols=None, key=None):
     columns_to_show = st.multiselect("Select columns to display", df.columns.tolist(), default=default_cols)
 
     # Apply filters
-    filtered_df = df.copy()
+    filter_dict = {}
     for filter_info in st.session_state[f"filter_list_{key}"]:
-        if filter_info['column'] and filter_info['values']:
-            filtered_df = filtered_df[filtered_df[filter_info['column']].isin(filter_info['values'])]
+        col, values = filter_info['column'], filter_info['values']
+        if col and values:
+            # two filters on the same column keep the values selected in both
+            filter_dict[col] = [v for v in filter_dict[col] if v in values] if col in filter_dict else list(values)
+    filtered_df = df_filter(df, filter_dict)
 
     # Show selected columns of the filtered dataframe
     return filtered_df[columns_to_show]
\ No newline at end of file
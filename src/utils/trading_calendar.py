@@ -0,0 +1,127 @@
+import functools
+import numpy as np
+import pandas as pd
+import holidays
+
+
+# exchange calendars of the holidays package, by market
+MARKET_EXCHANGES = {
+    'US': 'XNYS',
+    'CN': 'XSHG',  # SSE and SZSE share their closing days
+    'HK': 'XHKG',
+}
+# public holidays used when the installed holidays package has no calendar for the exchange
+MARKET_COUNTRIES = {
+    'US': 'US',
+    'CN': 'CN',
+    'HK': 'HK',
+}
+
+
+def _market_holidays(market: str, years) -> np.ndarray:
+    try:
+        calendar = holidays.financial_holidays(MARKET_EXCHANGES[market], years=years)
+    except (AttributeError, NotImplementedError, KeyError):
+        calendar = holidays.country_holidays(MARKET_COUNTRIES[market], years=years)
+    return np.array(sorted(calendar.keys()), dtype='datetime64[D]')
+
+
+class TradingCalendar:
+    """
+    Trading days of one market over a fixed range of years, held as a sorted datetime64[D] array. Every query takes a
+    single date or a whole array of dates and is answered with searchsorted on that array.
+
+    Scalar inputs return a pd.Timestamp, array-like inputs a pd.DatetimeIndex. Dates falling outside of the range
+    give NaT.
+    """
+
+    def __init__(self, market: str = 'US', start: str = '1990-01-01', end: str = '2035-12-31'):
+        self.market = market
+        self.start = np.datetime64(start, 'D')
+        self.end = np.datetime64(end, 'D')
+        years = range(pd.Timestamp(start).year, pd.Timestamp(end).year + 1)
+        self.holidays = _market_holidays(market, years)
+        days = np.arange(self.start, self.end + 1, dtype='datetime64[D]')
+        self.sessions = days[np.is_busday(days, holidays=self.holidays)]
+
+    def __repr__(self):
+        return f"TradingCalendar({self.market}, {self.start} to {self.end}, {len(self.sessions)} sessions)"
+
+    @staticmethod
+    def _to_days(dates):
+        is_scalar = np.ndim(dates) == 0
+        days = pd.DatetimeIndex(pd.to_datetime([dates] if is_scalar else dates)).values.astype('datetime64[D]')
+        return days, is_scalar
+
+    def _take(self, positions, is_scalar, valid=None):
+        positions = np.asarray(positions)
+        valid = (positions >= 0) & (positions < len(self.sessions)) if valid is None else valid
+        output = np.full(positions.shape, np.datetime64('NaT'), dtype='datetime64[D]')
+        output[valid] = self.sessions[positions[valid]]
+        output = pd.DatetimeIndex(output)
+        return output[0] if is_scalar else output
+
+    def is_trading_day(self, dates):
+        days, is_scalar = self._to_days(dates)
+        positions = np.searchsorted(self.sessions, days, side='left')
+        found = positions < len(self.sessions)
+        found[found] = self.sessions[positions[found]] == days[found]
+        return bool(found[0]) if is_scalar else found
+
+    def previous_trading_day(self, dates):
+        """
+        The last trading day strictly before each date
+        """
+        days, is_scalar = self._to_days(dates)
+        return self._take(np.searchsorted(self.sessions, days, side='left') - 1, is_scalar)
+
+    def next_trading_day(self, dates):
+        """
+        The first trading day strictly after each date
+        """
+        days, is_scalar = self._to_days(dates)
+        return self._take(np.searchsorted(self.sessions, days, side='right'), is_scalar)
+
+    def offset(self, dates, n: int):
+        """
+        Move each date by n trading days. A date that is not a trading day first rolls back to the previous trading day,
+        so offset(saturday, 1) is the next monday and offset(saturday, 0) the friday before.
+        """
+        days, is_scalar = self._to_days(dates)
+        positions = np.searchsorted(self.sessions, days, side='right') - 1
+        valid = (positions >= 0) & (positions + n >= 0) & (positions + n < len(self.sessions))
+        return self._take(positions + n, is_scalar, valid)
+
+    def month_end(self, dates):
+        """
+        The last trading day of the month of each date
+        """
+        days, is_scalar = self._to_days(dates)
+        next_month = (days.astype('datetime64[M]') + 1).astype('datetime64[D]')
+        return self._take(np.searchsorted(self.sessions, next_month, side='left') - 1, is_scalar)
+
+    def sessions_in_range(self, start, end) -> pd.DatetimeIndex:
+        """
+        The trading days between start and end, both inclusive
+        """
+        start, end = np.datetime64(pd.Timestamp(start).date(), 'D'), np.datetime64(pd.Timestamp(end).date(), 'D')
+        return pd.DatetimeIndex(self.sessions[np.searchsorted(self.sessions, start, side='left'):
+                                              np.searchsorted(self.sessions, end, side='right')])
+
+    def count_sessions(self, start_dates, end_dates):
+        """
+        Number of trading days in (start, end] for each pair of dates
+        """
+        start_days, _ = self._to_days(start_dates)
+        end_days, is_scalar = self._to_days(end_dates)
+        counts = (np.searchsorted(self.sessions, end_days, side='right')
+                  - np.searchsorted(self.sessions, start_days, side='right'))
+        return int(counts[0]) if is_scalar else counts
+
+
+@functools.lru_cache(maxsize=None)
+def get_calendar(market: str = 'US') -> TradingCalendar:
+    """
+    The shared calendar of a market: 'US' (NYSE), 'CN' (SSE/SZSE) or 'HK' (HKEX)
+    """
+    return TradingCalendar(market)